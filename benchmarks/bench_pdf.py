@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Micro-benchmark de la génération d'un bon de livraison PDF.
+
+Mesure le débit (PDF par seconde) pour un bon unique, avec l'ancienne
+construction des styles à chaque appel (feuille de style et TableStyle
+recréés) et avec les styles pré-construits de ``PDFGenerator``.
+Les PDF sont écrits en mémoire pour ne mesurer que reportlab.
+
+Usage : python benchmarks/bench_pdf.py [nombre_de_pdf]
+"""
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# main.py crée sa base, ses dossiers et ses fichiers de licence à l'import :
+# le benchmark travaille dans un dossier temporaire, jamais sur les vraies données.
+WORK_DIR = tempfile.mkdtemp(prefix="bench_pdf_")
+atexit.register(shutil.rmtree, WORK_DIR, True)
+os.environ["AHABIA_DATA_DIR"] = os.path.join(WORK_DIR, "AHABIAFILES")
+os.environ["HOME"] = os.environ["APPDATA"] = os.path.join(WORK_DIR, "home")
+os.makedirs(os.environ["HOME"])
+
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, LongTable, TableStyle
+from reportlab.lib import colors
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.enums import TA_JUSTIFY, TA_CENTER
+
+import main
+
+
+def sample_data():
+    row = {
+        "Numéro Bon": "BL01062025ENNA01",
+        "Date (JJ/MM/AAAA)": "01/06/2025",
+        "Agriculteur": "Ennajihi Nawfal",
+        "Parcelle": "P12",
+        "Produit": "Fraise",
+        "Variété": "Festival",
+        "Nb Ouvriers Cueilleurs": 24,
+        "Nb Ouvriers Indirect": 3,
+        "Nb Ouvriers Autres": 1,
+        "Total Ouvriers": 28,
+        "Nombre Caporaux": 2,
+        "Poids Total Cueillis (kg)": 1250.5,
+        "Écarts (Produit Déchet) en kg": 32.0,
+        "Poids Global": 1282.5,
+    }
+    return main.delivery_pdf_data(row, main.DEFAULT_FRUIT)
+
+
+def generate_delivery_pdf_per_call(data, pdf_path):
+    """Ancienne version : styles et TableStyle reconstruits à chaque PDF."""
+    doc = main.PDFGenerator.document(pdf_path)
+    styles = getSampleStyleSheet()
+    styles["Normal"].fontSize = 14
+    styles["Normal"].alignment = TA_JUSTIFY
+    styles["Title"].fontSize = 14
+    styles["Title"].alignment = TA_CENTER
+    styles["Heading2"].fontSize = 14
+    styles["Heading2"].alignment = TA_CENTER
+    elements = [
+        Paragraph("Gestion des Récoltes de " + data.get("fruit", "FRUIT") + " ENNAJIHI NAWFAL", styles['Title']),
+        Spacer(1, 12),
+        Paragraph(data['num_bon'], styles['Heading2']),
+        Spacer(1, 12),
+    ]
+    table_data = [["Champ", "Valeur"]] + [[field, str(val)] for field, val in data['fields']]
+    usable_width = main.PDFGenerator.geometry()[2]
+    table = LongTable(table_data, colWidths=[0.4 * usable_width, 0.6 * usable_width], repeatRows=1)
+    table.hAlign = 'CENTER'
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.darkblue),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 14),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.whitesmoke, colors.beige]),
+        ('GRID', (0, 0), (-1, -1), 1, colors.grey)
+    ]))
+    elements.append(table)
+    doc.build(elements)
+
+
+def throughput(generate, data, number):
+    generate(data, BytesIO())  # échauffement (polices, caches reportlab)
+    start = time.perf_counter()
+    for _ in range(number):
+        generate(data, BytesIO())
+    return number / (time.perf_counter() - start)
+
+
+def run(number=200):
+    data = sample_data()
+    before = throughput(generate_delivery_pdf_per_call, data, number)
+    after = throughput(main.PDFGenerator.generate_delivery_pdf, data, number)
+    print(f"{'version':<28}{'PDF/s':>10}")
+    print(f"{'styles recréés à chaque PDF':<28}{before:>10.1f}")
+    print(f"{'styles pré-construits':<28}{after:>10.1f}")
+    print(f"gain : {after / before:.2f}x")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""Mesure du démarrage à froid de l'application (``import main``).
+
+Lance ``python -X importtime -c "import main"`` dans des processus neufs, sur
+une copie de main.py placée dans un répertoire temporaire (base SQLite et
+dossiers AHABIAFILES créés à neuf, comme sur un déploiement serverless), puis
+compare le résultat au budget suivi dans ``startup_budget.json`` :
+
+- durée cumulée de ``import main`` (médiane des exécutions) ;
+- modules lourds qui ne doivent pas être chargés au démarrage
+  (ils sont importés dans les fonctions qui s'en servent).
+
+Le code de sortie est 1 si le budget est dépassé.
+
+Usage : python benchmarks/bench_startup.py [nombre_d_executions]
+"""
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+BUDGET_FILE = os.path.join(BENCH_DIR, "startup_budget.json")
+
+
+def import_profile(work_dir, code="import main"):
+    """Renvoie {module: durée cumulée en µs} pour ``code`` exécuté dans un processus neuf."""
+    env = dict(os.environ, HOME=work_dir, PYTHONDONTWRITEBYTECODE="1")
+    env.pop("PYTHONPATH", None)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=work_dir, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"{code} a échoué :\n{result.stderr[-2000:]}")
+    profile = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        try:
+            cumulative = int(parts[1])
+        except ValueError:
+            continue  # ligne d'en-tête
+        profile[parts[2].strip()] = cumulative
+    return profile
+
+
+def run(runs=5):
+    with open(BUDGET_FILE, encoding="utf-8") as f:
+        budget = json.load(f)
+    work_dir = tempfile.mkdtemp(prefix="bench_startup_")
+    try:
+        shutil.copy(os.path.join(ROOT_DIR, "main.py"), work_dir)
+        # Modules déjà chargés par l'interpréteur lui-même (site, .pth...), hors de main
+        baseline = set(import_profile(work_dir, "pass"))
+        # Première exécution : base et dossiers inexistants (vrai démarrage à froid)
+        profiles = [import_profile(work_dir) for _ in range(runs + 1)]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    first_ms = profiles[0]["main"] / 1000
+    median_ms = statistics.median(p["main"] for p in profiles[1:]) / 1000
+    loaded = sorted({name.split(".")[0] for p in profiles for name in p if name not in baseline})
+    forbidden = [name for name in budget["modules_interdits"] if name in loaded]
+
+    print(f"import main (base neuve)      : {first_ms:8.1f} ms")
+    print(f"import main (médiane, {runs} exéc.) : {median_ms:8.1f} ms   budget {budget['import_main_ms']} ms")
+    print("modules les plus coûteux :")
+    last = profiles[-1]
+    top = sorted((name for name in last if name != "main" and "." not in name and name not in baseline),
+                 key=last.get, reverse=True)[:10]
+    for name in top:
+        print(f"  {name:<30}{last[name] / 1000:8.1f} ms")
+
+    ok = True
+    if median_ms > budget["import_main_ms"]:
+        print(f"ÉCHEC : démarrage {median_ms:.1f} ms > budget {budget['import_main_ms']} ms")
+        ok = False
+    if forbidden:
+        print("ÉCHEC : modules lourds chargés au démarrage : " + ", ".join(forbidden))
+        ok = False
+    if ok:
+        print("Budget de démarrage respecté.")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run(int(sys.argv[1]) if len(sys.argv) > 1 else 5) else 1)
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""Micro-benchmark du rendu des pages.
+
+Compare, pour chaque page, le coût d'un rendu avec ``render_template_string``
+(la source est recompilée à chaque appel, comme avant) et avec
+``render_template`` (modèle compilé une fois puis mis en cache par Jinja).
+
+Usage : python benchmarks/bench_templates.py [nombre_de_rendus]
+"""
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# main.py crée sa base, ses dossiers et ses fichiers de licence à l'import :
+# le benchmark travaille dans un dossier temporaire, jamais sur les vraies données.
+WORK_DIR = tempfile.mkdtemp(prefix="bench_templates_")
+atexit.register(shutil.rmtree, WORK_DIR, True)
+os.environ["AHABIA_DATA_DIR"] = os.path.join(WORK_DIR, "AHABIAFILES")
+os.environ["HOME"] = os.environ["APPDATA"] = os.path.join(WORK_DIR, "home")
+os.makedirs(os.environ["HOME"])
+
+import pandas as pd
+from flask import render_template, render_template_string
+
+import main
+
+
+def page_contexts():
+    theme = main.fruit_themes[main.DEFAULT_FRUIT]
+    common = {"theme": theme, "current_fruit": main.DEFAULT_FRUIT}
+    return {
+        "saisie.html": dict(common, now_str="01/01/2025", fruit_themes=main.fruit_themes),
+        "bons.html": dict(
+            common,
+            column_order=main.column_order,
+            column_abbr=main.column_abbr,
+            rows=[],
+            pagination={"page": 1, "page_count": 1, "per_page": 50, "total": 0, "q": "", "tri": "", "ordre": "asc"},
+        ),
+        "stats.html": dict(
+            common,
+            all_columns_extended=main.all_columns_extended,
+            graph_column="Poids Total Cueillis (kg)",
+            x_axis="Date (JJ/MM/AAAA)",
+            selected_checkboxes=[],
+            group_data=pd.DataFrame({"Date (JJ/MM/AAAA)": [], "Poids Total Cueillis (kg)": []}),
+            bar_img=None,
+            pie_img=None,
+            selected_stats={},
+        ),
+        "historique.html": dict(
+            common,
+            report_history=[],
+            pagination={"page": 1, "page_count": 1, "per_page": 50, "total": 0, "q": "", "debut": "", "fin": ""},
+        ),
+        "change_theme.html": {"fruit_themes": main.fruit_themes, "current_fruit": main.DEFAULT_FRUIT},
+    }
+
+
+def run(number=200):
+    print(f"{'page':<20}{'avant (µs)':>14}{'après (µs)':>14}{'gain':>8}")
+    with main.app.test_request_context("/"):
+        for name, context in page_contexts().items():
+            source = main.PAGE_TEMPLATES[name]
+            render_template(name, **context)  # compilation initiale
+            before = timeit.timeit(lambda: render_template_string(source, **context), number=number)
+            after = timeit.timeit(lambda: render_template(name, **context), number=number)
+            before_us = before / number * 1e6
+            after_us = after / number * 1e6
+            print(f"{name:<20}{before_us:>14.1f}{after_us:>14.1f}{before_us / after_us:>7.1f}x")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -2,37 +2,48 @@
 import os
 import sys
 import json
+import csv
 import uuid
 import hashlib
 import platform
 import datetime
-import pandas as pd
-import requests  # Pour l'API PayPal
+import time
+import re
+import glob
+import shutil
+import tempfile
+import zipfile
+import functools
+import sqlite3
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 
 from flask import (
     Flask, request, redirect, url_for, flash, send_file,
-    render_template_string
+    render_template, jsonify, Response
 )
-from openpyxl import Workbook, load_workbook
+from jinja2 import DictLoader, FileSystemBytecodeCache
+from markupsafe import Markup
+import click
+from io import BytesIO, StringIO
 
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
-from io import BytesIO
-import base64  # AJOUTÉ pour encoder les images en base64
-
-from reportlab.platypus import (
-    SimpleDocTemplate, Paragraph, Spacer, LongTable, TableStyle, Table, Image, PageBreak
-)
-from reportlab.lib.pagesizes import A4, landscape
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib.enums import TA_JUSTIFY, TA_CENTER
-from reportlab.lib.units import cm
+# pandas, matplotlib, openpyxl, requests et reportlab sont importés dans les
+# fonctions qui s'en servent : un démarrage à froid (Vercel, nouveau worker
+# gunicorn) ne paie que ce que la première requête utilise réellement.
+# Budget suivi par benchmarks/bench_startup.py.
 
 app = Flask(__name__)
 app.secret_key = "UNE_SUPER_CLE_SECRETE_FLASK"
 
+# Pages HTML enregistrées par nom (PAGE_TEMPLATES["..."] avant chaque route) :
+# Jinja les compile une seule fois par worker au lieu de le faire à chaque requête.
+PAGE_TEMPLATES = {}
+app.jinja_loader = DictLoader(PAGE_TEMPLATES)
+
 # =============================================================================
 # Partie Activation & Administration
 # =============================================================================
@@ -40,6 +51,7 @@ app.secret_key = "UNE_SUPER_CLE_SECRETE_FLASK"
 # --- Paramètres d'activation ---
 SECRET_SALT = "VOTRE_SEL_SECRET_UNIQUE"  # Remplacez par votre sel secret unique
 
+@functools.lru_cache(maxsize=None)
 def get_hardware_id():
     hardware_id = str(uuid.getnode())
     return hashlib.sha256(hardware_id.encode()).hexdigest()[:16]
@@ -57,8 +69,56 @@ else:
     ACTIVATION_DIR = os.path.join(os.path.expanduser('~'), '.systemdata')
 os.makedirs(ACTIVATION_DIR, exist_ok=True)
 ACTIVATION_FILE = os.path.join(ACTIVATION_DIR, 'activation3264.json')
+TRIAL_FILE = os.path.join(ACTIVATION_DIR, 'windows32')
+
+# =============================================================================
+# Cache de l'état de licence (hooks before_request)
+# =============================================================================
+
+# Les deux hooks before_request s'exécutent à chaque requête (y compris les
+# graphiques et PDF) : leur résultat est mémorisé et n'est recalculé qu'après
+# LICENCE_CACHE_TTL secondes si le fichier concerné a changé (mtime/taille)
+# ou si la date du jour a changé.
+LICENCE_CACHE_TTL = 30
+_licence_cache = {}
+_licence_cache_lock = threading.Lock()
+
+def _file_signature(path):
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+def _cached_licence_check(name, path, compute):
+    now = time.monotonic()
+    entry = _licence_cache.get(name)
+    if entry is not None and now < entry["expires"]:
+        return entry["result"]
+    with _licence_cache_lock:
+        entry = _licence_cache.get(name)
+        today = datetime.date.today()
+        signature = _file_signature(path)
+        if entry is not None and signature is not None and entry["signature"] == signature and entry["day"] == today:
+            entry["expires"] = now + LICENCE_CACHE_TTL
+            return entry["result"]
+        result = compute()
+        _licence_cache[name] = {
+            "result": result,
+            "signature": _file_signature(path),
+            "day": today,
+            "expires": now + LICENCE_CACHE_TTL
+        }
+        return result
+
+def invalidate_licence_cache():
+    with _licence_cache_lock:
+        _licence_cache.clear()
 
 def check_activation():
+    return _cached_licence_check("activation", ACTIVATION_FILE, _evaluate_activation)
+
+def _evaluate_activation():
     if not os.path.exists(ACTIVATION_FILE):
         activation_data = {
             "plan": "essai_7jours",
@@ -101,20 +161,21 @@ def update_activation_after_payment(plan):
     }
     with open(ACTIVATION_FILE, "w", encoding="utf-8") as f:
         json.dump(data, f)
+    invalidate_licence_cache()
 
 # =============================================================================
 # Nouvelle fonctionnalité : Contrôle de la période d'essai
 # =============================================================================
 
 def check_trial_period():
-    if platform.system() == "Windows":
-        hidden_folder = os.path.join(os.environ.get('APPDATA'), 'SystemData')
-        os.makedirs(hidden_folder, exist_ok=True)
-        file_path = os.path.join(hidden_folder, 'windows32')
-    else:
-        hidden_folder = os.path.join(os.path.expanduser('~'), '.systemdata')
-        os.makedirs(hidden_folder, exist_ok=True)
-        file_path = os.path.join(hidden_folder, 'windows32')
+    ok, message = _cached_licence_check("essai", TRIAL_FILE, _evaluate_trial_period)
+    if message:
+        flash(message, "error")
+    return ok
+
+def _evaluate_trial_period():
+    """Renvoie (valide, message d'erreur éventuel) sans dépendre de la requête."""
+    file_path = TRIAL_FILE
     from datetime import datetime
     if os.path.exists(file_path):
         try:
@@ -122,16 +183,13 @@ def check_trial_period():
                 stored_date_str = f.read().strip()
             stored_date = datetime.strptime(stored_date_str, '%Y-%m-%d')
         except Exception as e:
-            flash("Le fichier de licence est corrompu. Veuillez contacter le support.", "error")
-            return False
+            return False, "Le fichier de licence est corrompu. Veuillez contacter le support."
         if stored_date > datetime.now():
-            flash("Le fichier de licence est corrompu ou la date système a été modifiée.", "error")
-            return False
+            return False, "Le fichier de licence est corrompu ou la date système a été modifiée."
         days_passed = (datetime.now() - stored_date).days
         if days_passed > 150:
-            flash("La période d'essai de 7 jours est terminée.<br>Contactez sastoukadigital@gmail.com ou Whatsapp au +212652084735.", "error")
-            return False
-        return True
+            return False, "La période d'essai de 7 jours est terminée.<br>Contactez sastoukadigital@gmail.com ou Whatsapp au +212652084735."
+        return True, None
     else:
         current_date_str = datetime.now().strftime('%Y-%m-%d')
         try:
@@ -146,9 +204,8 @@ def check_trial_period():
             else:
                 os.chmod(file_path, 0)
         except Exception as e:
-            flash("Impossible de créer le fichier de licence.", "error")
-            return False
-        return True
+            return False, "Impossible de créer le fichier de licence."
+        return True, None
 
 @app.before_request
 def enforce_trial_period():
@@ -156,39 +213,46 @@ def enforce_trial_period():
         if not check_trial_period():
             return redirect(url_for("trial_expired"))
 
+PAGE_TEMPLATES["trial_expired.html"] = """
+<!DOCTYPE html>
+<html lang="fr">
+<head>
+  <meta charset="UTF-8"/>
+  <title>Période d'essai expirée</title>
+  <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css" rel="stylesheet">
+</head>
+<body class="bg-light">
+  <div class="container my-5">
+    <div class="alert alert-danger" role="alert">
+      La période d'essai de 7 jours est terminée.<br>
+      Veuillez contacter <a href="mailto:sastoukadigital@gmail.com">sastoukadigital@gmail.com</a> ou Whatsapp au +212652084735.
+    </div>
+  </div>
+</body>
+</html>
+"""
+
 @app.route("/trial_expired")
 def trial_expired():
-    return render_template_string("""
-    <!DOCTYPE html>
-    <html lang="fr">
-    <head>
-      <meta charset="UTF-8"/>
-      <title>Période d'essai expirée</title>
-      <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css" rel="stylesheet">
-    </head>
-    <body class="bg-light">
-      <div class="container my-5">
-        <div class="alert alert-danger" role="alert">
-          La période d'essai de 7 jours est terminée.<br>
-          Veuillez contacter <a href="mailto:sastoukadigital@gmail.com">sastoukadigital@gmail.com</a> ou Whatsapp au +212652084735.
-        </div>
-      </div>
-    </body>
-    </html>
-    """)
+    return render_template("trial_expired.html")
 
 # =============================================================================
 # Partie Fichiers, Thèmes, Numéros de bons, PDF (inchangés)
 # =============================================================================
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-AHABIAFILES_DIR = os.path.join(BASE_DIR, "AHABIAFILES")
+# AHABIA_DATA_DIR permet de placer les données ailleurs (volume, tests...)
+AHABIAFILES_DIR = os.environ.get("AHABIA_DATA_DIR") or os.path.join(BASE_DIR, "AHABIAFILES")
 EXCEL_DIR = os.path.join(AHABIAFILES_DIR, "Excel")
 PDF_LIVRAISON_DIR = os.path.join(AHABIAFILES_DIR, "PDF_Livraison")
 PDF_STATS_DIR = os.path.join(AHABIAFILES_DIR, "PDF_Stats")
-for d in [AHABIAFILES_DIR, EXCEL_DIR, PDF_LIVRAISON_DIR, PDF_STATS_DIR]:
+JINJA_CACHE_DIR = os.path.join(AHABIAFILES_DIR, "cache", "jinja")
+for d in [AHABIAFILES_DIR, EXCEL_DIR, PDF_LIVRAISON_DIR, PDF_STATS_DIR, JINJA_CACHE_DIR]:
     os.makedirs(d, exist_ok=True)
 
+# Le bytecode compilé des pages est conservé sur disque entre les démarrages
+app.jinja_options = dict(app.jinja_options, bytecode_cache=FileSystemBytecodeCache(JINJA_CACHE_DIR))
+
 VOUCHER_FILE = os.path.join(AHABIAFILES_DIR, "last_voucher.txt")
 USER_THEME_FILE = os.path.join(AHABIAFILES_DIR, "user_theme.json")
 
@@ -203,20 +267,35 @@ fruit_themes = {
 }
 DEFAULT_FRUIT = "Myrtille"
 
+# Thème mémorisé en mémoire ; la signature (mtime, taille) du fichier permet
+# de voir les changements faits par les autres workers gunicorn.
+_theme_cache = {"signature": None, "fruit": DEFAULT_FRUIT}
+
 def load_user_theme():
-    if os.path.exists(USER_THEME_FILE):
-        try:
-            with open(USER_THEME_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            return data.get("fruit", DEFAULT_FRUIT)
-        except Exception:
-            return DEFAULT_FRUIT
-    return DEFAULT_FRUIT
+    signature = _file_signature(USER_THEME_FILE)
+    if signature is None:
+        return DEFAULT_FRUIT
+    if signature == _theme_cache["signature"]:
+        return _theme_cache["fruit"]
+    try:
+        with open(USER_THEME_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        fruit = data.get("fruit", DEFAULT_FRUIT)
+    except Exception:
+        fruit = DEFAULT_FRUIT
+    _theme_cache["signature"] = signature
+    _theme_cache["fruit"] = fruit
+    return fruit
 
 def save_user_theme(fruit):
     try:
-        with open(USER_THEME_FILE, "w", encoding="utf-8") as f:
+        # Écriture atomique : les autres workers ne lisent jamais un fichier partiel
+        tmp_path = f"{USER_THEME_FILE}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
             json.dump({"fruit": fruit}, f)
+        os.replace(tmp_path, USER_THEME_FILE)
+        _theme_cache["signature"] = _file_signature(USER_THEME_FILE)
+        _theme_cache["fruit"] = fruit
     except Exception:
         pass
 
@@ -226,20 +305,40 @@ def load_last_voucher_number():
             return f.read().strip()
     return None
 
-def save_last_voucher_number(num):
-    with open(VOUCHER_FILE, "w", encoding="utf-8") as f:
-        f.write(num)
+def reserve_sequence(cle, count=1):
+    """Réserve atomiquement `count` valeurs consécutives du compteur `cle`.
 
-def get_voucher_sequence(date_str):
+    L'UPSERT et la relecture s'exécutent dans une transaction SQLite très
+    courte ouverte en BEGIN IMMEDIATE : deux workers gunicorn ne peuvent jamais
+    obtenir la même valeur, sans verrou global sur la requête. (RETURNING
+    n'est pas utilisé : il exige SQLite 3.35.) Renvoie la première valeur du
+    bloc réservé.
+    """
+    with db_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            "INSERT INTO compteurs (cle, valeur) VALUES (?, ?) "
+            "ON CONFLICT(cle) DO UPDATE SET valeur = valeur + excluded.valeur",
+            (cle, count)
+        )
+        row = conn.execute("SELECT valeur FROM compteurs WHERE cle = ?", (cle,)).fetchone()
+    return row["valeur"] - count + 1
+
+def seed_voucher_counter():
+    """Reprend la séquence du jour depuis l'ancien fichier last_voucher.txt."""
     last_bon = load_last_voucher_number()
-    if last_bon and last_bon.startswith("BL" + date_str):
-        last_seq = int(last_bon[-2:])
-        seq = last_seq + 1
-    else:
-        seq = 1
-    return str(seq).zfill(2)
+    date_str = datetime.datetime.now().strftime("%d%m%Y")
+    if not last_bon or not last_bon.startswith("BL" + date_str):
+        return
+    try:
+        last_seq = int(last_bon[len("BL" + date_str) + 4:])
+    except ValueError:
+        return
+    with db_connection() as conn:
+        conn.execute("INSERT OR IGNORE INTO compteurs (cle, valeur) VALUES (?, ?)",
+                     ("BL" + date_str, last_seq))
 
-def generate_voucher_number(farmer):
+def _farmer_initials(farmer):
     parts = farmer.split()
     if len(parts) >= 2:
         nom = parts[0][:2].upper().ljust(2, "X")
@@ -247,57 +346,71 @@ def generate_voucher_number(farmer):
     else:
         nom = farmer[:2].upper().ljust(2, "X")
         prenom = farmer[:2].upper().ljust(2, "X")
+    return nom + prenom
+
+def generate_voucher_number(farmer):
+    return generate_voucher_numbers([farmer])[0]
+
+def generate_voucher_numbers(farmers):
+    """Attribue les numéros d'un lot de bons en réservant un bloc du compteur du jour."""
+    if not farmers:
+        return []
     date_str = datetime.datetime.now().strftime("%d%m%Y")
-    seq = get_voucher_sequence(date_str)
-    num_bon = "BL" + date_str + nom + prenom + seq
-    save_last_voucher_number(num_bon)
-    return num_bon
+    first_seq = reserve_sequence("BL" + date_str, len(farmers))
+    return [
+        "BL" + date_str + _farmer_initials(farmer) + str(first_seq + i).zfill(2)
+        for i, farmer in enumerate(farmers)
+    ]
 
 def get_report_sequence(date_str):
-    file_path = os.path.join(EXCEL_DIR, "enregistrements.xlsx")
-    seq = 1
-    if os.path.exists(file_path):
-        try:
-            wb = load_workbook(file_path)
-            if "HistoriqueRapports" in wb.sheetnames:
-                ws = wb["HistoriqueRapports"]
-                sequences = []
-                for row in ws.iter_rows(min_row=2, values_only=True):
-                    if row[0] is not None and str(row[0]).startswith("R" + date_str):
-                        try:
-                            seq_num = int(str(row[0])[len("R" + date_str):])
-                            sequences.append(seq_num)
-                        except:
-                            pass
-                if sequences:
-                    seq = max(sequences) + 1
-        except Exception:
-            seq = 1
-    return str(seq).zfill(2)
+    """Numéro de séquence du rapport du jour, tiré du compteur persistant (O(1))."""
+    return str(reserve_sequence("R" + date_str)).zfill(2)
+
+def seed_report_counter():
+    """Reprend la séquence du jour depuis l'historique existant (une seule fois au démarrage)."""
+    date_str = datetime.datetime.now().strftime("%d%m%Y")
+    prefix = "R" + date_str
+    with db_connection() as conn:
+        rows = conn.execute(
+            "SELECT numero FROM historique_rapports WHERE numero LIKE ?", (prefix + "%",)
+        ).fetchall()
+        sequences = []
+        for row in rows:
+            # Le numéro contient les initiales : on ne garde que le suffixe numérique final
+            suffix = str(row["numero"])[len(prefix):]
+            digits = suffix[len(suffix.rstrip("0123456789")):]
+            if digits:
+                sequences.append(int(digits))
+        if sequences:
+            conn.execute("INSERT OR IGNORE INTO compteurs (cle, valeur) VALUES (?, ?)",
+                         (prefix, max(sequences)))
 
 def generate_report_number(farmer):
-    parts = farmer.split()
-    if len(parts) >= 2:
-        nom = parts[0][:2].upper().ljust(2, "X")
-        prenom = parts[1][:2].upper().ljust(2, "X")
-    else:
-        nom = farmer[:2].upper().ljust(2, "X")
-        prenom = farmer[:2].upper().ljust(2, "X")
     date_str = datetime.datetime.now().strftime("%d%m%Y")
     seq = get_report_sequence(date_str)
-    return "R" + date_str + nom + prenom + seq
+    return "R" + date_str + _farmer_initials(farmer) + seq
 
 class PDFGenerator:
+    # Feuilles de style, styles de tableau et mise en page sont construits une
+    # seule fois puis partagés : reportlab ne fait que les lire pendant build(),
+    # ils peuvent donc servir à plusieurs threads en même temps. Seul le
+    # SimpleDocTemplate (qui porte l'état de mise en page) est créé par document.
+
     @staticmethod
-    def generate_delivery_pdf(data, pdf_path):
-        doc = SimpleDocTemplate(
-            pdf_path,
-            pagesize=landscape(A4),
-            leftMargin=1.5*cm,
-            rightMargin=1.5*cm,
-            topMargin=1.5*cm,
-            bottomMargin=1.5*cm
-        )
+    @functools.lru_cache(maxsize=None)
+    def geometry():
+        """(largeur, hauteur) de la page A4 paysage, marge, largeur utile."""
+        from reportlab.lib.pagesizes import A4, landscape
+        from reportlab.lib.units import cm
+        page_size = landscape(A4)
+        margin = 1.5*cm
+        return page_size, margin, page_size[0] - 2 * margin
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def styles():
+        from reportlab.lib.styles import getSampleStyleSheet
+        from reportlab.lib.enums import TA_JUSTIFY, TA_CENTER
         styles = getSampleStyleSheet()
         styles["Normal"].fontSize = 14
         styles["Normal"].alignment = TA_JUSTIFY
@@ -305,6 +418,49 @@ class PDFGenerator:
         styles["Title"].alignment = TA_CENTER
         styles["Heading2"].fontSize = 14
         styles["Heading2"].alignment = TA_CENTER
+        return styles
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def table_styles():
+        from reportlab.platypus import TableStyle
+        from reportlab.lib import colors
+        header = [
+            ('BACKGROUND', (0, 0), (-1, 0), colors.darkblue),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, 0), 14),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.whitesmoke, colors.beige])
+        ]
+        return {
+            "livraison": TableStyle(header + [('GRID', (0, 0), (-1, -1), 1, colors.grey)]),
+            "stats": TableStyle(header + [('GRID', (0, 0), (-1, -1), 0.5, colors.grey)]),
+            "champ": TableStyle([
+                ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+                ('GRID', (0, 0), (-1, -1), 0.5, colors.grey)
+            ])
+        }
+
+    @staticmethod
+    def document(pdf_path):
+        from reportlab.platypus import SimpleDocTemplate
+        page_size, margin, _ = PDFGenerator.geometry()
+        return SimpleDocTemplate(
+            pdf_path,
+            pagesize=page_size,
+            leftMargin=margin,
+            rightMargin=margin,
+            topMargin=margin,
+            bottomMargin=margin
+        )
+
+    @staticmethod
+    def generate_delivery_pdf(data, pdf_path):
+        """Écrit le PDF d'un bon ; pdf_path peut aussi être un fichier ouvert (BytesIO...)."""
+        from reportlab.platypus import Paragraph, Spacer, LongTable
+        styles = PDFGenerator.styles()
         elements = []
         title = Paragraph("Gestion des Récoltes de " + data.get("fruit", "FRUIT") + " ENNAJIHI NAWFAL", styles['Title'])
         elements.append(title)
@@ -316,38 +472,20 @@ class PDFGenerator:
         table_data.append(["Champ", "Valeur"])
         for field, val in data['fields']:
             table_data.append([field, str(val)])
-        PAGE_WIDTH, PAGE_HEIGHT = landscape(A4)
-        usable_width = PAGE_WIDTH - (doc.leftMargin + doc.rightMargin)
+        usable_width = PDFGenerator.geometry()[2]
         table = LongTable(
             table_data,
             colWidths=[0.4 * usable_width, 0.6 * usable_width],
             repeatRows=1
         )
         table.hAlign = 'CENTER'
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.darkblue),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 14),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.whitesmoke, colors.beige]),
-            ('GRID', (0, 0), (-1, -1), 1, colors.grey)
-        ]))
+        table.setStyle(PDFGenerator.table_styles()["livraison"])
         elements.append(table)
-        doc.build(elements)
+        PDFGenerator.document(pdf_path).build(elements)
 
     @staticmethod
     def generate_stats_pdf(elements, pdf_path):
-        doc = SimpleDocTemplate(
-            pdf_path,
-            pagesize=landscape(A4),
-            leftMargin=1.5*cm,
-            rightMargin=1.5*cm,
-            topMargin=1.5*cm,
-            bottomMargin=1.5*cm
-        )
-        doc.build(elements)
+        PDFGenerator.document(pdf_path).build(elements)
 
 column_order = [
     "Date (JJ/MM/AAAA)",
@@ -385,6 +523,1555 @@ if "Mois" not in all_columns_extended:
 if "Annee" not in all_columns_extended:
     all_columns_extended.insert(2, "Annee")
 
+# =============================================================================
+# Stockage SQLite des bons de livraison et de l'historique des rapports
+# =============================================================================
+
+# La base SQLite est la source de vérité ; le classeur Excel n'est plus
+# qu'un format d'export, construit à la demande par /export_excel.
+# EXCEL_FILE ne sert qu'à la migration unique de l'ancien classeur.
+DB_FILE = os.path.join(AHABIAFILES_DIR, "enregistrements.db")
+EXCEL_FILE = os.path.join(EXCEL_DIR, "enregistrements.xlsx")
+
+# Correspondance entre les en-têtes de la feuille BonLivraison et les colonnes SQL
+bon_columns = {
+    "Numéro Bon": "num_bon",
+    "Date (JJ/MM/AAAA)": "date_saisie",
+    "Agriculteur": "agriculteur",
+    "Parcelle": "parcelle",
+    "Produit": "produit",
+    "Variété": "variete",
+    "Nb Ouvriers Cueilleurs": "nb_cueilleurs",
+    "Nb Ouvriers Indirect": "nb_indirect",
+    "Nb Ouvriers Autres": "nb_autres",
+    "Total Ouvriers": "total_ouvriers",
+    "Nombre Caporaux": "nb_caporaux",
+    "Poids Total Cueillis (kg)": "poids_total",
+    "Écarts (Produit Déchet) en kg": "ecarts",
+    "Poids Global": "poids_global"
+}
+bon_int_columns = ["nb_cueilleurs", "nb_indirect", "nb_autres", "total_ouvriers", "nb_caporaux"]
+bon_float_columns = ["poids_total", "ecarts", "poids_global"]
+historique_headers = ["N°", "Type", "Date", "Chemin"]
+
+DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS bon_livraison (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    num_bon TEXT,
+    date_saisie TEXT,
+    date_iso TEXT,
+    agriculteur TEXT,
+    parcelle TEXT,
+    produit TEXT,
+    variete TEXT,
+    nb_cueilleurs INTEGER DEFAULT 0,
+    nb_indirect INTEGER DEFAULT 0,
+    nb_autres INTEGER DEFAULT 0,
+    total_ouvriers INTEGER DEFAULT 0,
+    nb_caporaux INTEGER DEFAULT 0,
+    poids_total REAL DEFAULT 0,
+    ecarts REAL DEFAULT 0,
+    poids_global REAL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_bon_num ON bon_livraison(num_bon);
+CREATE INDEX IF NOT EXISTS idx_bon_date ON bon_livraison(date_iso);
+CREATE INDEX IF NOT EXISTS idx_bon_agriculteur ON bon_livraison(agriculteur);
+CREATE INDEX IF NOT EXISTS idx_bon_parcelle ON bon_livraison(parcelle);
+CREATE INDEX IF NOT EXISTS idx_bon_produit ON bon_livraison(produit);
+CREATE INDEX IF NOT EXISTS idx_bon_variete ON bon_livraison(variete);
+CREATE TABLE IF NOT EXISTS historique_rapports (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    numero TEXT,
+    type TEXT,
+    date TEXT,
+    chemin TEXT,
+    date_iso TEXT,
+    taille INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_hist_numero ON historique_rapports(numero);
+CREATE TABLE IF NOT EXISTS rollup_recolte (
+    granularite TEXT NOT NULL,
+    periode TEXT NOT NULL,
+    date_saisie TEXT NOT NULL,
+    dimension TEXT NOT NULL,
+    valeur TEXT NOT NULL,
+    nb_bons INTEGER DEFAULT 0,
+    poids_total REAL DEFAULT 0,
+    ecarts REAL DEFAULT 0,
+    poids_global REAL DEFAULT 0,
+    nb_cueilleurs INTEGER DEFAULT 0,
+    nb_indirect INTEGER DEFAULT 0,
+    nb_autres INTEGER DEFAULT 0,
+    total_ouvriers INTEGER DEFAULT 0,
+    nb_caporaux INTEGER DEFAULT 0,
+    PRIMARY KEY (granularite, dimension, periode, date_saisie, valeur)
+);
+CREATE TABLE IF NOT EXISTS compteurs (
+    cle TEXT PRIMARY KEY,
+    valeur INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    cle TEXT PRIMARY KEY,
+    valeur TEXT
+);
+CREATE TABLE IF NOT EXISTS travaux (
+    id TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    statut TEXT NOT NULL,
+    parametres TEXT,
+    progression INTEGER DEFAULT 0,
+    total INTEGER DEFAULT 0,
+    chemin TEXT,
+    message TEXT,
+    proprietaire TEXT,
+    cree_le TEXT,
+    maj_le TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_travaux_statut ON travaux(statut);
+CREATE TABLE IF NOT EXISTS commandes_paypal (
+    order_id TEXT PRIMARY KEY,
+    plan TEXT NOT NULL,
+    statut TEXT NOT NULL DEFAULT 'en_attente',
+    cree_le REAL NOT NULL,
+    expire_le REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_commandes_paypal_expire ON commandes_paypal(expire_le);
+"""
+
+@contextmanager
+def db_connection():
+    conn = sqlite3.connect(DB_FILE, timeout=30)
+    conn.row_factory = sqlite3.Row
+    # Chaque COMMIT est synchronisé sur disque avant le retour de la requête
+    conn.execute("PRAGMA synchronous=FULL")
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+# Index plein texte des bons (FTS5, contenu externe) tenu à jour par triggers.
+# La recherche se rabat sur LIKE si SQLite a été compilé sans FTS5.
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS bon_recherche USING fts5(
+    num_bon, agriculteur, parcelle, produit, variete, date_saisie,
+    content='bon_livraison', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS bon_recherche_ai AFTER INSERT ON bon_livraison BEGIN
+    INSERT INTO bon_recherche (rowid, num_bon, agriculteur, parcelle, produit, variete, date_saisie)
+    VALUES (new.id, new.num_bon, new.agriculteur, new.parcelle, new.produit, new.variete, new.date_saisie);
+END;
+CREATE TRIGGER IF NOT EXISTS bon_recherche_ad AFTER DELETE ON bon_livraison BEGIN
+    INSERT INTO bon_recherche (bon_recherche, rowid, num_bon, agriculteur, parcelle, produit, variete, date_saisie)
+    VALUES ('delete', old.id, old.num_bon, old.agriculteur, old.parcelle, old.produit, old.variete, old.date_saisie);
+END;
+CREATE TRIGGER IF NOT EXISTS bon_recherche_au AFTER UPDATE ON bon_livraison BEGIN
+    INSERT INTO bon_recherche (bon_recherche, rowid, num_bon, agriculteur, parcelle, produit, variete, date_saisie)
+    VALUES ('delete', old.id, old.num_bon, old.agriculteur, old.parcelle, old.produit, old.variete, old.date_saisie);
+    INSERT INTO bon_recherche (rowid, num_bon, agriculteur, parcelle, produit, variete, date_saisie)
+    VALUES (new.id, new.num_bon, new.agriculteur, new.parcelle, new.produit, new.variete, new.date_saisie);
+END;
+"""
+search_state = {"fts": False}
+
+def init_db():
+    with db_connection() as conn:
+        # Journal WAL : une saisie est un simple ajout en fin de journal,
+        # de coût constant quelle que soit la taille de la saison.
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(DB_SCHEMA)
+    try:
+        with db_connection() as conn:
+            conn.executescript(SEARCH_SCHEMA)
+        search_state["fts"] = True
+    except sqlite3.OperationalError as e:
+        print("Recherche plein texte indisponible ({}), repli sur LIKE.".format(e), file=sys.stderr)
+        search_state["fts"] = False
+
+def upgrade_report_history():
+    """Ajoute horodatage ISO indexé et taille de fichier aux historiques créés avant ces colonnes."""
+    with db_connection() as conn:
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(historique_rapports)")}
+        for column, decl in (("date_iso", "TEXT"), ("taille", "INTEGER")):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE historique_rapports ADD COLUMN {column} {decl}")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_hist_date ON historique_rapports(date_iso)")
+        # date au format JJ/MM/AAAA HH:MM:SS -> AAAA-MM-JJ HH:MM:SS
+        conn.execute(
+            "UPDATE historique_rapports SET date_iso = substr(date, 7, 4) || '-' || substr(date, 4, 2) || '-' "
+            "|| substr(date, 1, 2) || substr(date, 11) WHERE date_iso IS NULL AND date LIKE '__/__/____%'"
+        )
+        missing = conn.execute(
+            "SELECT id, chemin FROM historique_rapports WHERE taille IS NULL AND chemin IS NOT NULL AND chemin <> ''"
+        ).fetchall()
+        conn.executemany(
+            "UPDATE historique_rapports SET taille = ? WHERE id = ?",
+            [(_file_size(row["chemin"]), row["id"]) for row in missing]
+        )
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except (OSError, TypeError):
+        return 0
+
+def _bump_data_version(conn):
+    """Incrémente le compteur de version des bons (dans la transaction en cours)."""
+    conn.execute(
+        "INSERT INTO meta (cle, valeur) VALUES ('data_version', 1) "
+        "ON CONFLICT(cle) DO UPDATE SET valeur = CAST(valeur AS INTEGER) + 1"
+    )
+
+def get_data_version():
+    with db_connection() as conn:
+        row = conn.execute("SELECT valeur FROM meta WHERE cle = 'data_version'").fetchone()
+    return int(row["valeur"]) if row else 0
+
+def _to_int(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return 0
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+def _date_to_iso(date_saisie):
+    try:
+        return datetime.datetime.strptime(str(date_saisie).strip(), "%d/%m/%Y").date().isoformat()
+    except ValueError:
+        return None
+
+def _bon_to_sql_values(data_dict):
+    """Convertit un dictionnaire indexé par les en-têtes Excel en valeurs SQL."""
+    values = {}
+    for label, col in bon_columns.items():
+        val = data_dict.get(label, "")
+        if col in bon_int_columns:
+            val = _to_int(val)
+        elif col in bon_float_columns:
+            val = _to_float(val)
+        elif isinstance(val, (datetime.date, datetime.datetime)):
+            val = val.strftime("%d/%m/%Y")
+        else:
+            val = "" if val is None else str(val)
+        values[col] = val
+    values["date_iso"] = _date_to_iso(values["date_saisie"])
+    return values
+
+def _insert_bon_rows(conn, rows):
+    cols = list(bon_columns.values()) + ["date_iso"]
+    sql = "INSERT INTO bon_livraison ({}) VALUES ({})".format(
+        ", ".join(cols), ", ".join("?" for _ in cols)
+    )
+    ids = []
+    for data_dict in rows:
+        values = _bon_to_sql_values(data_dict)
+        cur = conn.execute(sql, [values[c] for c in cols])
+        ids.append(cur.lastrowid)
+        _apply_rollup(conn, values, 1)
+    if ids:
+        _bump_data_version(conn)
+    return ids
+
+def insert_bon(data_dict):
+    with db_connection() as conn:
+        bon_id = _insert_bon_rows(conn, [data_dict])[0]
+    invalidate_bons_cache()
+    return bon_id
+
+def delete_bon(bon_id):
+    with db_connection() as conn:
+        row = conn.execute("SELECT * FROM bon_livraison WHERE id = ?", (bon_id,)).fetchone()
+        cur = conn.execute("DELETE FROM bon_livraison WHERE id = ?", (bon_id,))
+        if cur.rowcount > 0:
+            _apply_rollup(conn, dict(row), -1)
+            _bump_data_version(conn)
+    invalidate_bons_cache()
+    return cur.rowcount > 0
+
+# -----------------------------------------------------------------------------
+# Agrégats pré-calculés (rollups) des récoltes
+# -----------------------------------------------------------------------------
+
+# Sommes par jour, mois et année, croisées avec chaque dimension ("*" = toutes
+# les lignes). Elles sont mises à jour dans la même transaction que l'ajout ou
+# la suppression d'un bon, ce qui permet à /stats de répondre sans relire les bons.
+rollup_dimensions = {"Agriculteur": "agriculteur", "Parcelle": "parcelle", "Produit": "produit", "Variété": "variete"}
+rollup_metrics = ["poids_total", "ecarts", "poids_global", "nb_cueilleurs", "nb_indirect",
+                  "nb_autres", "total_ouvriers", "nb_caporaux"]
+_rollup_key_columns = ["granularite", "periode", "date_saisie", "dimension", "valeur"]
+ROLLUP_UPSERT = (
+    "INSERT INTO rollup_recolte ({cols}, nb_bons, {metrics}) VALUES ({marks}) "
+    "ON CONFLICT(granularite, dimension, periode, date_saisie, valeur) DO UPDATE SET "
+    "nb_bons = nb_bons + excluded.nb_bons, {updates}"
+).format(
+    cols=", ".join(_rollup_key_columns),
+    metrics=", ".join(rollup_metrics),
+    marks=", ".join("?" for _ in range(len(_rollup_key_columns) + 1 + len(rollup_metrics))),
+    updates=", ".join(f"{m} = {m} + excluded.{m}" for m in rollup_metrics)
+)
+
+def _apply_rollup(conn, values, sign):
+    """Ajoute (sign=1) ou retire (sign=-1) un bon des agrégats."""
+    date_iso = values.get("date_iso") or ""
+    periodes = {
+        "jour": (date_iso, values.get("date_saisie") or ""),
+        "mois": (date_iso[:7], ""),
+        "annee": (date_iso[:4], "")
+    }
+    dims = [("*", "")] + [(col, values.get(col) or "") for col in rollup_dimensions.values()]
+    # Les totaux sont recalculés comme dans /stats, quelle que soit la valeur stockée
+    values = dict(values)
+    values["poids_global"] = (values.get("poids_total") or 0) + (values.get("ecarts") or 0)
+    values["total_ouvriers"] = sum(values.get(c) or 0 for c in ("nb_cueilleurs", "nb_indirect", "nb_autres"))
+    metrics = [sign * (values.get(m) or 0) for m in rollup_metrics]
+    for granularite, (periode, date_saisie) in periodes.items():
+        for dimension, valeur in dims:
+            key = [granularite, periode, date_saisie, dimension, valeur]
+            conn.execute(ROLLUP_UPSERT, key + [sign] + metrics)
+            if sign < 0:
+                conn.execute(
+                    "DELETE FROM rollup_recolte WHERE granularite = ? AND periode = ? AND date_saisie = ? "
+                    "AND dimension = ? AND valeur = ? AND nb_bons <= 0",
+                    key
+                )
+
+def rebuild_rollups(conn):
+    conn.execute("DELETE FROM rollup_recolte")
+    periodes = {
+        "jour": ("COALESCE(date_iso, '')", "COALESCE(date_saisie, '')"),
+        "mois": ("COALESCE(substr(date_iso, 1, 7), '')", "''"),
+        "annee": ("COALESCE(substr(date_iso, 1, 4), '')", "''")
+    }
+    dims = dict([("*", "''")] + [(col, f"COALESCE({col}, '')") for col in rollup_dimensions.values()])
+    expressions = dict((m, m) for m in rollup_metrics)
+    expressions["poids_global"] = "poids_total + ecarts"
+    expressions["total_ouvriers"] = "nb_cueilleurs + nb_indirect + nb_autres"
+    sums = ", ".join(f"SUM({expressions[m]})" for m in rollup_metrics)
+    for granularite, (periode_sql, date_sql) in periodes.items():
+        for dimension, valeur_sql in dims.items():
+            conn.execute(
+                f"INSERT INTO rollup_recolte ({', '.join(_rollup_key_columns)}, nb_bons, {', '.join(rollup_metrics)}) "
+                f"SELECT ?, {periode_sql}, {date_sql}, ?, {valeur_sql}, COUNT(*), {sums} "
+                f"FROM bon_livraison GROUP BY 2, 3, 5",
+                (granularite, dimension)
+            )
+
+def ensure_rollups():
+    """Construit les agrégats une seule fois (bases existantes), ensuite maintenus au fil de l'eau."""
+    conn = sqlite3.connect(DB_FILE, timeout=30)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        if conn.execute("SELECT 1 FROM meta WHERE cle = 'rollups_construits'").fetchone():
+            conn.rollback()
+            return
+        rebuild_rollups(conn)
+        conn.execute("INSERT INTO meta (cle, valeur) VALUES ('rollups_construits', ?)",
+                     (datetime.datetime.now().isoformat(),))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def ensure_search_index():
+    """Remplit l'index plein texte une seule fois pour les bons antérieurs aux triggers."""
+    if not search_state["fts"]:
+        return
+    conn = sqlite3.connect(DB_FILE, timeout=30)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        if conn.execute("SELECT 1 FROM meta WHERE cle = 'recherche_construite'").fetchone():
+            conn.rollback()
+            return
+        conn.execute("INSERT INTO bon_recherche (bon_recherche) VALUES ('rebuild')")
+        conn.execute("INSERT INTO meta (cle, valeur) VALUES ('recherche_construite', ?)",
+                     (datetime.datetime.now().isoformat(),))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def query_rollup(label, graph_column, start_iso=None, end_iso=None):
+    """Somme de graph_column regroupée par label, lue dans les agrégats.
+
+    Renvoie un DataFrame [label, graph_column], ou None si la combinaison
+    demandée n'est pas couverte par les agrégats.
+    """
+    import pandas as pd
+    metric = bon_columns.get(graph_column)
+    if metric not in rollup_metrics:
+        return None
+    ranged = bool(start_iso or end_iso)
+    conds = []
+    params = []
+    if label == "Date (JJ/MM/AAAA)":
+        granularite, dimension, key_sql = "jour", "*", "date_saisie"
+    elif label == "Mois":
+        granularite, dimension, key_sql = ("jour" if ranged else "mois"), "*", "CAST(substr(periode, 6, 2) AS INTEGER)"
+        conds.append("periode <> ''")
+    elif label == "Annee":
+        granularite, dimension, key_sql = ("jour" if ranged else "annee"), "*", "CAST(substr(periode, 1, 4) AS INTEGER)"
+        conds.append("periode <> ''")
+    elif label in rollup_dimensions:
+        granularite, dimension, key_sql = ("jour" if ranged else "annee"), rollup_dimensions[label], "valeur"
+    else:
+        return None
+    if ranged:
+        conds.append("periode <> ''")
+    if start_iso:
+        conds.append("periode >= ?")
+        params.append(start_iso)
+    if end_iso:
+        conds.append("periode <= ?")
+        params.append(end_iso)
+    where = "".join(" AND " + c for c in conds)
+    with db_connection() as conn:
+        rows = conn.execute(
+            f"SELECT {key_sql} AS cle, SUM({metric}) AS total FROM rollup_recolte "
+            f"WHERE granularite = ? AND dimension = ?{where} GROUP BY cle ORDER BY cle",
+            [granularite, dimension] + params
+        ).fetchall()
+    return pd.DataFrame([tuple(r) for r in rows], columns=[label, graph_column])
+
+def load_bons_dataframe():
+    """Renvoie la feuille BonLivraison sous forme de DataFrame (en-têtes Excel, index = id)."""
+    import pandas as pd
+    with db_connection() as conn:
+        df = pd.read_sql_query(
+            "SELECT id, {} FROM bon_livraison ORDER BY id".format(", ".join(bon_columns.values())),
+            conn,
+            index_col="id"
+        )
+    return df.rename(columns={col: label for label, col in bon_columns.items()})
+
+# Pagination de /bons : seule la page visible est lue dans la base
+BONS_PAGE_SIZE = int(os.environ.get("BONS_PAGE_SIZE", "50"))
+BONS_PAGE_SIZE_MAX = 500
+
+# Expression SQL de chaque colonne affichée (les totaux sont recalculés comme dans /stats)
+bon_display_expressions = dict(
+    {label: col for label, col in bon_columns.items()},
+    **{
+        "Total Ouvriers": "(nb_cueilleurs + nb_indirect + nb_autres)",
+        "Poids Global": "(poids_total + ecarts)"
+    }
+)
+# Tri : la date se trie sur sa forme ISO indexée, pas sur le texte JJ/MM/AAAA
+bon_sort_expressions = dict(bon_display_expressions, **{"Date (JJ/MM/AAAA)": "date_iso"})
+
+_bons_count_cache = {"version": None, "counts": {}}
+_bons_count_lock = threading.Lock()
+
+# Champs utilisables dans une recherche ciblée, ex. « agriculteur:ennajihi »
+search_fields = {
+    "num": "num_bon",
+    "bon": "num_bon",
+    "numero": "num_bon",
+    "agriculteur": "agriculteur",
+    "parcelle": "parcelle",
+    "produit": "produit",
+    "variete": "variete",
+    "variété": "variete",
+    "date": "date_saisie"
+}
+
+def parse_search(search):
+    """Découpe une recherche en termes (colonne ou None, texte)."""
+    terms = []
+    for word in (search or "").split():
+        field, sep, value = word.partition(":")
+        column = search_fields.get(field.lower()) if sep else None
+        if column and value:
+            terms.append((column, value))
+        else:
+            terms.append((None, word))
+    return terms
+
+def _fts_query(terms):
+    """Requête MATCH FTS5 : chaque terme est une phrase en préfixe, les termes sont combinés en ET."""
+    parts = []
+    for column, value in terms:
+        tokens = re.findall(r"\w+", value)
+        if not tokens:
+            continue
+        phrase = '"{}"*'.format(" ".join(tokens).replace('"', '""'))
+        parts.append("{} : {}".format(column, phrase) if column else phrase)
+    return " ".join(parts)
+
+def _like_contains(value):
+    """Motif LIKE « contient `value` » : \\, % et _ sont échappés (à utiliser avec ESCAPE '\\')."""
+    value = value.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return "%" + value + "%"
+
+def _bons_search_clause(search):
+    """Clause WHERE de la recherche : index plein texte, ou LIKE en repli."""
+    terms = parse_search(search)
+    if not terms:
+        return "", []
+    if search_state["fts"]:
+        match = _fts_query(terms)
+        if match:
+            return " WHERE id IN (SELECT rowid FROM bon_recherche WHERE bon_recherche MATCH ?)", [match]
+    haystack = " || ' ' || ".join(
+        "COALESCE(CAST({} AS TEXT), '')".format(expr) for expr in bon_display_expressions.values()
+    )
+    conds = []
+    params = []
+    for column, value in terms:
+        conds.append("lower({}) LIKE ? ESCAPE '\\'".format("COALESCE({}, '')".format(column) if column else haystack))
+        params.append(_like_contains(value))
+    return " WHERE " + " AND ".join(conds), params
+
+def count_bons(search="", data_version=None):
+    """Nombre de bons correspondant à la recherche, mis en cache par data_version.
+
+    Sans recherche, le total est lu dans les agrégats annuels (une ligne par
+    année) au lieu de parcourir la table.
+    """
+    version = get_data_version() if data_version is None else data_version
+    key = (search or "").strip().lower()
+    with _bons_count_lock:
+        if _bons_count_cache["version"] != version:
+            _bons_count_cache["version"] = version
+            _bons_count_cache["counts"] = {}
+        if key in _bons_count_cache["counts"]:
+            return _bons_count_cache["counts"][key]
+    with db_connection() as conn:
+        if key:
+            where, params = _bons_search_clause(key)
+            total = conn.execute("SELECT COUNT(*) FROM bon_livraison" + where, params).fetchone()[0]
+        else:
+            total = conn.execute(
+                "SELECT COALESCE(SUM(nb_bons), 0) FROM rollup_recolte "
+                "WHERE granularite = 'annee' AND dimension = '*'"
+            ).fetchone()[0]
+    with _bons_count_lock:
+        if _bons_count_cache["version"] == version:
+            if len(_bons_count_cache["counts"]) >= 256:
+                _bons_count_cache["counts"].clear()
+            _bons_count_cache["counts"][key] = total
+    return total
+
+def _bon_display_select():
+    return ", ".join("{} AS c{}".format(expr, i) for i, expr in enumerate(bon_display_expressions.values()))
+
+def _bon_display_rows(rows):
+    """Convertit des lignes (id, colonnes affichées) en dictionnaires indexés par les en-têtes, plus _idx."""
+    labels = list(bon_display_expressions)
+    result = []
+    for row in rows:
+        row_data = {label: row[i + 1] for i, label in enumerate(labels)}
+        row_data["_idx"] = row["id"]
+        result.append(row_data)
+    return result
+
+def fetch_bons_page(search="", sort_label=None, descending=False, limit=BONS_PAGE_SIZE, offset=0):
+    """Renvoie une page de bons (dictionnaires indexés par les en-têtes Excel, plus _idx)."""
+    sort_expr = bon_sort_expressions.get(sort_label, "id")
+    direction = "DESC" if descending else "ASC"
+    where, params = _bons_search_clause(search)
+    with db_connection() as conn:
+        rows = conn.execute(
+            f"SELECT id, {_bon_display_select()} FROM bon_livraison{where} "
+            f"ORDER BY {sort_expr} {direction}, id {direction} LIMIT ? OFFSET ?",
+            params + [limit, offset]
+        ).fetchall()
+    return _bon_display_rows(rows)
+
+def fetch_bon(bon_id):
+    """Un bon par son id (même dictionnaire que fetch_bons_page), ou None."""
+    with db_connection() as conn:
+        rows = conn.execute(
+            f"SELECT id, {_bon_display_select()} FROM bon_livraison WHERE id = ?", (bon_id,)
+        ).fetchall()
+    found = _bon_display_rows(rows)
+    return found[0] if found else None
+
+# Filtres d'export : colonne SQL comparée (sans casse) à la valeur saisie
+bon_text_filters = {"agriculteur": "agriculteur", "produit": "produit", "variete": "variete"}
+
+def _bons_filter_clause(filters):
+    """Clause WHERE des filtres d'export : debut / fin (dates ISO), agriculteur, produit, variete."""
+    conds = []
+    params = []
+    if filters.get("debut"):
+        conds.append("date_iso >= ?")
+        params.append(filters["debut"])
+    if filters.get("fin"):
+        conds.append("date_iso <= ?")
+        params.append(filters["fin"])
+    for key, column in bon_text_filters.items():
+        if filters.get(key):
+            conds.append(f"lower({column}) LIKE ? ESCAPE '\\'")
+            params.append(_like_contains(filters[key].strip()))
+    return (" WHERE " + " AND ".join(conds)) if conds else "", params
+
+def parse_bons_filters(values):
+    """Lit les filtres d'export d'un formulaire ; renvoie (filtres, message d'erreur ou None)."""
+    filters = {key: values.get(key, "").strip() for key in bon_text_filters}
+    for key in ("debut", "fin"):
+        value = values.get(key, "").strip()
+        try:
+            filters[key] = datetime.datetime.strptime(value, "%d/%m/%Y").date().isoformat() if value else ""
+        except ValueError:
+            return filters, "Date invalide (format JJ/MM/AAAA)."
+    return filters, None
+
+def fetch_bons_filtered(filters):
+    """Bons correspondant aux filtres, triés par date (mêmes dictionnaires que fetch_bons_page)."""
+    where, params = _bons_filter_clause(filters)
+    with db_connection() as conn:
+        rows = conn.execute(
+            f"SELECT id, {_bon_display_select()} FROM bon_livraison{where} ORDER BY date_iso, id", params
+        ).fetchall()
+    return _bon_display_rows(rows)
+
+def add_report_history(numero, report_type, chemin):
+    now = datetime.datetime.now()
+    with db_connection() as conn:
+        cur = conn.execute(
+            "INSERT INTO historique_rapports (numero, type, date, chemin, date_iso, taille) VALUES (?, ?, ?, ?, ?, ?)",
+            (numero, report_type, now.strftime("%d/%m/%Y %H:%M:%S"), chemin,
+             now.strftime("%Y-%m-%d %H:%M:%S"), _file_size(chemin))
+        )
+    return cur.lastrowid
+
+HISTORY_PAGE_SIZE = 50
+
+def _report_history_clause(search="", debut=None, fin=None):
+    conds = []
+    params = []
+    if debut:
+        conds.append("date_iso >= ?")
+        params.append(debut.isoformat())
+    if fin:
+        # Jusqu'à la fin de la journée incluse
+        conds.append("date_iso < ?")
+        params.append((fin + datetime.timedelta(days=1)).isoformat())
+    for word in (search or "").split():
+        conds.append("lower(COALESCE(numero, '') || ' ' || COALESCE(type, '') || ' ' || COALESCE(date, '') "
+                     "|| ' ' || COALESCE(chemin, '')) LIKE ? ESCAPE '\\'")
+        params.append(_like_contains(word))
+    return (" WHERE " + " AND ".join(conds)) if conds else "", params
+
+def count_report_history(search="", debut=None, fin=None):
+    where, params = _report_history_clause(search, debut, fin)
+    with db_connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM historique_rapports" + where, params).fetchone()[0]
+
+def fetch_report_history(search="", debut=None, fin=None, limit=HISTORY_PAGE_SIZE, offset=0):
+    """Une page de l'historique des rapports, du plus récent au plus ancien."""
+    where, params = _report_history_clause(search, debut, fin)
+    with db_connection() as conn:
+        rows = conn.execute(
+            "SELECT * FROM historique_rapports" + where + " ORDER BY id DESC LIMIT ? OFFSET ?",
+            params + [limit, offset]
+        ).fetchall()
+    return [{"idx": row["id"], "numero": row["numero"], "type": row["type"], "date": row["date"],
+             "pdf_path": row["chemin"], "taille": row["taille"]} for row in rows]
+
+def migrate_excel_to_sqlite():
+    """Import unique de l'ancien classeur enregistrements.xlsx dans la base SQLite."""
+    conn = sqlite3.connect(DB_FILE, timeout=30)
+    try:
+        # Verrou d'écriture : un seul worker gunicorn effectue la migration
+        conn.execute("BEGIN IMMEDIATE")
+        if conn.execute("SELECT 1 FROM meta WHERE cle = 'excel_migre'").fetchone():
+            conn.rollback()
+            return 0
+        imported = 0
+        if os.path.exists(EXCEL_FILE):
+            from openpyxl import load_workbook
+            wb = load_workbook(EXCEL_FILE, read_only=True, data_only=True)
+            if "BonLivraison" in wb.sheetnames:
+                rows = wb["BonLivraison"].iter_rows(values_only=True)
+                headers = [str(h).strip() if h is not None else "" for h in next(rows, [])]
+                bons_rows = []
+                for row in rows:
+                    if row is None or all(v is None for v in row):
+                        continue
+                    bons_rows.append(dict(zip(headers, row)))
+                imported = len(_insert_bon_rows(conn, bons_rows))
+            if "HistoriqueRapports" in wb.sheetnames:
+                for row in wb["HistoriqueRapports"].iter_rows(min_row=2, values_only=True):
+                    row = list(row) + [None] * (4 - len(row))
+                    if row[0] is None:
+                        continue
+                    conn.execute(
+                        "INSERT INTO historique_rapports (type, date, chemin) VALUES (?, ?, ?)",
+                        (row[1], None if row[2] is None else str(row[2]), row[3])
+                    )
+            wb.close()
+        _bump_data_version(conn)
+        conn.execute("INSERT INTO meta (cle, valeur) VALUES ('excel_migre', ?)",
+                     (datetime.datetime.now().isoformat(),))
+        conn.commit()
+        return imported
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def build_excel_export():
+    """Génère le classeur Excel (BonLivraison + HistoriqueRapports) à partir de la base."""
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("BonLivraison")
+    ws.append(list(bon_columns.keys()))
+    with db_connection() as conn:
+        for row in conn.execute("SELECT {} FROM bon_livraison ORDER BY id".format(", ".join(bon_columns.values()))):
+            ws.append(list(row))
+        ws_hist = wb.create_sheet("HistoriqueRapports")
+        ws_hist.append(historique_headers)
+        for row in conn.execute("SELECT id, type, date, chemin FROM historique_rapports ORDER BY id"):
+            ws_hist.append(list(row))
+    buffer = BytesIO()
+    wb.save(buffer)
+    buffer.seek(0)
+    return buffer
+
+# Export filtré (/export) : les lignes sont lues par lots au fil de l'envoi,
+# la mémoire reste constante quel que soit le nombre de bons.
+EXPORT_BATCH_SIZE = 1000
+
+def iter_bons_export(filters):
+    """Génère les lignes (valeurs dans l'ordre de bon_columns) des bons filtrés, triées par date."""
+    where, params = _bons_filter_clause(filters)
+    with db_connection() as conn:
+        cursor = conn.execute(
+            f"SELECT id, {_bon_display_select()} FROM bon_livraison{where} ORDER BY date_iso, id", params
+        )
+        while True:
+            rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                yield list(row)[1:]
+
+def stream_bons_csv(filters):
+    """CSV (séparateur ;, UTF-8 avec BOM pour Excel) envoyé lot par lot."""
+    buffer = StringIO()
+    writer = csv.writer(buffer, delimiter=";")
+    buffer.write("\ufeff")
+    writer.writerow(list(bon_display_expressions))
+    count = 0
+    for row in iter_bons_export(filters):
+        writer.writerow(row)
+        count += 1
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def stream_bons_xlsx(filters, chunk_size=64 * 1024):
+    """Classeur XLSX en mode write-only, écrit dans un fichier temporaire puis envoyé par blocs.
+
+    Le format ZIP du XLSX impose d'écrire le répertoire central en dernier :
+    le classeur est donc complet avant le premier octet, mais aucune étape ne
+    garde toutes les lignes en mémoire.
+    """
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("BonLivraison")
+    ws.append(list(bon_display_expressions))
+    for row in iter_bons_export(filters):
+        ws.append(row)
+    with tempfile.TemporaryFile() as tmp:
+        wb.save(tmp)
+        tmp.seek(0)
+        while True:
+            chunk = tmp.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+# =============================================================================
+# Cache en mémoire du DataFrame BonLivraison
+# =============================================================================
+
+# Le DataFrame typé est partagé par toutes les lectures (bons, stats, PDF) et
+# rechargé uniquement quand le compteur data_version de la base a changé,
+# ce qui reste cohérent entre plusieurs workers gunicorn.
+_bons_cache = {"version": None, "df": None}
+_bons_cache_lock = threading.Lock()
+bons_cache_stats = {"hits": 0, "misses": 0}
+
+def _build_bons_dataframe():
+    import pandas as pd
+    df = load_bons_dataframe()
+    df["Date"] = pd.to_datetime(df["Date (JJ/MM/AAAA)"], format="%d/%m/%Y", errors="coerce")
+    df["Mois"] = df["Date"].dt.month
+    df["Annee"] = df["Date"].dt.year
+    for c in ["Poids Total Cueillis (kg)", "Écarts (Produit Déchet) en kg",
+              "Nb Ouvriers Cueilleurs", "Nb Ouvriers Indirect", "Nb Ouvriers Autres", "Nombre Caporaux"]:
+        df[c] = pd.to_numeric(df[c], errors='coerce').fillna(0)
+    df["Poids Global"] = df["Poids Total Cueillis (kg)"] + df["Écarts (Produit Déchet) en kg"]
+    df["Total Ouvriers"] = df["Nb Ouvriers Cueilleurs"] + df["Nb Ouvriers Indirect"] + df["Nb Ouvriers Autres"]
+    return df
+
+def get_bons_dataframe():
+    """Renvoie le DataFrame typé des bons (partagé : ne pas le modifier en place)."""
+    version = get_data_version()
+    with _bons_cache_lock:
+        if _bons_cache["df"] is not None and _bons_cache["version"] == version:
+            bons_cache_stats["hits"] += 1
+            return _bons_cache["df"]
+        bons_cache_stats["misses"] += 1
+        df = _build_bons_dataframe()
+        df.attrs["data_version"] = version
+        _bons_cache["version"] = version
+        _bons_cache["df"] = df
+        return df
+
+def invalidate_bons_cache():
+    with _bons_cache_lock:
+        _bons_cache["version"] = None
+        _bons_cache["df"] = None
+
+# =============================================================================
+# Agrégation des statistiques
+# =============================================================================
+
+def _parse_filter_date(date_str):
+    if not date_str:
+        return None
+    try:
+        return datetime.datetime.strptime(date_str, "%d/%m/%Y")
+    except ValueError:
+        return None
+
+def compute_stats(start_date_str, end_date_str, graph_column, x_axis, selected_checkboxes):
+    """Filtre les bons sur la période puis agrège graph_column par x_axis et par champ coché.
+
+    Les agrégats pré-calculés répondent à toutes les combinaisons courantes ;
+    le DataFrame complet des bons n'est chargé que pour les autres.
+    Renvoie (group_data, {champ: DataFrame agrégé ou None si le champ est inexploitable}).
+    """
+    import pandas as pd
+    sd = _parse_filter_date(start_date_str)
+    ed = _parse_filter_date(end_date_str)
+    start_iso = sd.date().isoformat() if sd else None
+    end_iso = ed.date().isoformat() if ed else None
+    group_data = query_rollup(x_axis, graph_column, start_iso, end_iso)
+    field_tables = {field: query_rollup(field, graph_column, start_iso, end_iso) for field in selected_checkboxes}
+    if group_data is not None and all(t is not None for t in field_tables.values()):
+        if group_data.empty:
+            group_data = pd.DataFrame({x_axis:[], graph_column:[]})
+        return group_data, field_tables
+
+    df = get_bons_dataframe()
+    if sd:
+        df = df[df["Date"] >= sd]
+    if ed:
+        df = df[df["Date"] <= ed]
+    if not df.empty and x_axis in df.columns and graph_column in df.columns:
+        group_data = df.groupby(x_axis, as_index=False).agg({graph_column: "sum"})
+    else:
+        group_data = pd.DataFrame({x_axis:[], graph_column:[]})
+    field_tables = {}
+    for field in selected_checkboxes:
+        try:
+            # Agrégation sur le champ sélectionné (somme du graph_column)
+            field_tables[field] = df.groupby(field)[graph_column].sum().reset_index()
+        except Exception:
+            field_tables[field] = None
+    return group_data, field_tables
+
+def _records_for_json(df):
+    if df is None:
+        return []
+    return json.loads(df.to_json(orient="records", date_format="iso", force_ascii=False))
+
+def stats_to_json(x_axis, graph_column, group_data, field_tables, data_version):
+    return {
+        "data_version": data_version,
+        "x_axis": x_axis,
+        "graph_column": graph_column,
+        "group_data": _records_for_json(group_data),
+        "selected_stats": {field: _records_for_json(group) for field, group in field_tables.items()}
+    }
+
+# =============================================================================
+# Graphiques des statistiques et cache des images PNG
+# =============================================================================
+
+# Les PNG sont mémorisés par clé (version des données, filtres, colonnes,
+# champ de regroupement, couleur du thème) dans un cache LRU borné ; le cache
+# est vidé dès que la version des données change.
+CHART_CACHE_SIZE = 64
+_chart_cache = OrderedDict()
+_chart_cache_state = {"version": None}
+_chart_cache_lock = threading.Lock()
+chart_cache_stats = {"hits": 0, "misses": 0}
+NO_CHART = b""
+
+def chart_cache_key(data_version, *parts):
+    return hashlib.sha256(json.dumps([data_version] + list(parts), default=str).encode("utf-8")).hexdigest()[:32]
+
+# Les graphiques manquants d'une même page sont dessinés en parallèle dans un
+# pool de processus : la latence de /stats est bornée par le graphique le plus
+# lent et non par leur somme. Les fonctions de rendu utilisent l'API objet
+# Figure (sans l'état global de pyplot) et restent donc sûres en threads si le
+# pool est indisponible (CHART_WORKERS=1, plateformes serverless...).
+CHART_WORKERS = int(os.environ.get("CHART_WORKERS", min(4, os.cpu_count() or 1)))
+_process_pools = {}
+_process_pools_lock = threading.Lock()
+
+def _get_process_pool(name, workers):
+    """Pool de processus (spawn) nommé, créé à la première utilisation ; None si workers <= 1."""
+    with _process_pools_lock:
+        if name not in _process_pools and workers > 1:
+            try:
+                _process_pools[name] = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            except (OSError, ValueError, NotImplementedError):
+                return None
+        return _process_pools.get(name)
+
+def _reset_process_pool(name):
+    with _process_pools_lock:
+        pool = _process_pools.pop(name, None)
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+def _get_chart_pool():
+    return _get_process_pool("graphiques", CHART_WORKERS)
+
+def _reset_chart_pool():
+    _reset_process_pool("graphiques")
+
+def _render_chart_safely(render, args):
+    """Octets PNG, NO_CHART si le graphique n'a pas de données, None si le rendu a échoué."""
+    try:
+        return render(*args)
+    except Exception as e:
+        print(f"Erreur lors du rendu du graphique {render.__name__} : {e}", file=sys.stderr)
+        return None
+
+def render_charts(data_version, chart_jobs):
+    """Renvoie {nom: (clé, octets PNG ou None)} pour des tâches {nom: (clé, fonction, arguments)}.
+
+    Seuls les graphiques absents du cache sont dessinés, en parallèle s'il y en a plusieurs.
+    Un rendu en échec n'est pas mémorisé : il sera retenté au prochain affichage.
+    """
+    results = {}
+    missing = {}
+    with _chart_cache_lock:
+        if _chart_cache_state["version"] != data_version:
+            _chart_cache.clear()
+            _chart_cache_state["version"] = data_version
+            prune_chart_files()
+        for name, (key_parts, render, args) in chart_jobs.items():
+            key = chart_cache_key(data_version, *key_parts)
+            if key in _chart_cache:
+                _chart_cache.move_to_end(key)
+                chart_cache_stats["hits"] += 1
+                results[name] = (key, _chart_cache[key] or None)
+            else:
+                chart_cache_stats["misses"] += 1
+                missing[name] = (key, render, args)
+    pool = _get_chart_pool() if len(missing) > 1 else None
+    if pool is not None:
+        try:
+            futures = {name: pool.submit(_render_chart_safely, render, args)
+                       for name, (key, render, args) in missing.items()}
+            for name, future in futures.items():
+                results[name] = (missing[name][0], future.result())
+        except (BrokenProcessPool, OSError, RuntimeError) as e:
+            print(f"Pool de rendu indisponible, rendu séquentiel : {e}", file=sys.stderr)
+            _reset_chart_pool()
+    for name, (key, render, args) in missing.items():
+        if name not in results:
+            results[name] = (key, _render_chart_safely(render, args))
+    with _chart_cache_lock:
+        if _chart_cache_state["version"] == data_version:
+            for name, (key, render, args) in missing.items():
+                png = results[name][1]
+                # Un graphique sans données (NO_CHART) est mémorisé pour ne pas
+                # être recalculé à chaque affichage ; un échec (None) ne l'est pas.
+                if png is None:
+                    continue
+                _chart_cache[key] = png
+                if png:
+                    _write_chart_file(key, png)
+            while len(_chart_cache) > CHART_CACHE_SIZE:
+                _chart_cache.popitem(last=False)
+    return {name: (key, png or None) for name, (key, png) in results.items()}
+
+# Copie disque des PNG : l'image d'une page peut être demandée à un autre
+# worker gunicorn que celui qui l'a dessinée.
+CHART_CACHE_DIR = os.path.join(AHABIAFILES_DIR, "cache", "charts")
+CHART_FILE_TTL = 3600
+os.makedirs(CHART_CACHE_DIR, exist_ok=True)
+
+def _chart_file_path(key):
+    return os.path.join(CHART_CACHE_DIR, key + ".png")
+
+def _write_chart_file(key, png):
+    try:
+        tmp_path = f"{_chart_file_path(key)}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(png)
+        os.replace(tmp_path, _chart_file_path(key))
+    except OSError as e:
+        print(f"Impossible d'écrire le graphique {key} : {e}", file=sys.stderr)
+
+def prune_chart_files():
+    """Supprime les PNG des versions de données précédentes (plus vieux que CHART_FILE_TTL)."""
+    limit = time.time() - CHART_FILE_TTL
+    try:
+        with os.scandir(CHART_CACHE_DIR) as entries:
+            for entry in entries:
+                if entry.stat().st_mtime < limit:
+                    os.remove(entry.path)
+    except OSError:
+        pass
+
+def get_chart_png(key):
+    with _chart_cache_lock:
+        png = _chart_cache.get(key)
+    if png is not None:
+        return png or None
+    try:
+        with open(_chart_file_path(key), "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+def stats_chart_jobs(start_date_str, end_date_str, graph_column, x_axis, group_data, field_tables, accent_color):
+    """Tâches de rendu des graphiques de /stats, au format attendu par render_charts."""
+    chart_params = (start_date_str, end_date_str, graph_column, accent_color)
+    chart_jobs = {}
+    # Graphiques principaux dynamiques (Histogramme et Donut) pour l'ensemble
+    if not group_data.empty and x_axis in group_data.columns and graph_column in group_data.columns:
+        x_values = group_data[x_axis].astype(str).tolist()
+        y_values = group_data[graph_column].tolist()
+        chart_jobs["histogramme"] = (chart_params + (x_axis, "histogramme"), render_bar_chart,
+                                     (x_values, y_values, x_axis, graph_column, accent_color))
+        chart_jobs["camembert"] = (chart_params + (x_axis, "camembert"), render_pie_chart,
+                                   (x_values, y_values, x_axis))
+    # Pour chaque case cochée, un histogramme et un donut côte à côte dans une figure dynamique
+    for field, group in field_tables.items():
+        if group is not None:
+            labels = group[field].astype(str).tolist()
+            values = group[graph_column].tolist()
+            chart_jobs[("champ", field)] = (chart_params + ("champ", field), render_field_chart,
+                                            (field, labels, values, graph_column, accent_color))
+    return chart_jobs
+
+def _new_figure(figsize):
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib.figure import Figure
+    return Figure(figsize=figsize, dpi=100)
+
+def _figure_to_png(fig):
+    buffer = BytesIO()
+    fig.savefig(buffer, format='png')
+    return buffer.getvalue()
+
+def render_bar_chart(x_values, y_values, x_axis, graph_column, accent_color):
+    fig_bar = _new_figure((5,4))
+    ax_bar = fig_bar.subplots()
+    ax_bar.bar(x_values, y_values, color=accent_color)
+    ax_bar.set_title(f"Histogramme selon {x_axis}")
+    ax_bar.set_xlabel(x_axis)
+    ax_bar.set_ylabel(graph_column)
+    for label in ax_bar.get_xticklabels():
+        label.set_rotation(45)
+    fig_bar.tight_layout()
+    return _figure_to_png(fig_bar)
+
+def render_pie_chart(x_values, y_values, x_axis):
+    if sum(y_values) <= 0:
+        return NO_CHART
+    fig_pie = _new_figure((5,4))
+    ax_pie = fig_pie.subplots()
+    wedges, texts, autotexts = ax_pie.pie(y_values, autopct='%1.1f%%', startangle=90, wedgeprops={'width':0.3})
+    ax_pie.set_title(f"Camembert selon {x_axis}")
+    ax_pie.legend(wedges, x_values, title=x_axis, loc="center left", bbox_to_anchor=(1, 0.5), fontsize=10, title_fontsize=12)
+    fig_pie.tight_layout()
+    return _figure_to_png(fig_pie)
+
+def render_field_chart(field, labels, values, graph_column, accent_color):
+    fig = _new_figure((10,4))
+    ax1, ax2 = fig.subplots(1, 2)
+    # Histogramme
+    ax1.bar(labels, values, color=accent_color)
+    ax1.set_title(f"Histogramme par {field}")
+    ax1.set_xlabel(field)
+    ax1.set_ylabel(graph_column)
+    for label in ax1.get_xticklabels():
+        label.set_rotation(45)
+    # Donut chart
+    if sum(values) > 0:
+        wedges, texts, autotexts = ax2.pie(values, autopct='%1.1f%%', startangle=90, wedgeprops={'width':0.3})
+        ax2.set_title(f"Donut par {field}")
+        ax2.legend(wedges, labels, title=field, loc="center left", bbox_to_anchor=(1, 0.5), fontsize=10, title_fontsize=12)
+    else:
+        ax2.text(0.5, 0.5, "Aucune donnée", ha="center", va="center")
+    fig.tight_layout()
+    return _figure_to_png(fig)
+
+# =============================================================================
+# Import en masse des bons (CSV / JSON)
+# =============================================================================
+
+bulk_int_columns = ["Nb Ouvriers Cueilleurs", "Nb Ouvriers Indirect", "Nb Ouvriers Autres",
+                    "Total Ouvriers", "Nombre Caporaux"]
+bulk_float_columns = ["Poids Total Cueillis (kg)", "Écarts (Produit Déchet) en kg", "Poids Global"]
+# Colonnes acceptées mais ignorées (présentes dans l'export CSV de /export) :
+# chaque bon importé reçoit un nouveau numéro.
+bulk_ignored_columns = ["Numéro Bon"]
+
+def parse_bulk_rows(content, filename=""):
+    """Lit un fichier CSV (séparateur ; ou ,) ou JSON (liste d'objets) et renvoie une liste de dictionnaires."""
+    if isinstance(content, bytes):
+        content = content.decode("utf-8-sig")
+    text = content.strip()
+    if filename.lower().endswith(".json") or text.startswith("[") or text.startswith("{"):
+        data = json.loads(text)
+        if isinstance(data, dict):
+            data = data.get("bons", [])
+        if not isinstance(data, list) or not all(isinstance(r, dict) for r in data):
+            raise ValueError("Le JSON doit contenir une liste d'objets.")
+        return data
+    try:
+        dialect = csv.Sniffer().sniff(text.splitlines()[0], delimiters=";,")
+    except (csv.Error, IndexError):
+        dialect = csv.excel
+    return list(csv.DictReader(StringIO(text), dialect=dialect))
+
+def validate_bulk_rows(rows):
+    """Valide les lignes par rapport à column_order ; renvoie (lignes propres, erreurs)."""
+    clean_rows = []
+    errors = []
+    for line_no, raw in enumerate(rows, start=1):
+        row = {str(k).strip(): ("" if v is None else v) for k, v in raw.items()
+               if k is not None and str(k).strip() not in bulk_ignored_columns}
+        unknown = [k for k in row if k not in column_order]
+        if unknown:
+            errors.append(f"Ligne {line_no} : colonnes inconnues {', '.join(unknown)}")
+            continue
+        date_saisie = str(row.get("Date (JJ/MM/AAAA)", "")).strip()
+        if _date_to_iso(date_saisie) is None:
+            errors.append(f"Ligne {line_no} : date invalide '{date_saisie}' (JJ/MM/AAAA attendu)")
+            continue
+        agriculteur = str(row.get("Agriculteur", "")).strip()
+        if not agriculteur:
+            errors.append(f"Ligne {line_no} : agriculteur manquant")
+            continue
+        clean = {
+            "Date (JJ/MM/AAAA)": date_saisie,
+            "Agriculteur": agriculteur,
+            "Parcelle": str(row.get("Parcelle", "")).strip(),
+            "Produit": str(row.get("Produit", "")).strip(),
+            "Variété": str(row.get("Variété", "")).strip(),
+        }
+        try:
+            for col in bulk_int_columns:
+                val = str(row.get(col, "")).strip()
+                clean[col] = int(float(val.replace(",", "."))) if val else 0
+            for col in bulk_float_columns:
+                val = str(row.get(col, "")).strip()
+                clean[col] = float(val.replace(",", ".")) if val else 0.0
+        except ValueError:
+            errors.append(f"Ligne {line_no} : valeur numérique invalide dans '{col}'")
+            continue
+        # Les totaux sont toujours recalculés, comme dans le formulaire de saisie
+        clean["Total Ouvriers"] = clean["Nb Ouvriers Cueilleurs"] + clean["Nb Ouvriers Indirect"] + clean["Nb Ouvriers Autres"]
+        clean["Poids Global"] = clean["Poids Total Cueillis (kg)"] + clean["Écarts (Produit Déchet) en kg"]
+        clean_rows.append(clean)
+    return clean_rows, errors
+
+def import_bons(rows):
+    """Valide puis insère un lot de bons en une seule transaction ; renvoie (numéros, erreurs)."""
+    clean_rows, errors = validate_bulk_rows(rows)
+    if errors or not clean_rows:
+        return [], errors or ["Aucune ligne à importer."]
+    nums = generate_voucher_numbers([r["Agriculteur"] for r in clean_rows])
+    for row, num_bon in zip(clean_rows, nums):
+        row["Numéro Bon"] = num_bon
+    with db_connection() as conn:
+        _insert_bon_rows(conn, clean_rows)
+    invalidate_bons_cache()
+    return nums, []
+
+@app.cli.command("import-bons")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+def import_bons_command(path):
+    """Importe un fichier CSV ou JSON de bons de livraison."""
+    with open(path, "rb") as f:
+        rows = parse_bulk_rows(f.read(), path)
+    nums, errors = import_bons(rows)
+    if errors:
+        for err in errors:
+            click.echo(err, err=True)
+        raise SystemExit(1)
+    click.echo(f"{len(nums)} bons importés ({nums[0]} à {nums[-1]}).")
+
+# =============================================================================
+# Travaux en arrière-plan (rapports PDF)
+# =============================================================================
+
+# Les rapports longs sont produits hors requête par un pool de threads ;
+# l'état des travaux est conservé dans la table SQLite « travaux », partagée
+# par tous les workers gunicorn. Un travail resté en attente ou en cours dans
+# un processus qui n'existe plus est marqué en échec au démarrage.
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_OWNER = f"{platform.node()}:{os.getpid()}"
+_job_pool = None
+_job_pool_lock = threading.Lock()
+job_handlers = {}
+
+def _get_job_pool():
+    global _job_pool
+    with _job_pool_lock:
+        if _job_pool is None:
+            _job_pool = ThreadPoolExecutor(max_workers=max(JOB_WORKERS, 1), thread_name_prefix="travaux")
+        return _job_pool
+
+def job_handler(job_type):
+    """Enregistre la fonction (job_id, paramètres) -> chemin du fichier produit pour un type de travail."""
+    def register(func):
+        job_handlers[job_type] = func
+        return func
+    return register
+
+def _update_job(job_id, **fields):
+    fields["maj_le"] = datetime.datetime.now().isoformat()
+    with db_connection() as conn:
+        conn.execute(
+            "UPDATE travaux SET {} WHERE id = ?".format(", ".join(f"{k} = ?" for k in fields)),
+            list(fields.values()) + [job_id]
+        )
+
+def submit_job(job_type, params):
+    """Enregistre un travail, le confie au pool et renvoie aussitôt son identifiant."""
+    if job_type not in job_handlers:
+        raise ValueError(f"Type de travail inconnu : {job_type}")
+    job_id = uuid.uuid4().hex
+    now = datetime.datetime.now().isoformat()
+    with db_connection() as conn:
+        conn.execute(
+            "INSERT INTO travaux (id, type, statut, parametres, proprietaire, cree_le, maj_le) "
+            "VALUES (?, ?, 'en_attente', ?, ?, ?, ?)",
+            (job_id, job_type, json.dumps(params, ensure_ascii=False), JOB_OWNER, now, now)
+        )
+    _get_job_pool().submit(_run_job, job_id, job_type, params)
+    return job_id
+
+def _run_job(job_id, job_type, params):
+    _update_job(job_id, statut="en_cours")
+    try:
+        chemin = job_handlers[job_type](job_id, params)
+    except Exception as e:
+        print(f"Échec du travail {job_id} ({job_type}) : {e}", file=sys.stderr)
+        _update_job(job_id, statut="echec", message=str(e))
+    else:
+        _update_job(job_id, statut="termine", chemin=chemin)
+
+def update_job_progress(job_id, progression, total):
+    _update_job(job_id, progression=progression, total=total)
+
+def get_job(job_id):
+    with db_connection() as conn:
+        row = conn.execute("SELECT * FROM travaux WHERE id = ?", (job_id,)).fetchone()
+    return dict(row) if row else None
+
+def _owner_alive(owner):
+    """Indique si le processus propriétaire d'un travail tourne encore sur cette machine."""
+    host, _, pid = (owner or "").rpartition(":")
+    if host != platform.node() or not pid.isdigit() or int(pid) == os.getpid():
+        return False
+    if platform.system() == "Windows":
+        # Serveur de développement mono-processus : tout autre propriétaire a disparu
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def fail_orphaned_jobs():
+    """Marque en échec les travaux interrompus par l'arrêt de leur processus."""
+    with db_connection() as conn:
+        rows = conn.execute(
+            "SELECT id, proprietaire FROM travaux WHERE statut IN ('en_attente', 'en_cours')"
+        ).fetchall()
+        orphaned = [row["id"] for row in rows if not _owner_alive(row["proprietaire"])]
+        conn.executemany(
+            "UPDATE travaux SET statut = 'echec', message = ?, maj_le = ? WHERE id = ?",
+            [("Interrompu par un redémarrage du serveur", datetime.datetime.now().isoformat(), job_id)
+             for job_id in orphaned]
+        )
+    return len(orphaned)
+
+def build_stats_report(params, report_num, pdf_path):
+    """Construit le rapport PDF de statistiques décrit par les paramètres du formulaire /stats."""
+    from reportlab.platypus import Table, Spacer, Paragraph, PageBreak, Image
+    start_date_str = params.get("start_date", "")
+    end_date_str = params.get("end_date", "")
+    graph_column = params.get("graph_column", "Poids Total Cueillis (kg)")
+    x_axis = params.get("x_axis", "Date (JJ/MM/AAAA)")
+    data_version = get_data_version()
+    group_data, field_tables = compute_stats(start_date_str, end_date_str, graph_column, x_axis,
+                                             params.get("checkbox_fields", []))
+    charts = render_charts(data_version, stats_chart_jobs(start_date_str, end_date_str, graph_column, x_axis,
+                                                          group_data, field_tables, params.get("accent")))
+    bar_png = charts.get("histogramme", (None, None))[1]
+    pie_png = charts.get("camembert", (None, None))[1]
+    selected_stats = {}
+    for field, group in field_tables.items():
+        selected_stats[field] = {
+            "table": group.to_dict(orient="records") if group is not None else [],
+            "png": charts.get(("champ", field), (None, None))[1]
+        }
+    styles = PDFGenerator.styles()
+    table_styles = PDFGenerator.table_styles()
+    elements = []
+    # Tableau et graphiques principaux
+    elements.append(Paragraph(f"Rapport de statistiques du {start_date_str} au {end_date_str}", styles["Heading2"]))
+    elements.append(Spacer(1, 12))
+    elements.append(Paragraph("N° Rapport: " + report_num, styles["Heading2"]))
+    elements.append(Spacer(1, 12))
+    elements.append(Paragraph(f"Statistiques selon '{x_axis}'", styles['Heading2']))
+    available_width = PDFGenerator.geometry()[0][0] - 40
+    col_widths = [available_width * 0.5, available_width * 0.5]
+    data_table = [[x_axis, graph_column]]
+    for _, row in group_data.iterrows():
+        data_table.append([str(row[x_axis]), row[graph_column]])
+    table_pdf = Table(data_table, repeatRows=1, colWidths=col_widths)
+    table_pdf.hAlign = 'CENTER'
+    table_pdf.setStyle(table_styles["stats"])
+    elements.append(table_pdf)
+    elements.append(Spacer(1, 12))
+    # Insertion des graphiques principaux
+    images = []
+    if bar_png:
+        images.append(Image(BytesIO(bar_png), width=available_width*0.48, height=250))
+    if bar_png and pie_png:
+        images.append(Image(BytesIO(pie_png), width=available_width*0.48, height=250))
+    if images:
+        table_images = Table([images], colWidths=[available_width*0.5, available_width*0.5])
+        table_images.hAlign = 'CENTER'
+        elements.append(table_images)
+    elements.append(PageBreak())
+    # Pour chaque case cochée, insertion d'un tableau et d'un graphique avec saut de page
+    for field, stats_data in selected_stats.items():
+        elements.append(Paragraph(f"Statistiques pour {field} :", styles["Heading2"]))
+        table_data = [[field, graph_column]]
+        for row in stats_data["table"]:
+            table_data.append([str(row[field]), row[graph_column]])
+        stat_table = Table(table_data, repeatRows=1)
+        stat_table.hAlign = 'CENTER'
+        stat_table.setStyle(table_styles["champ"])
+        elements.append(stat_table)
+        elements.append(Spacer(1, 12))
+        if stats_data.get("png"):
+            elements.append(Image(BytesIO(stats_data["png"]), width=available_width, height=250))
+        elements.append(PageBreak())
+    PDFGenerator.generate_stats_pdf(elements, pdf_path)
+
+@job_handler("rapport_stats")
+def _job_rapport_stats(job_id, params):
+    report_num = generate_report_number("Rapport")
+    pdf_file_name = f"Rapport_{params.get('graph_column', '')}_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}_{job_id[:8]}.pdf"
+    pdf_path = os.path.join(PDF_STATS_DIR, pdf_file_name)
+    build_stats_report(params, report_num, pdf_path)
+    add_report_history(report_num, "Statistiques", pdf_path)
+    return pdf_path
+
+# Export en lot des bons de livraison : les PDF sont dessinés dans le pool de
+# processus des graphiques, puis fusionnés (pypdf / PyPDF2 si installé) ou
+# regroupés dans une archive ZIP.
+PDF_EXPORT_DIR = os.path.join(AHABIAFILES_DIR, "PDF_Export")
+# Les exports en masse (et dossiers de travail abandonnés) sont supprimés
+# après PDF_EXPORT_TTL secondes : ils ne figurent pas dans l'historique.
+PDF_EXPORT_TTL = int(os.environ.get("PDF_EXPORT_TTL", str(7 * 24 * 3600)))
+os.makedirs(PDF_EXPORT_DIR, exist_ok=True)
+
+def prune_export_files():
+    """Supprime les exports de PDF_EXPORT_DIR plus vieux que PDF_EXPORT_TTL."""
+    limit = time.time() - PDF_EXPORT_TTL
+    try:
+        with os.scandir(PDF_EXPORT_DIR) as entries:
+            for entry in entries:
+                if entry.stat().st_mtime >= limit:
+                    continue
+                if entry.is_dir():
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    os.remove(entry.path)
+    except OSError:
+        pass
+
+def delivery_pdf_data(row, fruit):
+    """Données de PDFGenerator.generate_delivery_pdf pour un bon (dictionnaire indexé par les en-têtes)."""
+    return {
+        "num_bon": "N° Bon: " + str(row.get("Numéro Bon") or ""),
+        "fruit": fruit,
+        "fields": [(col, row.get(col, "")) for col in column_order]
+    }
+
+def _render_delivery_pdf(data, pdf_path):
+    # Nom temporaire : seul un PDF complet porte le nom final
+    tmp_path = f"{pdf_path}.{os.getpid()}.tmp"
+    PDFGenerator.generate_delivery_pdf(data, tmp_path)
+    os.replace(tmp_path, pdf_path)
+    return pdf_path
+
+# Pool dédié aux exports en masse, distinct de celui des graphiques : un
+# export de plusieurs centaines de bons ne fait pas attendre /stats. Au plus
+# EXPORT_PDF_INFLIGHT bons sont soumis à la fois.
+EXPORT_PDF_WORKERS = int(os.environ.get("EXPORT_PDF_WORKERS", min(2, os.cpu_count() or 1)))
+EXPORT_PDF_INFLIGHT = 2 * EXPORT_PDF_WORKERS
+
+def delivery_pdf_for_bon(bon_id, fruit):
+    """Renvoie (chemin, empreinte) du PDF d'un bon, généré seulement si son contenu a changé.
+
+    Le fichier est nommé d'après le numéro de bon enregistré, l'identifiant de
+    la ligne (deux bons peuvent partager un numéro) et l'empreinte de son
+    contenu : un même bon téléchargé deux fois réutilise le même fichier.
+    Renvoie None si le bon n'existe pas.
+    """
+    row = fetch_bon(bon_id)
+    if row is None:
+        return None
+    data = delivery_pdf_data(row, fruit)
+    digest = hashlib.sha256(json.dumps(data, default=str, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+    num_bon = re.sub(r"[^\w-]", "_", str(row.get("Numéro Bon") or "")) or f"id{bon_id}"
+    prefix = os.path.join(PDF_LIVRAISON_DIR, f"bon_de_livraison_{num_bon}_{bon_id}_")
+    pdf_path = f"{prefix}{digest}.pdf"
+    if not os.path.exists(pdf_path):
+        tmp_path = f"{pdf_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        PDFGenerator.generate_delivery_pdf(data, tmp_path)
+        os.replace(tmp_path, pdf_path)
+        # Les versions précédentes du même bon sont périmées
+        for path in glob.glob(glob.escape(prefix) + "?" * len(digest) + ".pdf"):
+            if path != pdf_path:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+    return pdf_path, digest
+
+def _pdf_writer_class():
+    try:
+        from pypdf import PdfWriter
+    except ImportError:
+        try:
+            from PyPDF2 import PdfWriter
+        except ImportError:
+            return None
+    return PdfWriter
+
+def _render_export_pdfs(job_id, tasks):
+    """Dessine les PDF (données, chemin) d'un export, dans le pool d'export s'il est disponible.
+
+    Aucun rendu n'est encore en cours au retour, même en cas d'erreur : le
+    dossier de travail peut être supprimé sans course avec le pool.
+    """
+    total = len(tasks)
+    update_job_progress(job_id, 0, total)
+    done = 0
+    last_report = time.monotonic()
+    pool = _get_process_pool("export_pdf", EXPORT_PDF_WORKERS) if total > 1 else None
+    pending = list(tasks)
+    if pool is not None:
+        running = set()
+        try:
+            queue = iter(tasks)
+            while True:
+                for data, pdf_path in queue:
+                    running.add(pool.submit(_render_delivery_pdf, data, pdf_path))
+                    if len(running) >= EXPORT_PDF_INFLIGHT:
+                        break
+                if not running:
+                    break
+                finished, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    future.result()
+                    done += 1
+                if time.monotonic() - last_report >= 0.5:
+                    update_job_progress(job_id, done, total)
+                    last_report = time.monotonic()
+            pending = []
+        except (BrokenProcessPool, OSError, RuntimeError) as e:
+            print(f"Pool d'export indisponible, rendu séquentiel : {e}", file=sys.stderr)
+            _reset_process_pool("export_pdf")
+            pending = None
+        finally:
+            for future in running:
+                future.cancel()
+            wait(running)
+        if pending is None:
+            pending = [(data, pdf_path) for data, pdf_path in tasks if not os.path.exists(pdf_path)]
+            done = total - len(pending)
+    for data, pdf_path in pending:
+        _render_delivery_pdf(data, pdf_path)
+        done += 1
+        if time.monotonic() - last_report >= 0.5:
+            update_job_progress(job_id, done, total)
+            last_report = time.monotonic()
+    update_job_progress(job_id, total, total)
+
+@job_handler("export_bons_pdf")
+def _job_export_bons_pdf(job_id, params):
+    bons_rows = fetch_bons_filtered(params)
+    if not bons_rows:
+        raise ValueError("Aucun bon ne correspond aux filtres.")
+    fruit = params.get("fruit") or load_user_theme()
+    work_dir = tempfile.mkdtemp(prefix=f"bons_{job_id[:8]}_", dir=PDF_EXPORT_DIR)
+    try:
+        tasks = []
+        for n, row in enumerate(bons_rows):
+            name = "{:04d}_{}.pdf".format(n + 1, row.get("Numéro Bon") or row["_idx"])
+            tasks.append((delivery_pdf_data(row, fruit), os.path.join(work_dir, name)))
+        _render_export_pdfs(job_id, tasks)
+
+        # Le document est assemblé dans work_dir puis déplacé : un échec ne
+        # laisse aucun fichier partiel dans PDF_EXPORT_DIR.
+        stamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+        pdf_paths = [pdf_path for _, pdf_path in tasks]
+        writer_class = _pdf_writer_class() if params.get("format") == "pdf" else None
+        if writer_class is not None:
+            out_name = f"bons_{stamp}_{job_id[:8]}.pdf"
+            writer = writer_class()
+            for pdf_path in pdf_paths:
+                writer.append(pdf_path)
+            with open(os.path.join(work_dir, out_name), "wb") as f:
+                writer.write(f)
+        else:
+            if params.get("format") == "pdf":
+                # Le message reste affiché sur la page de suivi une fois le travail terminé
+                _update_job(job_id, message="PDF unique indisponible (pypdf / PyPDF2 non installé) : "
+                                            "les bons sont livrés dans une archive ZIP.")
+            out_name = f"bons_{stamp}_{job_id[:8]}.zip"
+            with zipfile.ZipFile(os.path.join(work_dir, out_name), "w", zipfile.ZIP_DEFLATED) as archive:
+                for pdf_path in pdf_paths:
+                    archive.write(pdf_path, os.path.basename(pdf_path))
+        out_path = os.path.join(PDF_EXPORT_DIR, out_name)
+        os.replace(os.path.join(work_dir, out_name), out_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return out_path
+
 # =============================================================================
 # Partie PayPal et Achat de Plans
 # =============================================================================
@@ -392,72 +2079,233 @@ if "Annee" not in all_columns_extended:
 # Modification : les clés PayPal sont désormais chargées depuis les variables d'environnement
 PAYPAL_CLIENT_ID = os.environ.get("PAYPAL_CLIENT_ID") or "ATyh7nhaFjHLqrD4Bvp1Y2tXLeRub-9733ONYXASKr0sq6YEvbZm1QjcToKzFVRv6dIcGmyudbZT6YyL"
 PAYPAL_SECRET = os.environ.get("PAYPAL_SECRET") or "EPysjDOTBgxhecho8xFualacKDeJn9udQebusanBYglTaBnW5lOT-Tg2v3gN5es_UJXXOGCVO0RG24bN"
-PAYPAL_OAUTH_URL = "https://api-m.sandbox.paypal.com/v1/oauth2/token"
-PAYPAL_ORDER_API = "https://api-m.sandbox.paypal.com/v2/checkout/orders"
+# URL de l'API : sandbox par défaut, production ou serveur de test local
+# (python paypal_stub.py) via PAYPAL_API_BASE.
+PAYPAL_API_BASE = os.environ.get("PAYPAL_API_BASE", "https://api-m.sandbox.paypal.com").rstrip("/")
+# (connexion, lecture) en secondes : un PayPal lent ne bloque jamais un worker indéfiniment
+PAYPAL_TIMEOUT = (float(os.environ.get("PAYPAL_CONNECT_TIMEOUT", "3.05")),
+                  float(os.environ.get("PAYPAL_READ_TIMEOUT", "15")))
+PAYPAL_MAX_RETRIES = int(os.environ.get("PAYPAL_MAX_RETRIES", "3"))
+# Durée maximale d'un appel, tentatives, attentes et renouvellement du jeton
+# compris : reste sous le délai des workers gunicorn (30 s).
+PAYPAL_TOTAL_TIMEOUT = float(os.environ.get("PAYPAL_TOTAL_TIMEOUT", "25"))
 
-def get_paypal_access_token():
-    response = requests.post(
-        PAYPAL_OAUTH_URL,
-        headers={"Accept": "application/json", "Accept-Language": "en_US"},
-        data={"grant_type": "client_credentials"},
-        auth=(PAYPAL_CLIENT_ID, PAYPAL_SECRET)
-    )
-    if response.status_code == 200:
-        return response.json()["access_token"]
-    else:
-        raise Exception(f"Erreur obtention token PayPal: {response.status_code} {response.text}")
+class PaypalError(Exception):
+    pass
 
-def create_paypal_order(amount, currency="USD"):
-    token = get_paypal_access_token()
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {token}"
-    }
-    body = {
-        "intent": "CAPTURE",
-        "purchase_units": [
-            {
-                "amount": {
-                    "currency_code": currency,
-                    "value": amount
+class PaypalClient:
+    """Client de l'API PayPal : une session HTTP partagée (connexions réutilisées),
+    un jeton OAuth mis en cache jusqu'à peu avant son expiration, des délais
+    bornés et des nouvelles tentatives sans double effet grâce à PayPal-Request-Id.
+    """
+    # Marge avant l'expiration annoncée (expires_in) à laquelle le jeton est renouvelé
+    TOKEN_MARGIN = 60
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, client_id, secret, base_url=PAYPAL_API_BASE, timeout=PAYPAL_TIMEOUT,
+                 max_retries=PAYPAL_MAX_RETRIES, backoff=0.5, total_timeout=PAYPAL_TOTAL_TIMEOUT,
+                 sleep=time.sleep):
+        self.client_id = client_id
+        self.secret = secret
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.total_timeout = total_timeout
+        # Attente entre deux tentatives (remplaçable, par exemple dans les tests)
+        self.sleep = sleep
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._token = None
+        self._token_expiry = 0.0
+        self._token_lock = threading.Lock()
+
+    @property
+    def session(self):
+        """Session HTTP partagée, créée au premier appel (requests n'est pas chargé au démarrage)."""
+        with self._session_lock:
+            if self._session is None:
+                import requests
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=10)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._session = session
+            return self._session
+
+    def _deadline(self):
+        return time.monotonic() + self.total_timeout
+
+    def _send(self, method, path, deadline=None, **kwargs):
+        """Envoie la requête, en la rejouant sur erreur réseau, délai dépassé ou réponse 429/5xx.
+
+        Aucune tentative ni attente ne dépasse deadline (time.monotonic()) : une
+        fois le budget épuisé, la dernière réponse est renvoyée ou PaypalError levée.
+        """
+        import requests
+        url = self.base_url + path
+        if deadline is None:
+            deadline = self._deadline()
+        for attempt in range(self.max_retries + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise PaypalError(f"PayPal : délai total de {self.total_timeout:g} s dépassé ({method} {path})")
+            timeout = (min(self.timeout[0], remaining), min(self.timeout[1], remaining))
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                response, error = None, e
+            else:
+                if response.status_code not in self.RETRY_STATUSES:
+                    return response
+            delay = self.backoff * (2 ** attempt)
+            if attempt >= self.max_retries or time.monotonic() + delay >= deadline:
+                if response is not None:
+                    return response
+                raise PaypalError(f"PayPal injoignable ({method} {path}) : {error}") from error
+            self.sleep(delay)
+
+    def access_token(self, deadline=None):
+        with self._token_lock:
+            if self._token and time.monotonic() < self._token_expiry:
+                return self._token
+            response = self._send(
+                "POST", "/v1/oauth2/token", deadline=deadline,
+                headers={"Accept": "application/json", "Accept-Language": "en_US"},
+                data={"grant_type": "client_credentials"},
+                auth=(self.client_id, self.secret)
+            )
+            if response.status_code != 200:
+                raise PaypalError(f"Erreur obtention token PayPal: {response.status_code} {response.text}")
+            data = response.json()
+            self._token = data["access_token"]
+            self._token_expiry = time.monotonic() + max(int(data.get("expires_in", 0)) - self.TOKEN_MARGIN, 0)
+            return self._token
+
+    def invalidate_token(self):
+        with self._token_lock:
+            self._token = None
+            self._token_expiry = 0.0
+
+    def _api(self, method, path, request_id=None, **kwargs):
+        """Appel authentifié ; le même PayPal-Request-Id est renvoyé à chaque tentative.
+
+        Toutes les tentatives, renouvellement du jeton compris, partagent le budget total_timeout.
+        """
+        deadline = self._deadline()
+        headers = {"Content-Type": "application/json"}
+        if request_id:
+            headers["PayPal-Request-Id"] = request_id
+        for renewed in (False, True):
+            headers["Authorization"] = f"Bearer {self.access_token(deadline)}"
+            response = self._send(method, path, deadline=deadline, headers=headers, **kwargs)
+            if response.status_code != 401 or renewed:
+                return response
+            # Jeton révoqué ou expiré plus tôt que prévu : un seul renouvellement
+            self.invalidate_token()
+
+    def create_order(self, amount, currency, return_url, cancel_url, request_id=None):
+        body = {
+            "intent": "CAPTURE",
+            "purchase_units": [
+                {
+                    "amount": {
+                        "currency_code": currency,
+                        "value": amount
+                    }
                 }
+            ],
+            "application_context": {
+                "return_url": return_url,
+                "cancel_url": cancel_url
             }
-        ],
-        "application_context": {
-            "return_url": url_for("paypal_success", _external=True),
-            "cancel_url": url_for("paypal_cancel", _external=True)
         }
-    }
-    response = requests.post(PAYPAL_ORDER_API, json=body, headers=headers)
-    if response.status_code in (200, 201):
+        response = self._api("POST", "/v2/checkout/orders", request_id=request_id or uuid.uuid4().hex, json=body)
+        if response.status_code not in (200, 201):
+            raise PaypalError(f"Erreur création ordre PayPal: {response.status_code} {response.text}")
         data = response.json()
-        order_id = data["id"]
         approval_url = None
-        for link in data["links"]:
+        for link in data.get("links", []):
             if link["rel"] in ("approve", "payer-action"):
                 approval_url = link["href"]
                 break
-        return order_id, approval_url
-    else:
-        raise Exception(f"Erreur création ordre PayPal: {response.status_code} {response.text}")
+        return data["id"], approval_url
+
+    def get_order(self, order_id):
+        response = self._api("GET", f"/v2/checkout/orders/{order_id}")
+        if response.status_code != 200:
+            raise PaypalError(f"Erreur lecture ordre PayPal: {response.status_code} {response.text}")
+        return response.json()
+
+    def capture_order(self, order_id):
+        """Capture l'ordre ; True si le paiement est (ou était déjà) complété."""
+        # Identifiant de requête dérivé de l'ordre : rejouer la capture ne débite pas deux fois
+        response = self._api("POST", f"/v2/checkout/orders/{order_id}/capture", request_id=f"capture-{order_id}")
+        if response.status_code in (200, 201):
+            return response.json().get("status") == "COMPLETED"
+        if response.status_code == 422 and "ORDER_ALREADY_CAPTURED" in response.text:
+            return self.get_order(order_id).get("status") == "COMPLETED"
+        return False
+
+paypal_client = PaypalClient(PAYPAL_CLIENT_ID, PAYPAL_SECRET)
+
+def get_paypal_access_token():
+    return paypal_client.access_token()
+
+def create_paypal_order(amount, currency="USD"):
+    return paypal_client.create_order(
+        amount, currency,
+        return_url=url_for("paypal_success", _external=True),
+        cancel_url=url_for("paypal_cancel", _external=True)
+    )
 
 def capture_paypal_order(order_id):
-    token = get_paypal_access_token()
-    url = f"{PAYPAL_ORDER_API}/{order_id}/capture"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {token}"
-    }
-    response = requests.post(url, headers=headers)
-    if response.status_code in (200, 201):
-        data = response.json()
-        if data.get("status") == "COMPLETED":
-            return True
+    try:
+        return paypal_client.capture_order(order_id)
+    except PaypalError as e:
+        print(f"Capture PayPal impossible pour {order_id} : {e}", file=sys.stderr)
         return False
-    return False
 
-# Dictionnaire global pour mémoriser temporairement le plan acheté par commande
-purchase_orders = {}
+# Commandes en attente de paiement, partagées par tous les workers gunicorn :
+# le retour /paypal_success peut arriver sur un autre worker que /purchase_plan.
+# Les commandes expirent après PAYPAL_ORDER_TTL et sont purgées au plus une
+# fois par PAYPAL_ORDER_CLEANUP_INTERVAL.
+PAYPAL_ORDER_TTL = int(os.environ.get("PAYPAL_ORDER_TTL", str(3 * 3600)))
+PAYPAL_ORDER_CLEANUP_INTERVAL = 600
+_purchase_cleanup = {"last": 0.0}
+
+def purge_expired_purchase_orders():
+    _purchase_cleanup["last"] = time.time()
+    with db_connection() as conn:
+        return conn.execute("DELETE FROM commandes_paypal WHERE expire_le < ?", (time.time(),)).rowcount
+
+def remember_purchase_order(order_id, plan):
+    now = time.time()
+    if now - _purchase_cleanup["last"] >= PAYPAL_ORDER_CLEANUP_INTERVAL:
+        purge_expired_purchase_orders()
+    with db_connection() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO commandes_paypal (order_id, plan, statut, cree_le, expire_le) "
+            "VALUES (?, ?, 'en_attente', ?, ?)",
+            (order_id, plan, now, now + PAYPAL_ORDER_TTL)
+        )
+
+def get_purchase_order(order_id):
+    """Commande non expirée (dictionnaire plan / statut), ou None."""
+    with db_connection() as conn:
+        row = conn.execute(
+            "SELECT plan, statut FROM commandes_paypal WHERE order_id = ? AND expire_le >= ?",
+            (order_id, time.time())
+        ).fetchone()
+    return dict(row) if row else None
+
+def mark_purchase_captured(order_id):
+    """Passe la commande à « capturee » ; False si un autre retour l'a déjà fait."""
+    with db_connection() as conn:
+        return conn.execute(
+            "UPDATE commandes_paypal SET statut = 'capturee' WHERE order_id = ? AND statut = 'en_attente'",
+            (order_id,)
+        ).rowcount == 1
 
 @app.route("/purchase_plan/<plan>")
 def purchase_plan(plan):
@@ -466,7 +2314,7 @@ def purchase_plan(plan):
     amount = "10.00" if plan == "1 an" else "40.00"
     try:
         order_id, approval_url = create_paypal_order(amount, "EUR")
-        purchase_orders[order_id] = plan
+        remember_purchase_order(order_id, plan)
         return redirect(approval_url)
     except Exception as e:
         return f"Erreur: {e}"
@@ -476,14 +2324,19 @@ def paypal_success():
     order_id = request.args.get("token", None)
     if not order_id:
         return "Paramètre 'token' manquant dans l'URL."
+    order = get_purchase_order(order_id)
+    if order is not None and order["statut"] == "capturee":
+        # Retour PayPal rejoué : le plan a déjà été activé
+        flash(f"Paiement validé pour le plan {order['plan']} !", "success")
+        return redirect(url_for("saisie"))
     success = capture_paypal_order(order_id)
     if success:
-        plan = purchase_orders.get(order_id)
-        if plan:
-            update_activation_after_payment(plan)
-            flash(f"Paiement validé pour le plan {plan} !", "success")
-        else:
+        if order is None:
             flash("Paiement validé, mais plan inconnu.", "error")
+        else:
+            if mark_purchase_captured(order_id):
+                update_activation_after_payment(order["plan"])
+            flash(f"Paiement validé pour le plan {order['plan']} !", "success")
         return redirect(url_for("saisie"))
     else:
         flash("Paiement non complété.", "error")
@@ -504,75 +2357,75 @@ def enforce_activation_flask():
         if not check_activation():
             return redirect(url_for("activation"))
 
+PAGE_TEMPLATES["activation.html"] = """
+<!DOCTYPE html>
+<html lang="fr">
+<head>
+  <meta charset="UTF-8"/>
+  <title>Activation du logiciel</title>
+  <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css" rel="stylesheet">
+</head>
+<body class="bg-light">
+  <div class="container my-5">
+    <div class="card shadow">
+      <div class="card-body">
+        <h2 class="mb-4">Activation du logiciel</h2>
+        <p>ID du PC :</p>
+        <div class="input-group mb-3">
+          <input type="text" class="form-control" readonly value="{{ hw_id }}">
+        </div>
+        <p class="text-muted">Pour les plans 1 an et illimité, vous pouvez choisir parmi plusieurs options :</p>
+        <form action="{{ url_for('activate') }}" method="POST">
+          <div class="mb-3">
+            <label for="plan" class="form-label">Sélectionnez le Plan :</label>
+            <select name="plan" id="plan" class="form-select">
+              <option value="essai_7jours">Essai Gratuit 7 jours</option>
+              <option value="1 an">1 an (10€)</option>
+              <option value="illimité">Illimité (40€)</option>
+            </select>
+          </div>
+          <div class="mb-3" id="codeDiv">
+            <label for="activation_code" class="form-label">Code d'Activation :</label>
+            <input type="text" name="activation_code" id="activation_code" class="form-control" placeholder="Saisir le code d'activation (si disponible)">
+          </div>
+          <div id="contactOptions" style="display:none;" class="mb-3">
+            <button type="button" class="btn btn-success me-2" onclick="window.location.href='https://api.whatsapp.com/send?phone=212652084735'">WhatsApp</button>
+            <button type="button" class="btn btn-info me-2" onclick="window.location.href='mailto:sastoukadigital@gmail.com'">Email</button>
+            <button type="button" class="btn btn-primary me-2" id="paypalBtn">PayPal</button>
+            <button type="button" class="btn btn-warning" onclick="document.getElementById('activation_code').focus()">Saisir Code</button>
+          </div>
+          <button class="btn btn-primary" type="submit">Valider</button>
+        </form>
+      </div>
+    </div>
+  </div>
+  <script>
+    function updateOptions(){
+      var plan = document.getElementById("plan").value;
+      var contactDiv = document.getElementById("contactOptions");
+      var paypalBtn = document.getElementById("paypalBtn");
+      if(plan === "essai_7jours"){
+        contactDiv.style.display = "none";
+      } else {
+        contactDiv.style.display = "block";
+        if(plan === "1 an"){
+          paypalBtn.onclick = function(){ window.location.href = "{{ url_for('purchase_plan', plan='1 an') }}"; };
+        } else if(plan === "illimité"){
+          paypalBtn.onclick = function(){ window.location.href = "{{ url_for('purchase_plan', plan='illimité') }}"; };
+        }
+      }
+    }
+    document.getElementById("plan").addEventListener("change", updateOptions);
+    updateOptions();
+  </script>
+</body>
+</html>
+"""
+
 @app.route("/activation", methods=["GET"])
 def activation():
     hw_id = get_hardware_id()
-    return render_template_string(
-        """
-        <!DOCTYPE html>
-        <html lang="fr">
-        <head>
-          <meta charset="UTF-8"/>
-          <title>Activation du logiciel</title>
-          <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css" rel="stylesheet">
-        </head>
-        <body class="bg-light">
-          <div class="container my-5">
-            <div class="card shadow">
-              <div class="card-body">
-                <h2 class="mb-4">Activation du logiciel</h2>
-                <p>ID du PC :</p>
-                <div class="input-group mb-3">
-                  <input type="text" class="form-control" readonly value="{{ hw_id }}">
-                </div>
-                <p class="text-muted">Pour les plans 1 an et illimité, vous pouvez choisir parmi plusieurs options :</p>
-                <form action="{{ url_for('activate') }}" method="POST">
-                  <div class="mb-3">
-                    <label for="plan" class="form-label">Sélectionnez le Plan :</label>
-                    <select name="plan" id="plan" class="form-select">
-                      <option value="essai_7jours">Essai Gratuit 7 jours</option>
-                      <option value="1 an">1 an (10€)</option>
-                      <option value="illimité">Illimité (40€)</option>
-                    </select>
-                  </div>
-                  <div class="mb-3" id="codeDiv">
-                    <label for="activation_code" class="form-label">Code d'Activation :</label>
-                    <input type="text" name="activation_code" id="activation_code" class="form-control" placeholder="Saisir le code d'activation (si disponible)">
-                  </div>
-                  <div id="contactOptions" style="display:none;" class="mb-3">
-                    <button type="button" class="btn btn-success me-2" onclick="window.location.href='https://api.whatsapp.com/send?phone=212652084735'">WhatsApp</button>
-                    <button type="button" class="btn btn-info me-2" onclick="window.location.href='mailto:sastoukadigital@gmail.com'">Email</button>
-                    <button type="button" class="btn btn-primary me-2" id="paypalBtn">PayPal</button>
-                    <button type="button" class="btn btn-warning" onclick="document.getElementById('activation_code').focus()">Saisir Code</button>
-                  </div>
-                  <button class="btn btn-primary" type="submit">Valider</button>
-                </form>
-              </div>
-            </div>
-          </div>
-          <script>
-            function updateOptions(){
-              var plan = document.getElementById("plan").value;
-              var contactDiv = document.getElementById("contactOptions");
-              var paypalBtn = document.getElementById("paypalBtn");
-              if(plan === "essai_7jours"){
-                contactDiv.style.display = "none";
-              } else {
-                contactDiv.style.display = "block";
-                if(plan === "1 an"){
-                  paypalBtn.onclick = function(){ window.location.href = "{{ url_for('purchase_plan', plan='1 an') }}"; };
-                } else if(plan === "illimité"){
-                  paypalBtn.onclick = function(){ window.location.href = "{{ url_for('purchase_plan', plan='illimité') }}"; };
-                }
-              }
-            }
-            document.getElementById("plan").addEventListener("change", updateOptions);
-            updateOptions();
-          </script>
-        </body>
-        </html>
-        """, hw_id=hw_id
-    )
+    return render_template("activation.html", hw_id=hw_id)
 
 @app.route("/activate", methods=["POST"])
 def activate():
@@ -586,6 +2439,7 @@ def activate():
         }
         with open(ACTIVATION_FILE, "w", encoding="utf-8") as f:
             json.dump(data, f)
+        invalidate_licence_cache()
         flash("Essai gratuit activé pour 7 jours.", "success")
         return redirect(url_for("saisie"))
     else:
@@ -594,107 +2448,22 @@ def activate():
             data = {
                 "plan": plan,
                 "activation_date": datetime.date.today().isoformat(),
-                "activation_code": expected
-            }
-            with open(ACTIVATION_FILE, "w", encoding="utf-8") as f:
-                json.dump(data, f)
-            flash(f"Activation validée pour le plan {plan} via saisie de code.", "success")
-            return redirect(url_for("saisie"))
-        else:
-            flash(f"Pour le plan {plan}: Veuillez soit effectuer le paiement via PayPal, saisir un code d'activation valide, ou contacter le développeur par WhatsApp au +212652084735.", "error")
-            return redirect(url_for("activation"))
-
-@app.route("/")
-def index():
-    return redirect(url_for("saisie"))
-
-@app.route("/saisie", methods=["GET", "POST"])
-def saisie():
-    current_fruit = load_user_theme()
-    theme = fruit_themes.get(current_fruit, fruit_themes[DEFAULT_FRUIT])
-    if request.method == "POST":
-        action = request.form.get("action")
-        date_saisie = request.form.get("date_saisie", "").strip()
-        agriculteur = request.form.get("agriculteur", "").strip()
-        parcelle = request.form.get("parcelle", "").strip()
-        produit = request.form.get("produit", "").strip()
-        variete = request.form.get("variete", "").strip()
-        nb_cueilleurs = request.form.get("nb_cueilleurs", "0").strip()
-        nb_indirect = request.form.get("nb_indirect", "0").strip()
-        nb_autres = request.form.get("nb_autres", "0").strip()
-        nb_caporaux = request.form.get("nb_caporaux", "0").strip()
-        poids_total = request.form.get("poids_total", "0").strip()
-        ecarts = request.form.get("ecarts", "0").strip()
-        try: nb_cueilleurs = int(nb_cueilleurs)
-        except: nb_cueilleurs = 0
-        try: nb_indirect = int(nb_indirect)
-        except: nb_indirect = 0
-        try: nb_autres = int(nb_autres)
-        except: nb_autres = 0
-        total_ouv = nb_cueilleurs + nb_indirect + nb_autres
-        try: nb_caporaux = int(nb_caporaux)
-        except: nb_caporaux = 0
-        try: poids_total = float(poids_total)
-        except: poids_total = 0
-        try: ecarts = float(ecarts)
-        except: ecarts = 0
-        poids_global = poids_total + ecarts
-        file_path = os.path.join(EXCEL_DIR, "enregistrements.xlsx")
-        if not os.path.exists(file_path):
-            wb = Workbook()
-            ws = wb.active
-            ws.title = "BonLivraison"
-            headers = ["Numéro Bon"] + column_order
-            for c, h in enumerate(headers, start=1):
-                ws.cell(row=1, column=c, value=h)
-            wb.create_sheet("HistoriqueRapports")
-            wb.save(file_path)
-        wb = load_workbook(file_path)
-        ws = wb["BonLivraison"]
-        next_row = ws.max_row + 1
-        num_bon = generate_voucher_number(agriculteur or "AGRI")
-        data_dict = {
-            "Numéro Bon": num_bon,
-            "Date (JJ/MM/AAAA)": date_saisie,
-            "Agriculteur": agriculteur,
-            "Parcelle": parcelle,
-            "Produit": produit,
-            "Variété": variete,
-            "Nb Ouvriers Cueilleurs": nb_cueilleurs,
-            "Nb Ouvriers Indirect": nb_indirect,
-            "Nb Ouvriers Autres": nb_autres,
-            "Total Ouvriers": total_ouv,
-            "Nombre Caporaux": nb_caporaux,
-            "Poids Total Cueillis (kg)": poids_total,
-            "Écarts (Produit Déchet) en kg": ecarts,
-            "Poids Global": poids_global
-        }
-        row_fields = ["Numéro Bon"] + column_order
-        for i, key in enumerate(row_fields, start=1):
-            ws.cell(row=next_row, column=i, value=data_dict.get(key, ""))
-        wb.save(file_path)
-        flash("Enregistré avec succès !", "success")
-        if action == "save_pdf":
-            pdf_file_name = f"bon_de_livraison_{num_bon}.pdf"
-            pdf_path = os.path.join(PDF_LIVRAISON_DIR, pdf_file_name)
-            pdf_fields = []
-            for col in column_order:
-                pdf_val = data_dict.get(col, "")
-                pdf_fields.append((col, pdf_val))
-            data_for_pdf = {
-                "num_bon": f"N° Bon: {num_bon}",
-                "fruit": current_fruit,
-                "fields": pdf_fields
+                "activation_code": expected
             }
-            try:
-                PDFGenerator.generate_delivery_pdf(data_for_pdf, pdf_path)
-                flash("PDF généré avec succès !", "success")
-            except Exception as e:
-                flash(f"Erreur lors de la génération PDF: {e}", "error")
-        return redirect(url_for("saisie"))
-    now_str = datetime.datetime.now().strftime("%d/%m/%Y")
-    return render_template_string(
-        """
+            with open(ACTIVATION_FILE, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            invalidate_licence_cache()
+            flash(f"Activation validée pour le plan {plan} via saisie de code.", "success")
+            return redirect(url_for("saisie"))
+        else:
+            flash(f"Pour le plan {plan}: Veuillez soit effectuer le paiement via PayPal, saisir un code d'activation valide, ou contacter le développeur par WhatsApp au +212652084735.", "error")
+            return redirect(url_for("activation"))
+
+@app.route("/")
+def index():
+    return redirect(url_for("saisie"))
+
+PAGE_TEMPLATES["saisie.html"] = """
 <!DOCTYPE html>
 <html lang="fr">
 <head>
@@ -741,7 +2510,7 @@ def saisie():
       {% with messages = get_flashed_messages(with_categories=true) %}
         {% if messages %}
           {% for category, msg in messages %}
-            Swal.fire({ icon: "{{ 'error' if category=='error' else 'success' }}", title: "{{ msg|safe }}", timer: 2500 });
+            Swal.fire({ icon: "{{ 'error' if category=='error' else 'success' }}", title: {{ msg|tojson }}, timer: 2500 });
           {% endfor %}
         {% endif %}
       {% endwith %}
@@ -811,42 +2580,89 @@ def saisie():
 <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js"></script>
 </body>
 </html>
-        """, now_str=now_str, theme=theme, current_fruit=current_fruit, fruit_themes=fruit_themes)
+"""
 
-@app.route("/bons")
-def bons():
+@app.route("/saisie", methods=["GET", "POST"])
+def saisie():
     current_fruit = load_user_theme()
     theme = fruit_themes.get(current_fruit, fruit_themes[DEFAULT_FRUIT])
-    search_query = request.args.get("q", "").lower().strip()
-    file_path = os.path.join(EXCEL_DIR, "enregistrements.xlsx")
-    rows = []
-    if os.path.exists(file_path):
-        df = pd.read_excel(file_path, sheet_name="BonLivraison")
-        for idx, row in df.iterrows():
-            row_str = " ".join([str(val).lower() for val in row.values if val is not None])
-            if search_query in row_str:
-                pt = float(row.get("Poids Total Cueillis (kg)", 0) or 0)
-                ec = float(row.get("Écarts (Produit Déchet) en kg", 0) or 0)
-                pg = pt + ec
-                row_data = {
-                    "num_bon": row.get("Numéro Bon", ""),
-                    "Date (JJ/MM/AAAA)": row.get("Date (JJ/MM/AAAA)", ""),
-                    "Agriculteur": row.get("Agriculteur", ""),
-                    "Parcelle": row.get("Parcelle", ""),
-                    "Produit": row.get("Produit", ""),
-                    "Variété": row.get("Variété", ""),
-                    "Nb Ouvriers Cueilleurs": row.get("Nb Ouvriers Cueilleurs", 0),
-                    "Nb Ouvriers Indirect": row.get("Nb Ouvriers Indirect", 0),
-                    "Nb Ouvriers Autres": row.get("Nb Ouvriers Autres", 0),
-                    "Total Ouvriers": row.get("Total Ouvriers", 0),
-                    "Nombre Caporaux": row.get("Nombre Caporaux", 0),
-                    "Poids Total Cueillis (kg)": pt,
-                    "Écarts (Produit Déchet) en kg": ec,
-                    "Poids Global": pg,
-                    "_idx": idx + 2
-                }
-                rows.append(row_data)
-    return render_template_string("""
+    if request.method == "POST":
+        action = request.form.get("action")
+        date_saisie = request.form.get("date_saisie", "").strip()
+        agriculteur = request.form.get("agriculteur", "").strip()
+        parcelle = request.form.get("parcelle", "").strip()
+        produit = request.form.get("produit", "").strip()
+        variete = request.form.get("variete", "").strip()
+        nb_cueilleurs = request.form.get("nb_cueilleurs", "0").strip()
+        nb_indirect = request.form.get("nb_indirect", "0").strip()
+        nb_autres = request.form.get("nb_autres", "0").strip()
+        nb_caporaux = request.form.get("nb_caporaux", "0").strip()
+        poids_total = request.form.get("poids_total", "0").strip()
+        ecarts = request.form.get("ecarts", "0").strip()
+        try: nb_cueilleurs = int(nb_cueilleurs)
+        except: nb_cueilleurs = 0
+        try: nb_indirect = int(nb_indirect)
+        except: nb_indirect = 0
+        try: nb_autres = int(nb_autres)
+        except: nb_autres = 0
+        total_ouv = nb_cueilleurs + nb_indirect + nb_autres
+        try: nb_caporaux = int(nb_caporaux)
+        except: nb_caporaux = 0
+        try: poids_total = float(poids_total)
+        except: poids_total = 0
+        try: ecarts = float(ecarts)
+        except: ecarts = 0
+        poids_global = poids_total + ecarts
+        num_bon = generate_voucher_number(agriculteur or "AGRI")
+        data_dict = {
+            "Numéro Bon": num_bon,
+            "Date (JJ/MM/AAAA)": date_saisie,
+            "Agriculteur": agriculteur,
+            "Parcelle": parcelle,
+            "Produit": produit,
+            "Variété": variete,
+            "Nb Ouvriers Cueilleurs": nb_cueilleurs,
+            "Nb Ouvriers Indirect": nb_indirect,
+            "Nb Ouvriers Autres": nb_autres,
+            "Total Ouvriers": total_ouv,
+            "Nombre Caporaux": nb_caporaux,
+            "Poids Total Cueillis (kg)": poids_total,
+            "Écarts (Produit Déchet) en kg": ecarts,
+            "Poids Global": poids_global
+        }
+        bon_id = insert_bon(data_dict)
+        flash("Enregistré avec succès !", "success")
+        if action == "save_pdf":
+            try:
+                delivery_pdf_for_bon(bon_id, current_fruit)
+                flash("PDF généré avec succès !", "success")
+            except Exception as e:
+                flash(f"Erreur lors de la génération PDF: {e}", "error")
+        return redirect(url_for("saisie"))
+    now_str = datetime.datetime.now().strftime("%d/%m/%Y")
+    return render_template("saisie.html", now_str=now_str, theme=theme, current_fruit=current_fruit, fruit_themes=fruit_themes)
+
+# Barre de pagination partagée par les listes (bons, historique), importée
+# en tête de chaque page ; params porte les filtres à conserver d'une page à l'autre.
+PAGE_TEMPLATES["_pagination.html"] = """
+{% macro pagination_nav(pagination, endpoint, libelle, params) -%}
+  <div class="d-flex justify-content-between align-items-center">
+    <span>{{ pagination.total }} {{ libelle }} — page {{ pagination.page }} / {{ pagination.page_count }}</span>
+    <ul class="pagination mb-0">
+      <li class="page-item {% if pagination.page <= 1 %}disabled{% endif %}"><a class="page-link" href="{{ url_for(endpoint, page=1, **params) }}">«</a></li>
+      <li class="page-item {% if pagination.page <= 1 %}disabled{% endif %}"><a class="page-link" href="{{ url_for(endpoint, page=pagination.page - 1, **params) }}">‹</a></li>
+      {% for numero in range([pagination.page - 2, 1]|max, [pagination.page + 2, pagination.page_count]|min + 1) %}
+        <li class="page-item {% if numero == pagination.page %}active{% endif %}"><a class="page-link" href="{{ url_for(endpoint, page=numero, **params) }}">{{ numero }}</a></li>
+      {% endfor %}
+      <li class="page-item {% if pagination.page >= pagination.page_count %}disabled{% endif %}"><a class="page-link" href="{{ url_for(endpoint, page=pagination.page + 1, **params) }}">›</a></li>
+      <li class="page-item {% if pagination.page >= pagination.page_count %}disabled{% endif %}"><a class="page-link" href="{{ url_for(endpoint, page=pagination.page_count, **params) }}">»</a></li>
+    </ul>
+  </div>
+{%- endmacro %}
+"""
+
+PAGE_TEMPLATES["bons.html"] = """
+{% from "_pagination.html" import pagination_nav %}
 <!DOCTYPE html>
 <html lang="fr">
 <head>
@@ -885,7 +2701,7 @@ def bons():
       {% with messages = get_flashed_messages(with_categories=true) %}
         {% if messages %}
           {% for category, msg in messages %}
-            Swal.fire({ icon: "{{ 'error' if category=='error' else 'success' }}", title: "{{ msg|safe }}", timer: 2500 });
+            Swal.fire({ icon: "{{ 'error' if category=='error' else 'success' }}", title: {{ msg|tojson }}, timer: 2500 });
           {% endfor %}
         {% endif %}
       {% endwith %}
@@ -894,19 +2710,75 @@ def bons():
   <h3 class="mb-3">Liste des Bons Antérieurs</h3>
   <form method="GET" class="row mb-3">
     <div class="col-auto">
-      <input type="text" name="q" class="form-control" placeholder="Recherche Bons..." value="{{ request.args.get('q','') }}">
+      <input type="text" name="q" class="form-control" placeholder="Recherche Bons (ex. agriculteur:ennajihi)..." value="{{ request.args.get('q','') }}">
+    </div>
+    <div class="col-auto">
+      <select name="par_page" class="form-select" onchange="this.form.submit()">
+        {% for n in [25, 50, 100, 200] %}
+          <option value="{{ n }}" {% if n == pagination.per_page %}selected{% endif %}>{{ n }} / page</option>
+        {% endfor %}
+      </select>
     </div>
+    <input type="hidden" name="tri" value="{{ pagination.tri }}">
+    <input type="hidden" name="ordre" value="{{ pagination.ordre }}">
     <div class="col-auto">
       <button class="btn btn-secondary" type="submit">Rechercher</button>
     </div>
+    <div class="col-auto">
+      <a class="btn btn-success" href="{{ url_for('export_excel') }}">Exporter Excel</a>
+    </div>
+  </form>
+  <form method="POST" action="{{ url_for('import_bons_route') }}" enctype="multipart/form-data" class="row mb-3">
+    <div class="col-auto">
+      <input type="file" name="fichier" accept=".csv,.json" class="form-control">
+    </div>
+    <div class="col-auto">
+      <button class="btn btn-outline-primary" type="submit">Importer CSV/JSON</button>
+    </div>
+  </form>
+  <form method="POST" action="{{ url_for('export_bons_pdf') }}" class="row g-2 mb-3">
+    <div class="col-auto">
+      <input type="text" name="debut" class="form-control" placeholder="Du (JJ/MM/AAAA)">
+    </div>
+    <div class="col-auto">
+      <input type="text" name="fin" class="form-control" placeholder="Au (JJ/MM/AAAA)">
+    </div>
+    <div class="col-auto">
+      <input type="text" name="agriculteur" class="form-control" placeholder="Agriculteur">
+    </div>
+    <div class="col-auto">
+      <input type="text" name="produit" class="form-control" placeholder="Produit">
+    </div>
+    <div class="col-auto">
+      <input type="text" name="variete" class="form-control" placeholder="Variété">
+    </div>
+    <div class="col-auto">
+      <button class="btn btn-outline-success" type="submit" formaction="{{ url_for('export_bons') }}" formmethod="get" name="format" value="csv">CSV</button>
+      <button class="btn btn-outline-success" type="submit" formaction="{{ url_for('export_bons') }}" formmethod="get" name="format" value="xlsx">XLSX</button>
+    </div>
+    <div class="col-auto">
+      <select name="sortie" class="form-select">
+        <option value="zip">PDF en archive ZIP</option>
+        <option value="pdf">PDF unique</option>
+      </select>
+    </div>
+    <div class="col-auto">
+      <button class="btn btn-outline-secondary" type="submit">Exporter les PDF</button>
+    </div>
   </form>
   <div class="table-responsive">
     <table class="table table-bordered table-striped align-middle">
       <thead>
         <tr>
-          <th>N°</th>
+          {% macro tri_lien(col, titre) -%}
+            {%- set actif = pagination.tri == col -%}
+            {%- set ordre = 'desc' if actif and pagination.ordre == 'asc' else 'asc' -%}
+            <a href="{{ url_for('bons', q=pagination.q, tri=col, ordre=ordre, par_page=pagination.per_page) }}">{{ titre }}</a>
+            {%- if actif %} {{ '▲' if pagination.ordre == 'asc' else '▼' }}{% endif %}
+          {%- endmacro %}
+          <th>{{ tri_lien('Numéro Bon', 'N°') }}</th>
           {% for col in column_order %}
-            <th>{{ column_abbr.get(col, col) }}</th>
+            <th>{{ tri_lien(col, column_abbr.get(col, col)) }}</th>
           {% endfor %}
           <th>Actions</th>
         </tr>
@@ -927,249 +2799,135 @@ def bons():
       </tbody>
     </table>
   </div>
+  {{ pagination_nav(pagination, 'bons', 'bon(s)', {'q': pagination.q, 'tri': pagination.tri, 'ordre': pagination.ordre, 'par_page': pagination.per_page}) }}
 </div>
 <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js"></script>
 </body>
 </html>
-    """, current_fruit=current_fruit, theme=theme, column_order=column_order, column_abbr=column_abbr, rows=rows)
+"""
+
+@app.route("/bons")
+def bons():
+    current_fruit = load_user_theme()
+    theme = fruit_themes.get(current_fruit, fruit_themes[DEFAULT_FRUIT])
+    search_query = request.args.get("q", "").strip()
+    sort_label = request.args.get("tri", "")
+    if sort_label not in bon_sort_expressions:
+        sort_label = ""
+    descending = request.args.get("ordre", "asc") == "desc"
+    per_page = min(max(request.args.get("par_page", BONS_PAGE_SIZE, type=int) or BONS_PAGE_SIZE, 1), BONS_PAGE_SIZE_MAX)
+    total = count_bons(search_query)
+    page_count = max((total + per_page - 1) // per_page, 1)
+    page = min(max(request.args.get("page", 1, type=int) or 1, 1), page_count)
+    rows = fetch_bons_page(search_query, sort_label, descending, per_page, (page - 1) * per_page)
+    for row_data in rows:
+        row_data["num_bon"] = row_data.get("Numéro Bon", "")
+    pagination = {
+        "page": page, "page_count": page_count, "per_page": per_page, "total": total,
+        "q": search_query, "tri": sort_label, "ordre": "desc" if descending else "asc"
+    }
+    return render_template("bons.html", current_fruit=current_fruit, theme=theme, column_order=column_order,
+                           column_abbr=column_abbr, rows=rows, pagination=pagination)
 
 @app.route("/generer_pdf_bon/<int:idx>")
 def generer_pdf_bon(idx):
-    file_path = os.path.join(EXCEL_DIR, "enregistrements.xlsx")
-    if not os.path.exists(file_path):
-        flash("Fichier introuvable.", "error")
+    try:
+        result = delivery_pdf_for_bon(idx, load_user_theme())
+    except Exception as e:
+        flash(f"Erreur lors de la génération PDF: {e}", "error")
         return redirect(url_for("bons"))
-    df = pd.read_excel(file_path, sheet_name="BonLivraison")
-    if idx - 2 < 0 or idx - 2 >= len(df):
+    if result is None:
         flash("Index invalide.", "error")
         return redirect(url_for("bons"))
-    excel_row = df.iloc[idx - 2]
-    pt = float(excel_row.get("Poids Total Cueillis (kg)", 0) or 0)
-    ec = float(excel_row.get("Écarts (Produit Déchet) en kg", 0) or 0)
-    pg = pt + ec
-    farmer = str(excel_row.get("Agriculteur", "")).strip()
-    unique_num = generate_voucher_number(farmer or "AGRI")
-    pdf_file_name = f"bon_de_livraison_{unique_num}.pdf"
-    pdf_path = os.path.join(PDF_LIVRAISON_DIR, pdf_file_name)
-    data = {"num_bon": "N° Bon: " + unique_num, "fruit": load_user_theme(), "fields": []}
-    for col in column_order:
-        if col == "Poids Global":
-            data["fields"].append((col, pg))
-        else:
-            data["fields"].append((col, excel_row.get(col, "")))
-    PDFGenerator.generate_delivery_pdf(data, pdf_path)
-    return send_file(pdf_path, as_attachment=True)
+    pdf_path, digest = result
+    # L'empreinte du contenu sert d'ETag : un second téléchargement répond 304
+    response = send_file(pdf_path, as_attachment=True, etag=digest, conditional=True)
+    response.cache_control.no_cache = True
+    return response
+
+@app.route("/bons/export_pdf", methods=["POST"])
+def export_bons_pdf():
+    filters, error = parse_bons_filters(request.form)
+    if error:
+        flash(error, "error")
+        return redirect(url_for("bons"))
+    filters["format"] = "pdf" if request.form.get("sortie") == "pdf" else "zip"
+    filters["fruit"] = load_user_theme()
+    return job_submitted_response(submit_job("export_bons_pdf", filters))
 
 @app.route("/supprimer_bon/<int:idx>")
 def supprimer_bon(idx):
-    file_path = os.path.join(EXCEL_DIR, "enregistrements.xlsx")
-    if not os.path.exists(file_path):
-        flash("Fichier Excel introuvable.", "error")
-        return redirect(url_for("bons"))
     try:
-        wb = load_workbook(file_path)
-        ws = wb["BonLivraison"]
-        ws.delete_rows(idx)
-        wb.save(file_path)
-        flash("Bon supprimé avec succès.", "success")
+        if delete_bon(idx):
+            flash("Bon supprimé avec succès.", "success")
+        else:
+            flash("Bon introuvable.", "error")
     except Exception as e:
         flash(f"Erreur lors de la suppression : {str(e)}", "error")
     return redirect(url_for("bons"))
 
-@app.route("/stats", methods=["GET", "POST"])
-def stats():
-    current_fruit = load_user_theme()
-    theme = fruit_themes.get(current_fruit, fruit_themes[DEFAULT_FRUIT])
-    file_path = os.path.join(EXCEL_DIR, "enregistrements.xlsx")
-    df = pd.DataFrame()
-    if os.path.exists(file_path):
-        df = pd.read_excel(file_path, sheet_name="BonLivraison")
-        if "Date (JJ/MM/AAAA)" in df.columns:
-            df["Date"] = pd.to_datetime(df["Date (JJ/MM/AAAA)"], format="%d/%m/%Y", errors="coerce")
-        else:
-            df["Date"] = None
-        df["Mois"] = df["Date"].dt.month
-        df["Annee"] = df["Date"].dt.year
-        for c in ["Poids Total Cueillis (kg)", "Écarts (Produit Déchet) en kg", 
-                  "Nb Ouvriers Cueilleurs", "Nb Ouvriers Indirect", "Nb Ouvriers Autres", "Nombre Caporaux"]:
-            if c in df.columns:
-                df[c] = pd.to_numeric(df[c], errors='coerce').fillna(0)
-            else:
-                df[c] = 0
-        df["Poids Global"] = df["Poids Total Cueillis (kg)"] + df["Écarts (Produit Déchet) en kg"]
-        df["Total Ouvriers"] = df["Nb Ouvriers Cueilleurs"] + df["Nb Ouvriers Indirect"] + df["Nb Ouvriers Autres"]
-    start_date_str = request.form.get("start_date", "")
-    end_date_str = request.form.get("end_date", "")
-    graph_column = request.form.get("graph_column", "Poids Total Cueillis (kg)")
-    x_axis = request.form.get("x_axis", "Date (JJ/MM/AAAA)")
-    selected_checkboxes = request.form.getlist("checkbox_fields")
-    if start_date_str:
-        try:
-            sd = datetime.datetime.strptime(start_date_str, "%d/%m/%Y")
-            df = df[df["Date"] >= sd]
-        except:
-            pass
-    if end_date_str:
-        try:
-            ed = datetime.datetime.strptime(end_date_str, "%d/%m/%Y")
-            df = df[df["Date"] <= ed]
-        except:
-            pass
-    if not df.empty and x_axis in df.columns and graph_column in df.columns:
-        group_data = df.groupby(x_axis, as_index=False).agg({graph_column: "sum"})
+@app.route("/export_excel")
+def export_excel():
+    buffer = build_excel_export()
+    return send_file(
+        buffer,
+        as_attachment=True,
+        download_name="enregistrements.xlsx",
+        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    )
+
+@app.route("/export")
+def export_bons():
+    filters, error = parse_bons_filters(request.args)
+    if error:
+        flash(error, "error")
+        return redirect(url_for("bons"))
+    stamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    if request.args.get("format") == "xlsx":
+        body = stream_bons_xlsx(filters)
+        mimetype = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        file_name = f"bons_{stamp}.xlsx"
     else:
-        group_data = pd.DataFrame({x_axis:[], graph_column:[]})
-    
-    # Graphiques principaux dynamiques (Histogramme et Donut) pour l'ensemble
-    bar_img = None
-    pie_img = None
-    if not group_data.empty and x_axis in group_data.columns and graph_column in group_data.columns:
-        fig_bar, ax_bar = plt.subplots(figsize=(5,4), dpi=100)
-        x_values = group_data[x_axis].astype(str).tolist()
-        y_values = group_data[graph_column].tolist()
-        accent_color = theme["accent"]
-        ax_bar.bar(x_values, y_values, color=accent_color)
-        ax_bar.set_title(f"Histogramme selon {x_axis}")
-        ax_bar.set_xlabel(x_axis)
-        ax_bar.set_ylabel(graph_column)
-        plt.setp(ax_bar.get_xticklabels(), rotation=45)
-        fig_bar.tight_layout()
-        bar_buffer = BytesIO()
-        fig_bar.savefig(bar_buffer, format='png')
-        plt.close(fig_bar)
-        bar_buffer.seek(0)
-        bar_img = base64.b64encode(bar_buffer.getvalue()).decode('utf-8')
-        
-        fig_pie, ax_pie = plt.subplots(figsize=(5,4), dpi=100)
-        if sum(y_values) > 0:
-            wedges, texts, autotexts = ax_pie.pie(y_values, autopct='%1.1f%%', startangle=90, wedgeprops={'width':0.3})
-            ax_pie.set_title(f"Camembert selon {x_axis}")
-            ax_pie.legend(wedges, x_values, title=x_axis, loc="center left", bbox_to_anchor=(1, 0.5), fontsize=10, title_fontsize=12)
-            fig_pie.tight_layout()
-            pie_buffer = BytesIO()
-            fig_pie.savefig(pie_buffer, format='png')
-            plt.close(fig_pie)
-            pie_buffer.seek(0)
-            pie_img = base64.b64encode(pie_buffer.getvalue()).decode('utf-8')
+        body = stream_bons_csv(filters)
+        mimetype = "text/csv"
+        file_name = f"bons_{stamp}.csv"
+    return Response(body, mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename={file_name}"})
+
+@app.route("/import_bons", methods=["POST"])
+def import_bons_route():
+    try:
+        if request.is_json:
+            rows = parse_bulk_rows(request.get_data(), "import.json")
         else:
-            plt.close(fig_pie)
-    
-    # Pour chaque case cochée, créer un histogramme et un donut côte à côte dans une figure dynamique
-    selected_stats = {}
-    for field in selected_checkboxes:
-        try:
-            # Agrégation sur le champ sélectionné (somme du graph_column)
-            group = df.groupby(field)[graph_column].sum().reset_index()
-            fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(10,4), dpi=100)
-            # Histogramme
-            ax1.bar(group[field].astype(str), group[graph_column], color=theme["accent"])
-            ax1.set_title(f"Histogramme par {field}")
-            ax1.set_xlabel(field)
-            ax1.set_ylabel(graph_column)
-            plt.setp(ax1.get_xticklabels(), rotation=45)
-            # Donut chart
-            total = group[graph_column].sum()
-            if total > 0:
-                wedges, texts, autotexts = ax2.pie(group[graph_column], autopct='%1.1f%%', startangle=90, wedgeprops={'width':0.3})
-                ax2.set_title(f"Donut par {field}")
-                ax2.legend(wedges, group[field].astype(str), title=field, loc="center left", bbox_to_anchor=(1, 0.5), fontsize=10, title_fontsize=12)
-            else:
-                ax2.text(0.5, 0.5, "Aucune donnée", ha="center", va="center")
-            fig.tight_layout()
-            buf = BytesIO()
-            fig.savefig(buf, format='png')
-            plt.close(fig)
-            buf.seek(0)
-            chart_img = base64.b64encode(buf.getvalue()).decode('utf-8')
-            selected_stats[field] = {"table": group.to_dict(orient="records"), "chart": chart_img}
-        except Exception as e:
-            selected_stats[field] = {"table": [], "chart": ""}
-    
-    if request.method == "POST":
-        action = request.form.get("action")
-        if action == "generate_pdf_stats":
-            report_num = generate_report_number("Rapport")
-            pdf_file_name = f"Rapport_{graph_column}_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.pdf"
-            pdf_path = os.path.join(PDF_STATS_DIR, pdf_file_name)
-            from reportlab.platypus import Table, TableStyle, Spacer, Paragraph, PageBreak
-            styles = getSampleStyleSheet()
-            styles["Normal"].fontSize = 14
-            styles["Normal"].alignment = TA_JUSTIFY
-            styles["Title"].fontSize = 14
-            styles["Title"].alignment = TA_CENTER
-            styles["Heading2"].fontSize = 14
-            styles["Heading2"].alignment = TA_CENTER
-            elements = []
-            # Tableau et graphiques principaux
-            elements.append(Paragraph(f"Rapport de statistiques du {start_date_str} au {end_date_str}", styles["Heading2"]))
-            elements.append(Spacer(1, 12))
-            elements.append(Paragraph("N° Rapport: " + report_num, styles["Heading2"]))
-            elements.append(Spacer(1, 12))
-            elements.append(Paragraph(f"Statistiques selon '{x_axis}'", styles['Heading2']))
-            available_width = landscape(A4)[0] - 40
-            col_widths = [available_width * 0.5, available_width * 0.5]
-            data_table = [[x_axis, graph_column]]
-            for _, row in group_data.iterrows():
-                data_table.append([str(row[x_axis]), row[graph_column]])
-            table_pdf = Table(data_table, repeatRows=1, colWidths=col_widths)
-            table_pdf.hAlign = 'CENTER'
-            table_pdf.setStyle(TableStyle([
-                ('BACKGROUND', (0,0), (-1,0), colors.darkblue),
-                ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
-                ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-                ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0,0), (-1,0), 14),
-                ('BOTTOMPADDING', (0,0), (-1,0), 12),
-                ('ROWBACKGROUNDS', (0,1), (-1,-1), [colors.whitesmoke, colors.beige]),
-                ('GRID', (0,0), (-1,-1), 0.5, colors.grey)
-            ]))
-            elements.append(table_pdf)
-            elements.append(Spacer(1, 12))
-            # Insertion des graphiques principaux
-            from reportlab.platypus import Image
-            images = []
-            if bar_img:
-                bar_buffer = BytesIO(base64.b64decode(bar_img))
-                images.append(Image(bar_buffer, width=available_width*0.48, height=250))
-            if pie_img:
-                pie_buffer = BytesIO(base64.b64decode(pie_img))
-                images.append(Image(pie_buffer, width=available_width*0.48, height=250))
-            if images:
-                table_images = Table([images], colWidths=[available_width*0.5, available_width*0.5])
-                table_images.hAlign = 'CENTER'
-                elements.append(table_images)
-            elements.append(PageBreak())
-            # Pour chaque case cochée, insertion d'un tableau et d'un graphique avec saut de page
-            for field, stats_data in selected_stats.items():
-                elements.append(Paragraph(f"Statistiques pour {field} :", styles["Heading2"]))
-                table_data = [[field, graph_column]]
-                for row in stats_data["table"]:
-                    table_data.append([str(row[field]), row[graph_column]])
-                stat_table = Table(table_data, repeatRows=1)
-                stat_table.hAlign = 'CENTER'
-                stat_table.setStyle(TableStyle([
-                    ('BACKGROUND', (0,0), (-1,0), colors.lightgrey),
-                    ('GRID', (0,0), (-1,-1), 0.5, colors.grey)
-                ]))
-                elements.append(stat_table)
-                elements.append(Spacer(1, 12))
-                if stats_data["chart"]:
-                    buf = BytesIO(base64.b64decode(stats_data["chart"]))
-                    elements.append(Image(buf, width=available_width, height=250))
-                elements.append(PageBreak())
-            PDFGenerator.generate_stats_pdf(elements, pdf_path)
-            wb = load_workbook(file_path)
-            if "HistoriqueRapports" not in wb.sheetnames:
-                ws_hist = wb.create_sheet("HistoriqueRapports")
-                ws_hist.append(["N°", "Type", "Date", "Chemin"])
-            else:
-                ws_hist = wb["HistoriqueRapports"]
-            max_row = ws_hist.max_row
-            idx_rapport = max_row
-            ws_hist.append([idx_rapport, "Statistiques", datetime.datetime.now().strftime("%d/%m/%Y %H:%M:%S"), pdf_path])
-            wb.save(file_path)
-            return send_file(pdf_path, as_attachment=True)
-    return render_template_string("""
+            upload = request.files.get("fichier")
+            if upload is None or not upload.filename:
+                flash("Aucun fichier sélectionné.", "error")
+                return redirect(url_for("bons"))
+            rows = parse_bulk_rows(upload.read(), upload.filename)
+    except (ValueError, UnicodeDecodeError) as e:
+        if request.is_json:
+            return jsonify({"importes": 0, "erreurs": [str(e)]}), 400
+        flash(Markup("Fichier illisible : {}").format(e), "error")
+        return redirect(url_for("bons"))
+    nums, errors = import_bons(rows)
+    if request.is_json:
+        return jsonify({"importes": len(nums), "numeros": nums, "erreurs": errors}), (400 if errors else 200)
+    if errors:
+        # Les erreurs citent le contenu du fichier : Markup.join les échappe
+        flash(Markup("Import annulé :<br>") + Markup("<br>").join(errors[:10]), "error")
+    else:
+        flash(f"{len(nums)} bons importés avec succès.", "success")
+    return redirect(url_for("bons"))
+
+@app.route("/cache_stats")
+def cache_stats():
+    return jsonify({
+        "bons": dict(bons_cache_stats, data_version=_bons_cache["version"]),
+        "graphiques": dict(chart_cache_stats, taille=len(_chart_cache))
+    })
+
+PAGE_TEMPLATES["stats.html"] = """
 <!DOCTYPE html>
 <html lang="fr">
 <head>
@@ -1251,6 +3009,13 @@ def stats():
           </div>
         {% endfor %}
       </div>
+      <div class="mb-3">
+        <label>Rendu des graphiques :</label>
+        <select name="rendu" class="form-select w-auto d-inline-block">
+          <option value="serveur" {% if rendu != "client" %}selected{% endif %}>Serveur (images)</option>
+          <option value="client" {% if rendu == "client" %}selected{% endif %}>Navigateur</option>
+        </select>
+      </div>
       <button class="btn btn-info" type="submit">Mettre à jour</button>
       <button class="btn btn-warning" type="submit" name="action" value="generate_pdf_stats">Générer PDF</button>
     </form>
@@ -1258,15 +3023,21 @@ def stats():
   {% if bar_img %}
   <div class="row mb-4">
     <div class="col-md-6">
-      <img src="data:image/png;base64,{{ bar_img }}" class="img-fluid" alt="Histogramme">
+      <img src="{{ url_for('stats_chart', key=bar_img) }}" class="img-fluid" alt="Histogramme">
     </div>
     <div class="col-md-6">
       {% if pie_img %}
-      <img src="data:image/png;base64,{{ pie_img }}" class="img-fluid" alt="Camembert">
+      <img src="{{ url_for('stats_chart', key=pie_img) }}" class="img-fluid" alt="Camembert">
       {% endif %}
     </div>
   </div>
   {% endif %}
+  {% if stats_json and stats_json.group_data %}
+  <div class="row mb-4">
+    <div class="col-md-6"><canvas data-champ="" data-role="histogramme"></canvas></div>
+    <div class="col-md-6"><canvas data-champ="" data-role="camembert"></canvas></div>
+  </div>
+  {% endif %}
   <div class="card shadow p-4 mb-4">
     <h3>Tableau récapitulatif</h3>
     <table class="table table-bordered table-striped mt-3">
@@ -1307,40 +3078,238 @@ def stats():
     </table>
     {% if stat.chart %}
     <div class="mt-3 text-center">
-      <img src="data:image/png;base64,{{ stat.chart }}" class="img-fluid" alt="Graphique pour {{ field }}">
+      <img src="{{ url_for('stats_chart', key=stat.chart) }}" class="img-fluid" alt="Graphique pour {{ field }}">
+    </div>
+    {% elif stats_json and stat.table %}
+    <div class="row mt-3">
+      <div class="col-md-6"><canvas data-champ="{{ field }}" data-role="histogramme"></canvas></div>
+      <div class="col-md-6"><canvas data-champ="{{ field }}" data-role="camembert"></canvas></div>
     </div>
     {% endif %}
   </div>
   {% endfor %}
 </div>
 <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js"></script>
+{% if stats_json %}
+<script src="https://cdn.jsdelivr.net/npm/chart.js@4.4.0/dist/chart.umd.min.js"></script>
+<script>
+  const statsData = {{ stats_json|tojson }};
+  const accent = "{{ theme.accent }}";
+  function canvasFor(field, role) {
+    return document.querySelector('canvas[data-champ="' + CSS.escape(field) + '"][data-role="' + role + '"]');
+  }
+  function drawCharts(field, rows, labelKey, title) {
+    const labels = rows.map(r => String(r[labelKey]));
+    const values = rows.map(r => r[statsData.graph_column]);
+    const bar = canvasFor(field, "histogramme");
+    if (!bar) { return; }
+    new Chart(bar, {
+      type: "bar",
+      data: { labels: labels, datasets: [{ label: statsData.graph_column, data: values, backgroundColor: accent }] },
+      options: { plugins: { title: { display: true, text: "Histogramme " + title } } }
+    });
+    const donut = canvasFor(field, "camembert");
+    if (donut && values.reduce((a, b) => a + b, 0) > 0) {
+      new Chart(donut, {
+        type: "doughnut",
+        data: { labels: labels, datasets: [{ data: values }] },
+        options: { plugins: { title: { display: true, text: "Donut " + title }, legend: { position: "right" } } }
+      });
+    }
+  }
+  if (statsData.group_data.length) {
+    drawCharts("", statsData.group_data, statsData.x_axis, "selon " + statsData.x_axis);
+  }
+  Object.keys(statsData.selected_stats).forEach(field => {
+    if (statsData.selected_stats[field].length) {
+      drawCharts(field, statsData.selected_stats[field], field, "par " + field);
+    }
+  });
+</script>
+{% endif %}
 </body>
 </html>
-    """, current_fruit=current_fruit, theme=theme, all_columns_extended=all_columns_extended, graph_column=graph_column, x_axis=x_axis, selected_checkboxes=selected_checkboxes, group_data=group_data, bar_img=bar_img, pie_img=pie_img, selected_stats=selected_stats)
+"""
 
-@app.route("/historique")
-def historique():
+@app.route("/stats/data", methods=["GET", "POST"])
+def stats_data():
+    """Agrégats de /stats en JSON compact, pour un rendu des graphiques côté navigateur."""
+    data_version = get_data_version()
+    graph_column = request.values.get("graph_column", "Poids Total Cueillis (kg)")
+    x_axis = request.values.get("x_axis", "Date (JJ/MM/AAAA)")
+    group_data, field_tables = compute_stats(
+        request.values.get("start_date", ""),
+        request.values.get("end_date", ""),
+        graph_column,
+        x_axis,
+        request.values.getlist("checkbox_fields")
+    )
+    return jsonify(stats_to_json(x_axis, graph_column, group_data, field_tables, data_version))
+
+@app.route("/stats/chart/<key>.png")
+def stats_chart(key):
+    if not all(ch in "0123456789abcdef" for ch in key):
+        return "Graphique introuvable", 404
+    png = get_chart_png(key)
+    if png is None:
+        return "Graphique introuvable", 404
+    # La clé dépend de la version des données : le contenu d'une URL ne change jamais
+    response = send_file(BytesIO(png), mimetype="image/png", etag=key, max_age=31536000)
+    response.cache_control.immutable = True
+    return response
+
+@app.route("/stats", methods=["GET", "POST"])
+def stats():
     current_fruit = load_user_theme()
     theme = fruit_themes.get(current_fruit, fruit_themes[DEFAULT_FRUIT])
-    file_path = os.path.join(EXCEL_DIR, "enregistrements.xlsx")
-    report_history = []
-    if os.path.exists(file_path):
-        wb = load_workbook(file_path)
-        if "HistoriqueRapports" in wb.sheetnames:
-            ws = wb["HistoriqueRapports"]
-            for row in ws.iter_rows(min_row=2, values_only=True):
-                if row[0] is not None:
-                    entry = {"idx": row[0], "type": row[1], "date": row[2], "pdf_path": row[3]}
-                    report_history.append(entry)
-    search_query = request.args.get("q", "").lower().strip()
-    if search_query:
-        filtered = []
-        for rh in report_history:
-            concat = (str(rh["idx"]) + rh["type"] + str(rh["date"]) + str(rh["pdf_path"])).lower()
-            if search_query in concat:
-                filtered.append(rh)
-        report_history = filtered
-    return render_template_string("""
+    data_version = get_data_version()
+    start_date_str = request.form.get("start_date", "")
+    end_date_str = request.form.get("end_date", "")
+    graph_column = request.form.get("graph_column", "Poids Total Cueillis (kg)")
+    x_axis = request.form.get("x_axis", "Date (JJ/MM/AAAA)")
+    selected_checkboxes = request.form.getlist("checkbox_fields")
+    rendu = request.form.get("rendu", "serveur")
+    action = request.form.get("action") if request.method == "POST" else None
+    if action == "generate_pdf_stats":
+        # Le rapport est produit en tâche de fond : la requête rend la main aussitôt
+        job_id = submit_job("rapport_stats", {
+            "start_date": start_date_str,
+            "end_date": end_date_str,
+            "graph_column": graph_column,
+            "x_axis": x_axis,
+            "checkbox_fields": selected_checkboxes,
+            "accent": theme["accent"]
+        })
+        return job_submitted_response(job_id)
+    group_data, field_tables = compute_stats(start_date_str, end_date_str, graph_column, x_axis, selected_checkboxes)
+    selected_stats = {}
+    for field, group in field_tables.items():
+        table = group.to_dict(orient="records") if group is not None else []
+        selected_stats[field] = {"table": table, "chart": ""}
+    
+    # En mode "client", le navigateur dessine les graphiques à partir des agrégats
+    # JSON ; matplotlib n'est alors utilisé que pour l'export PDF.
+    bar_img = None
+    pie_img = None
+    if rendu != "client":
+        chart_jobs = stats_chart_jobs(start_date_str, end_date_str, graph_column, x_axis,
+                                      group_data, field_tables, theme["accent"])
+        # Tous les graphiques manquants sont dessinés en parallèle
+        # La page ne référence que les clés : les images sont servies par /stats/chart/<clé>.png
+        charts = render_charts(data_version, chart_jobs)
+        bar_png = charts.get("histogramme", (None, None))[1]
+        pie_png = charts.get("camembert", (None, None))[1]
+        bar_img = charts["histogramme"][0] if bar_png else None
+        pie_img = charts["camembert"][0] if bar_png and pie_png else None
+        for field in selected_stats:
+            key, png = charts.get(("champ", field), (None, None))
+            if png:
+                selected_stats[field]["chart"] = key
+    
+    stats_json = stats_to_json(x_axis, graph_column, group_data, field_tables, data_version) if rendu == "client" else None
+    return render_template("stats.html", current_fruit=current_fruit, theme=theme, all_columns_extended=all_columns_extended, graph_column=graph_column, x_axis=x_axis, selected_checkboxes=selected_checkboxes, group_data=group_data, bar_img=bar_img, pie_img=pie_img, selected_stats=selected_stats, rendu=rendu, stats_json=stats_json)
+
+PAGE_TEMPLATES["travail.html"] = """
+<!DOCTYPE html>
+<html lang="fr">
+<head>
+  <meta charset="UTF-8"/>
+  <title>Génération en cours</title>
+  <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css" rel="stylesheet">
+  <style>
+    body { background-color: {{ theme.bg }}; color: {{ theme.fg }}; }
+    .navbar-custom { background-color: {{ theme.accent }}; }
+    .navbar-custom .navbar-brand, .navbar-custom .nav-link { color: #fff !important; }
+  </style>
+</head>
+<body>
+<nav class="navbar navbar-expand-lg navbar-custom mb-4">
+  <div class="container-fluid">
+    <a class="navbar-brand" href="{{ url_for('saisie') }}">Gestion des Récoltes - {{ current_fruit }}</a>
+    <ul class="navbar-nav ms-auto flex-row gap-3">
+      <li class="nav-item"><a class="nav-link" href="{{ url_for('bons') }}">Bons antérieurs</a></li>
+      <li class="nav-item"><a class="nav-link" href="{{ url_for('stats') }}">Statistiques</a></li>
+      <li class="nav-item"><a class="nav-link" href="{{ url_for('historique') }}">Historique</a></li>
+    </ul>
+  </div>
+</nav>
+<div class="container">
+  <h3 class="mb-3">Génération du document</h3>
+  <p id="statut">En attente...</p>
+  <div id="remarque" class="alert alert-warning d-none"></div>
+  <div class="progress mb-3" style="height: 1.5rem;">
+    <div id="barre" class="progress-bar progress-bar-striped progress-bar-animated" style="width: 100%"></div>
+  </div>
+  <a id="telecharger" class="btn btn-success d-none" href="{{ url_for('job_download', job_id=job_id) }}">Télécharger</a>
+</div>
+<script>
+  const libelles = {en_attente: "En attente...", en_cours: "Génération en cours...", termine: "Document prêt.", echec: "Échec : "};
+  function suivre() {
+    fetch("{{ url_for('job_status', job_id=job_id) }}").then(r => r.json()).then(travail => {
+      const barre = document.getElementById("barre");
+      document.getElementById("statut").textContent = libelles[travail.statut] + (travail.statut === "echec" ? (travail.message || "") : "");
+      if (travail.statut === "termine" && travail.message) {
+        document.getElementById("remarque").textContent = travail.message;
+        document.getElementById("remarque").classList.remove("d-none");
+      }
+      if (travail.total > 0) {
+        barre.style.width = Math.round(100 * travail.progression / travail.total) + "%";
+        barre.textContent = travail.progression + " / " + travail.total;
+      }
+      if (travail.statut === "termine") {
+        barre.classList.remove("progress-bar-animated");
+        barre.style.width = "100%";
+        document.getElementById("telecharger").classList.remove("d-none");
+        window.location = "{{ url_for('job_download', job_id=job_id) }}";
+      } else if (travail.statut === "echec") {
+        barre.classList.remove("progress-bar-animated");
+        barre.classList.add("bg-danger");
+      } else {
+        setTimeout(suivre, 1000);
+      }
+    }).catch(() => setTimeout(suivre, 3000));
+  }
+  suivre();
+</script>
+</body>
+</html>
+"""
+
+def job_submitted_response(job_id):
+    """Réponse à la soumission d'un travail : page de suivi, ou JSON pour un client d'API."""
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify({"travail": job_id, "statut": url_for("job_status", job_id=job_id)}), 202
+    current_fruit = load_user_theme()
+    theme = fruit_themes.get(current_fruit, fruit_themes[DEFAULT_FRUIT])
+    return render_template("travail.html", current_fruit=current_fruit, theme=theme, job_id=job_id), 202
+
+@app.route("/travaux/<job_id>")
+def job_status(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"erreur": "Travail introuvable"}), 404
+    return jsonify({
+        "id": job["id"],
+        "type": job["type"],
+        "statut": job["statut"],
+        "progression": job["progression"],
+        "total": job["total"],
+        "message": job["message"],
+        "cree_le": job["cree_le"],
+        "maj_le": job["maj_le"],
+        "telechargement": url_for("job_download", job_id=job_id) if job["statut"] == "termine" else None
+    })
+
+@app.route("/travaux/<job_id>/telecharger")
+def job_download(job_id):
+    job = get_job(job_id)
+    if job is None or job["statut"] != "termine" or not job["chemin"] or not os.path.exists(job["chemin"]):
+        flash("Document indisponible.", "error")
+        return redirect(url_for("historique"))
+    return send_file(job["chemin"], as_attachment=True)
+
+PAGE_TEMPLATES["historique.html"] = """
+{% from "_pagination.html" import pagination_nav %}
 <!DOCTYPE html>
 <html lang="fr">
 <head>
@@ -1379,7 +3348,7 @@ def historique():
       {% with messages = get_flashed_messages(with_categories=true) %}
         {% if messages %}
           {% for category, msg in messages %}
-            Swal.fire({ icon: "{{ 'error' if category=='error' else 'success' }}", title: "{{ msg|safe }}", timer: 2500 });
+            Swal.fire({ icon: "{{ 'error' if category=='error' else 'success' }}", title: {{ msg|tojson }}, timer: 2500 });
           {% endfor %}
         {% endif %}
       {% endwith %}
@@ -1390,6 +3359,12 @@ def historique():
     <div class="col-auto">
       <input type="text" name="q" class="form-control" placeholder="Rechercher..." value="{{ request.args.get('q','') }}">
     </div>
+    <div class="col-auto">
+      <input type="text" name="debut" class="form-control" placeholder="Du (JJ/MM/AAAA)" value="{{ pagination.debut }}">
+    </div>
+    <div class="col-auto">
+      <input type="text" name="fin" class="form-control" placeholder="Au (JJ/MM/AAAA)" value="{{ pagination.fin }}">
+    </div>
     <div class="col-auto">
       <button class="btn btn-secondary">Rechercher</button>
     </div>
@@ -1398,9 +3373,11 @@ def historique():
     <thead>
       <tr>
         <th>N°</th>
+        <th>N° Rapport</th>
         <th>Type</th>
         <th>Date</th>
         <th>Chemin</th>
+        <th>Taille</th>
         <th>Action</th>
       </tr>
     </thead>
@@ -1408,9 +3385,11 @@ def historique():
       {% for r in report_history %}
       <tr>
         <td>{{ r["idx"] }}</td>
+        <td>{{ r["numero"] or "" }}</td>
         <td>{{ r["type"] }}</td>
         <td>{{ r["date"] }}</td>
         <td>{{ r["pdf_path"] }}</td>
+        <td>{{ r["taille"]|filesizeformat if r["taille"] else "-" }}</td>
         <td>
           {% if r["pdf_path"] and r["pdf_path"]|length > 0 %}
             <a class="btn btn-sm btn-primary" href="{{ url_for('afficher_rapport', pdfpath=r['pdf_path']) }}">Afficher</a>
@@ -1422,11 +3401,37 @@ def historique():
       {% endfor %}
     </tbody>
   </table>
+  {{ pagination_nav(pagination, 'historique', 'rapport(s)', {'q': pagination.q, 'debut': pagination.debut, 'fin': pagination.fin, 'par_page': pagination.per_page}) }}
 </div>
 <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js"></script>
 </body>
 </html>
-    """, current_fruit=current_fruit, theme=theme, report_history=report_history)
+"""
+
+@app.route("/historique")
+def historique():
+    current_fruit = load_user_theme()
+    theme = fruit_themes.get(current_fruit, fruit_themes[DEFAULT_FRUIT])
+    search_query = request.args.get("q", "").strip()
+    debut_str = request.args.get("debut", "").strip()
+    fin_str = request.args.get("fin", "").strip()
+    debut = _parse_filter_date(debut_str)
+    fin = _parse_filter_date(fin_str)
+    if (debut_str and debut is None) or (fin_str and fin is None):
+        flash("Date invalide (format JJ/MM/AAAA).", "error")
+    debut = debut.date() if debut else None
+    fin = fin.date() if fin else None
+    per_page = min(max(request.args.get("par_page", HISTORY_PAGE_SIZE, type=int) or HISTORY_PAGE_SIZE, 1), 500)
+    total = count_report_history(search_query, debut, fin)
+    page_count = max((total + per_page - 1) // per_page, 1)
+    page = min(max(request.args.get("page", 1, type=int) or 1, 1), page_count)
+    report_history = fetch_report_history(search_query, debut, fin, per_page, (page - 1) * per_page)
+    pagination = {
+        "page": page, "page_count": page_count, "per_page": per_page, "total": total, "q": search_query,
+        "debut": debut_str, "fin": fin_str
+    }
+    return render_template("historique.html", current_fruit=current_fruit, theme=theme,
+                           report_history=report_history, pagination=pagination)
 
 @app.route("/afficher_rapport")
 def afficher_rapport():
@@ -1436,15 +3441,7 @@ def afficher_rapport():
         return redirect(url_for("historique"))
     return send_file(pdf_path, as_attachment=False)
 
-@app.route("/change_theme", methods=["GET", "POST"])
-def change_theme():
-    if request.method == "POST":
-        chosen_fruit = request.form.get("fruit", DEFAULT_FRUIT)
-        save_user_theme(chosen_fruit)
-        flash(f"Thème '{chosen_fruit}' enregistré.", "success")
-        return redirect(url_for("saisie"))
-    current_fruit = load_user_theme()
-    return render_template_string("""
+PAGE_TEMPLATES["change_theme.html"] = """
 <!DOCTYPE html>
 <html lang="fr">
 <head>
@@ -1467,7 +3464,42 @@ def change_theme():
 </div>
 </body>
 </html>
-    """, fruit_themes=fruit_themes, current_fruit=current_fruit)
+"""
+
+@app.route("/change_theme", methods=["GET", "POST"])
+def change_theme():
+    if request.method == "POST":
+        chosen_fruit = request.form.get("fruit", DEFAULT_FRUIT)
+        save_user_theme(chosen_fruit)
+        flash(f"Thème '{chosen_fruit}' enregistré.", "success")
+        return redirect(url_for("saisie"))
+    current_fruit = load_user_theme()
+    return render_template("change_theme.html", fruit_themes=fruit_themes, current_fruit=current_fruit)
+
+# =============================================================================
+# Initialisation de l'application
+# =============================================================================
+
+def init_app():
+    """Prépare la base et l'état de licence ; appelée une fois par worker."""
+    init_db()
+    migrate_excel_to_sqlite()
+    upgrade_report_history()
+    ensure_rollups()
+    ensure_search_index()
+    seed_voucher_counter()
+    seed_report_counter()
+    fail_orphaned_jobs()
+    prune_export_files()
+    purge_expired_purchase_orders()
+    # Calcul initial de l'état de licence au démarrage du worker
+    _cached_licence_check("activation", ACTIVATION_FILE, _evaluate_activation)
+    _cached_licence_check("essai", TRIAL_FILE, _evaluate_trial_period)
+
+# Les processus du pool de rendu (spawn) réimportent ce module pour retrouver
+# les fonctions de rendu : ils n'ont besoin ni de la base ni de la licence.
+if multiprocessing.current_process().name == "MainProcess":
+    init_app()
 
 # =============================================================================
 # Lancement du serveur Flask
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""Serveur PayPal local pour tester l'achat de plans hors ligne.
+
+Imite les quelques points d'entrée utilisés par ``PaypalClient`` :
+jeton OAuth, création / lecture / capture d'ordre, et la page
+d'approbation de l'acheteur (approuvée automatiquement puis redirigée
+vers return_url). Les requêtes rejouées avec le même PayPal-Request-Id
+renvoient la même réponse, comme l'API réelle.
+
+Usage :
+    python paypal_stub.py [--port 8765] [--latence 0] [--echecs 0]
+    PAYPAL_API_BASE=http://127.0.0.1:8765 gunicorn main:app
+
+--latence ajoute un délai (secondes) à chaque réponse ; --echecs fait
+échouer en 503 les N premières requêtes de chaque point d'entrée, pour
+vérifier les délais et les nouvelles tentatives du client.
+
+Les tests (tests/test_paypal.py) le lancent dans un thread et agissent
+directement sur ``config``, ``tokens`` et ``journal`` ; ``reset()`` remet
+le serveur dans son état initial.
+"""
+import argparse
+import threading
+import time
+import uuid
+from collections import Counter
+
+from flask import Flask, request, jsonify, redirect
+
+app = Flask(__name__)
+config = {"latence": 0.0, "echecs": 0, "expires_in": 32400}
+orders = {}
+idempotent_responses = {}
+calls = Counter()
+# Jetons délivrés et encore valides (les retirer simule une révocation)
+tokens = set()
+# (point d'entrée, PayPal-Request-Id) de chaque requête reçue
+journal = []
+lock = threading.Lock()
+
+
+def reset():
+    with lock:
+        config.update(latence=0.0, echecs=0, expires_in=32400)
+        for state in (orders, idempotent_responses, calls, tokens, journal):
+            state.clear()
+
+
+def error(status, issue, description):
+    return jsonify({"name": issue, "details": [{"issue": issue, "description": description}]}), status
+
+
+@app.before_request
+def simulate_network():
+    endpoint = request.endpoint or ""
+    with lock:
+        calls[endpoint] += 1
+        failing = calls[endpoint] <= config["echecs"]
+        journal.append((endpoint, request.headers.get("PayPal-Request-Id")))
+    if config["latence"]:
+        time.sleep(config["latence"])
+    if failing and endpoint not in ("approve", "stats"):
+        return error(503, "SERVICE_UNAVAILABLE", "Panne simulée")
+    if endpoint not in ("token", "approve", "stats"):
+        authorization = request.headers.get("Authorization", "")
+        if not authorization.startswith("Bearer "):
+            return error(401, "AUTHENTICATION_FAILURE", "Jeton absent")
+        if authorization[len("Bearer "):] not in tokens:
+            return error(401, "AUTHENTICATION_FAILURE", "Jeton invalide ou révoqué")
+    return None
+
+
+def idempotent(handler):
+    """Renvoie la réponse déjà produite pour un PayPal-Request-Id connu."""
+    def wrapper(*args, **kwargs):
+        request_id = request.headers.get("PayPal-Request-Id")
+        key = (request.path, request_id)
+        with lock:
+            if request_id and key in idempotent_responses:
+                body, status = idempotent_responses[key]
+                return jsonify(body), status
+        body, status = handler(*args, **kwargs)
+        if request_id and status < 400:
+            with lock:
+                idempotent_responses[key] = (body, status)
+        return jsonify(body), status
+    wrapper.__name__ = handler.__name__
+    return wrapper
+
+
+@app.route("/v1/oauth2/token", methods=["POST"])
+def token():
+    if not request.authorization:
+        return error(401, "invalid_client", "Identifiants absents")
+    access_token = "STUB-" + uuid.uuid4().hex
+    with lock:
+        tokens.add(access_token)
+    return jsonify({"access_token": access_token, "token_type": "Bearer", "expires_in": config["expires_in"]})
+
+
+@app.route("/v2/checkout/orders", methods=["POST"])
+@idempotent
+def create_order():
+    body = request.get_json(force=True)
+    order_id = uuid.uuid4().hex[:17].upper()
+    order = {
+        "id": order_id,
+        "status": "CREATED",
+        "purchase_units": body.get("purchase_units", []),
+        "application_context": body.get("application_context", {}),
+        "links": [
+            {"rel": "self", "href": f"{request.host_url}v2/checkout/orders/{order_id}", "method": "GET"},
+            {"rel": "approve", "href": f"{request.host_url}checkoutnow?token={order_id}", "method": "GET"},
+        ],
+    }
+    with lock:
+        orders[order_id] = order
+    return {k: order[k] for k in ("id", "status", "links")}, 201
+
+
+@app.route("/checkoutnow")
+def approve():
+    order = orders.get(request.args.get("token", ""))
+    if order is None:
+        return "Ordre inconnu", 404
+    context = order["application_context"]
+    if request.args.get("annuler"):
+        return redirect(context.get("cancel_url", "/"))
+    with lock:
+        if order["status"] == "CREATED":
+            order["status"] = "APPROVED"
+    return redirect(f"{context.get('return_url', '/')}?token={order['id']}&PayerID=STUBPAYER")
+
+
+@app.route("/v2/checkout/orders/<order_id>", methods=["GET"])
+def get_order(order_id):
+    order = orders.get(order_id)
+    if order is None:
+        return error(404, "RESOURCE_NOT_FOUND", "Ordre inconnu")
+    return jsonify({k: order[k] for k in ("id", "status", "purchase_units", "links")})
+
+
+@app.route("/v2/checkout/orders/<order_id>/capture", methods=["POST"])
+@idempotent
+def capture(order_id):
+    with lock:
+        order = orders.get(order_id)
+        if order is None:
+            return {"name": "RESOURCE_NOT_FOUND"}, 404
+        if order["status"] == "COMPLETED":
+            return {"name": "UNPROCESSABLE_ENTITY", "details": [{"issue": "ORDER_ALREADY_CAPTURED"}]}, 422
+        if order["status"] != "APPROVED":
+            return {"name": "UNPROCESSABLE_ENTITY", "details": [{"issue": "ORDER_NOT_APPROVED"}]}, 422
+        order["status"] = "COMPLETED"
+    return {"id": order_id, "status": "COMPLETED"}, 201
+
+
+@app.route("/stub/stats")
+def stats():
+    """Nombre d'appels par point d'entrée (ex. pour vérifier le cache du jeton)."""
+    return jsonify(dict(calls))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latence", type=float, default=0.0)
+    parser.add_argument("--echecs", type=int, default=0)
+    args = parser.parse_args()
+    config["latence"] = args.latence
+    config["echecs"] = args.echecs
+    app.run(host="127.0.0.1", port=args.port, threaded=True)
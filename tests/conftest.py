@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Environnement des tests : données et licence dans un dossier temporaire.
+
+main.py crée ses dossiers, sa base et les fichiers de licence à l'import :
+AHABIA_DATA_DIR et HOME sont redirigés avant que les tests ne l'importent.
+"""
+import os
+import sys
+import tempfile
+import threading
+
+import pytest
+from werkzeug.serving import make_server
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_DIR = tempfile.mkdtemp(prefix="ahabia_tests_")
+os.environ["AHABIA_DATA_DIR"] = os.path.join(TEST_DIR, "AHABIAFILES")
+os.environ["HOME"] = os.environ["APPDATA"] = os.path.join(TEST_DIR, "home")
+os.makedirs(os.environ["HOME"], exist_ok=True)
+sys.path.insert(0, ROOT_DIR)
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """main avec une base vide propre au test."""
+    import main
+    monkeypatch.setattr(main, "DB_FILE", str(tmp_path / "enregistrements.db"))
+    monkeypatch.setattr(main, "EXCEL_FILE", str(tmp_path / "enregistrements.xlsx"))
+    main.invalidate_bons_cache()
+    main._bons_count_cache.update(version=None, counts={})
+    main.init_db()
+    return main
+
+
+@pytest.fixture(scope="session")
+def stub_url():
+    """URL du serveur PayPal local (paypal_stub.py) lancé dans un thread."""
+    import paypal_stub
+    server = make_server("127.0.0.1", 0, paypal_stub.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def bon(date="01/09/2024", agriculteur="Alami Said", parcelle="P1", produit="Orange", variete="Navel",
+        cueilleurs=10, indirect=2, autres=1, caporaux=1, poids=500.0, ecarts=20.0):
+    """Bon de livraison indexé par les en-têtes, comme le formulaire de saisie."""
+    return {
+        "Numéro Bon": "", "Date (JJ/MM/AAAA)": date, "Agriculteur": agriculteur, "Parcelle": parcelle,
+        "Produit": produit, "Variété": variete, "Nb Ouvriers Cueilleurs": cueilleurs,
+        "Nb Ouvriers Indirect": indirect, "Nb Ouvriers Autres": autres,
+        "Total Ouvriers": cueilleurs + indirect + autres, "Nombre Caporaux": caporaux,
+        "Poids Total Cueillis (kg)": poids, "Écarts (Produit Déchet) en kg": ecarts,
+        "Poids Global": poids + ecarts
+    }
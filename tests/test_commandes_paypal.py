@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""Commandes PayPal en attente : table commandes_paypal partagée par les workers, avec expiration."""
+import pytest
+import requests
+
+import paypal_stub
+
+
+def test_order_remembered_until_ttl(db):
+    db.remember_purchase_order("ORDRE1", "1 an")
+    assert db.get_purchase_order("ORDRE1") == {"plan": "1 an", "statut": "en_attente"}
+    assert db.get_purchase_order("INCONNU") is None
+
+
+def test_expired_order_ignored_then_purged(db, monkeypatch):
+    db.remember_purchase_order("VALIDE", "1 an")
+    monkeypatch.setattr(db, "PAYPAL_ORDER_TTL", -1)
+    db.remember_purchase_order("EXPIRE", "illimité")
+    assert db.get_purchase_order("EXPIRE") is None
+    assert db.purge_expired_purchase_orders() == 1
+    with db.db_connection() as conn:
+        assert [r["order_id"] for r in conn.execute("SELECT order_id FROM commandes_paypal")] == ["VALIDE"]
+
+
+def test_capture_marked_once(db):
+    db.remember_purchase_order("ORDRE1", "illimité")
+    assert db.mark_purchase_captured("ORDRE1") is True
+    assert db.mark_purchase_captured("ORDRE1") is False
+    assert db.get_purchase_order("ORDRE1")["statut"] == "capturee"
+
+
+@pytest.fixture
+def shop(db, stub_url, monkeypatch):
+    """Application branchée sur le serveur PayPal local ; renvoie les plans activés."""
+    paypal_stub.reset()
+    monkeypatch.setattr(db, "paypal_client", db.PaypalClient("id", "secret", base_url=stub_url))
+    monkeypatch.setattr(db, "check_activation", lambda: True)
+    monkeypatch.setattr(db, "check_trial_period", lambda: True)
+    activated = []
+    monkeypatch.setattr(db, "update_activation_after_payment", activated.append)
+    return activated
+
+
+def test_replayed_paypal_return_activates_once(db, shop):
+    client = db.app.test_client()
+    response = client.get("/purchase_plan/1 an")
+    assert response.status_code == 302
+    # L'acheteur approuve sur la page PayPal, qui le renvoie vers return_url
+    approval = requests.get(response.headers["Location"], allow_redirects=False)
+    order_id = approval.headers["Location"].split("token=")[1].split("&")[0]
+    assert db.get_purchase_order(order_id) == {"plan": "1 an", "statut": "en_attente"}
+
+    for _ in range(3):
+        response = client.get(f"/paypal_success?token={order_id}")
+        assert response.status_code == 302
+    assert shop == ["1 an"]
+    assert db.get_purchase_order(order_id)["statut"] == "capturee"
+    assert paypal_stub.orders[order_id]["status"] == "COMPLETED"
+
+
+def test_unknown_order_does_not_activate(db, shop):
+    client = db.app.test_client()
+    client.get("/paypal_success?token=INCONNU")
+    assert shop == []
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""Compteurs UPSERT des numéros de bons et de rapports."""
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+
+def today():
+    return datetime.datetime.now().strftime("%d%m%Y")
+
+
+def test_reserve_sequence_returns_consecutive_blocks(db):
+    assert db.reserve_sequence("test") == 1
+    assert db.reserve_sequence("test", 5) == 2
+    assert db.reserve_sequence("test") == 7
+    assert db.reserve_sequence("autre") == 1
+
+
+def test_concurrent_reservations_never_overlap(db):
+    def reserve(_):
+        first = db.reserve_sequence("test", 3)
+        return list(range(first, first + 3))
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        blocks = list(pool.map(reserve, range(40)))
+    values = [v for block in blocks for v in block]
+    assert sorted(values) == list(range(1, 121))
+
+
+def test_voucher_numbers_follow_daily_counter(db):
+    nums = db.generate_voucher_numbers(["Alami Said", "Bennani Ali"])
+    assert nums == ["BL" + today() + "ALSA01", "BL" + today() + "BEAL02"]
+    assert db.generate_voucher_number("Alami Said") == "BL" + today() + "ALSA03"
+
+
+def test_voucher_counter_seeded_from_legacy_file(db, tmp_path, monkeypatch):
+    voucher_file = tmp_path / "last_voucher.txt"
+    voucher_file.write_text("BL" + today() + "ALSA07", encoding="utf-8")
+    monkeypatch.setattr(db, "VOUCHER_FILE", str(voucher_file))
+    db.seed_voucher_counter()
+    db.seed_voucher_counter()
+    assert db.generate_voucher_number("Alami Said") == "BL" + today() + "ALSA08"
+
+
+def test_report_counter_seeded_from_history(db):
+    with db.db_connection() as conn:
+        conn.execute("INSERT INTO historique_rapports (numero, type) VALUES (?, 'Stats')",
+                     ("R" + today() + "ALSA04",))
+    db.seed_report_counter()
+    assert db.generate_report_number("Alami Said") == "R" + today() + "ALSA05"
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""Export en masse des PDF de bons : document final et nettoyage de PDF_EXPORT_DIR."""
+import os
+import time
+import zipfile
+
+import pytest
+
+from conftest import bon
+
+
+@pytest.fixture
+def export_dir(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "PDF_EXPORT_DIR", str(tmp_path / "PDF_Export"))
+    monkeypatch.setattr(db, "EXPORT_PDF_WORKERS", 1)
+    os.makedirs(db.PDF_EXPORT_DIR)
+    for n in range(3):
+        db.insert_bon(bon(agriculteur=f"Agriculteur{n} Test"))
+    return db.PDF_EXPORT_DIR
+
+
+def test_zip_export_leaves_only_the_archive(db, export_dir):
+    pytest.importorskip("reportlab")
+    out_path = db._job_export_bons_pdf("a" * 32, {"format": "zip", "fruit": "Orange"})
+    assert os.listdir(export_dir) == [os.path.basename(out_path)]
+    assert len(zipfile.ZipFile(out_path).namelist()) == 3
+
+
+def test_failed_render_removes_work_dir(db, export_dir, monkeypatch):
+    rendered = []
+
+    def failing_render(data, pdf_path):
+        if rendered:
+            raise RuntimeError("police introuvable")
+        rendered.append(pdf_path)
+        with open(pdf_path, "wb") as f:
+            f.write(b"%PDF")
+        return pdf_path
+
+    monkeypatch.setattr(db, "_render_delivery_pdf", failing_render)
+    with pytest.raises(RuntimeError):
+        db._job_export_bons_pdf("b" * 32, {"format": "zip", "fruit": "Orange"})
+    assert os.listdir(export_dir) == []
+
+
+def test_old_exports_pruned(db, export_dir):
+    old_file = os.path.join(export_dir, "bons_20240101000000_aaaaaaaa.zip")
+    old_dir = os.path.join(export_dir, "bons_bbbbbbbb_abandonne")
+    recent_file = os.path.join(export_dir, "bons_20240102000000_cccccccc.zip")
+    os.makedirs(old_dir)
+    for path in (old_file, recent_file, os.path.join(old_dir, "0001_BL.pdf")):
+        with open(path, "wb") as f:
+            f.write(b"x")
+    expired = time.time() - db.PDF_EXPORT_TTL - 60
+    for path in (old_file, old_dir):
+        os.utime(path, (expired, expired))
+    db.prune_export_files()
+    assert os.listdir(export_dir) == [os.path.basename(recent_file)]
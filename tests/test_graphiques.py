@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""Cache des graphiques de /stats."""
+import pytest
+
+
+@pytest.fixture
+def charts(db, tmp_path, monkeypatch):
+    pytest.importorskip("matplotlib")
+    monkeypatch.setattr(db, "CHART_WORKERS", 1)
+    monkeypatch.setattr(db, "CHART_CACHE_DIR", str(tmp_path))
+    db._chart_cache.clear()
+    db._chart_cache_state["version"] = None
+    return db
+
+
+def jobs(db, values):
+    return {
+        "histogramme": (("h",), db.render_bar_chart, (["A", "B"], values, "Agriculteur", "Poids", "#ff8800")),
+        "camembert": (("c",), db.render_pie_chart, (["A", "B"], values, "Agriculteur")),
+    }
+
+
+def test_charts_cached_per_data_version(charts):
+    first = charts.render_charts(1, jobs(charts, [3, 5]))
+    assert first["histogramme"][1].startswith(b"\x89PNG")
+    hits = charts.chart_cache_stats["hits"]
+    assert charts.render_charts(1, jobs(charts, [3, 5])) == first
+    assert charts.chart_cache_stats["hits"] == hits + 2
+    assert charts.get_chart_png(first["histogramme"][0]) == first["histogramme"][1]
+
+
+def test_empty_pie_chart_cached_as_missing(charts):
+    first = charts.render_charts(1, jobs(charts, [0, 0]))
+    key, png = first["camembert"]
+    assert png is None
+    hits = charts.chart_cache_stats["hits"]
+    again = charts.render_charts(1, jobs(charts, [0, 0]))
+    assert again["camembert"] == (key, None)
+    assert charts.chart_cache_stats["hits"] == hits + 2
+    assert charts.get_chart_png(key) is None
+
+
+def test_failed_render_not_cached(charts, monkeypatch):
+    calls = []
+    render_bar_chart = charts.render_bar_chart
+
+    def flaky_bar_chart(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise RuntimeError("police introuvable")
+        return render_bar_chart(*args)
+
+    monkeypatch.setattr(charts, "render_bar_chart", flaky_bar_chart)
+    key, png = charts.render_charts(1, jobs(charts, [3, 5]))["histogramme"]
+    assert png is None
+    assert key not in charts._chart_cache
+    # Affichage suivant : le graphique est redessiné, puis mis en cache
+    assert charts.render_charts(1, jobs(charts, [3, 5]))["histogramme"][1].startswith(b"\x89PNG")
+    assert len(calls) == 2
+    assert charts.get_chart_png(key).startswith(b"\x89PNG")
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""Import en masse des bons (CSV / JSON) par /import_bons."""
+import io
+
+import pytest
+
+from conftest import bon
+
+
+@pytest.fixture
+def client(db, monkeypatch):
+    monkeypatch.setattr(db, "check_activation", lambda: True)
+    monkeypatch.setattr(db, "check_trial_period", lambda: True)
+    return db.app.test_client()
+
+
+def upload(client, content, name="bons.csv"):
+    return client.post("/import_bons", data={"fichier": (io.BytesIO(content), name)}, follow_redirects=True)
+
+
+def test_exported_csv_imports_back(db, client):
+    db.insert_bon(dict(bon(), **{"Numéro Bon": "BL01092024ALSA01"}))
+    db.insert_bon(bon(date="02/09/2024", agriculteur="Bennani Ali", poids=312.5))
+    exported = client.get("/export").data
+    upload(client, exported)
+    assert db.count_bons() == 4
+    numbers = {row["Numéro Bon"] for row in db.fetch_bons_page(limit=10)}
+    # Les bons importés reçoivent de nouveaux numéros
+    assert len(numbers) == 4
+
+
+def test_import_is_all_or_nothing(db, client):
+    csv_text = "Date (JJ/MM/AAAA);Agriculteur\n01/09/2024;Alami Said\n31/02/2024;Bennani Ali\n"
+    response = upload(client, csv_text.encode("utf-8"))
+    assert "date invalide" in response.get_data(as_text=True)
+    assert db.count_bons() == 0
+
+
+def test_json_import(db, client):
+    response = client.post("/import_bons", json=[
+        {"Date (JJ/MM/AAAA)": "01/09/2024", "Agriculteur": "Alami Said", "Poids Total Cueillis (kg)": "12,5"}
+    ])
+    assert response.status_code == 200
+    assert response.get_json()["importes"] == 1
+    assert db.fetch_bons_page(limit=1)[0]["Poids Global"] == 12.5
+
+
+def test_file_content_escaped_in_error_message(db, client):
+    evil = 'Date (JJ/MM/AAAA);Agriculteur;X"</script><img src=x onerror=alert(1)>\n01/09/2024;A;x\n'
+    html = upload(client, evil.encode("utf-8")).get_data(as_text=True)
+    assert "</script><img" not in html
+    assert "onerror=alert(1)\\u0026gt;" in html
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""PaypalClient contre le serveur local paypal_stub.py (aucun accès réseau)."""
+import time
+
+import pytest
+
+import main
+import paypal_stub
+
+
+@pytest.fixture
+def client(stub_url):
+    paypal_stub.reset()
+    sleeps = []
+    client = main.PaypalClient("id", "secret", base_url=stub_url, backoff=0.5, sleep=sleeps.append)
+    client.sleeps = sleeps
+    return client
+
+
+def approved_order(client):
+    order_id, approval_url = client.create_order("10.00", "EUR", "http://retour/ok", "http://retour/annule")
+    client.session.get(approval_url, allow_redirects=False)
+    return order_id
+
+
+def test_token_reused_until_expiry(client):
+    paypal_stub.config["expires_in"] = client.TOKEN_MARGIN + 3600
+    first = client.access_token()
+    client.get_order(client.create_order("10.00", "EUR", "http://r/ok", "http://r/ko")[0])
+    assert client.access_token() == first
+    assert paypal_stub.calls["token"] == 1
+    # Jeton arrivé à TOKEN_MARGIN de son expiration : renouvelé
+    client._token_expiry = time.monotonic() - 1
+    assert client.access_token() != first
+    assert paypal_stub.calls["token"] == 2
+
+
+def test_revoked_token_renewed_once(client):
+    order_id, _ = client.create_order("10.00", "EUR", "http://r/ok", "http://r/ko")
+    paypal_stub.tokens.clear()
+    assert client.get_order(order_id)["id"] == order_id
+    assert paypal_stub.calls["token"] == 2
+    assert paypal_stub.calls["get_order"] == 2
+
+
+def test_persistent_401_is_not_retried_forever(client, monkeypatch):
+    order_id, _ = client.create_order("10.00", "EUR", "http://r/ok", "http://r/ko")
+    # Le serveur n'accepte plus aucun jeton, même fraîchement délivré
+    monkeypatch.setattr(paypal_stub, "tokens", type("Refus", (set,), {"add": lambda self, token: None})())
+    with pytest.raises(main.PaypalError):
+        client.get_order(order_id)
+    assert paypal_stub.calls["get_order"] == 2
+
+
+def test_503_retried_with_backoff(client):
+    client.access_token()
+    paypal_stub.config["echecs"] = 2
+    order_id, approval_url = client.create_order("10.00", "EUR", "http://r/ok", "http://r/ko")
+    assert order_id and approval_url
+    assert paypal_stub.calls["create_order"] == 3
+    assert client.sleeps == [0.5, 1.0]
+
+
+def test_retries_stop_at_max_retries(client):
+    client.access_token()
+    paypal_stub.config["echecs"] = 100
+    with pytest.raises(main.PaypalError):
+        client.create_order("10.00", "EUR", "http://r/ok", "http://r/ko")
+    assert paypal_stub.calls["create_order"] == client.max_retries + 1
+
+
+def test_replayed_capture_reuses_request_id(client):
+    order_id = approved_order(client)
+    assert client.capture_order(order_id) is True
+    assert client.capture_order(order_id) is True
+    captures = [request_id for endpoint, request_id in paypal_stub.journal if endpoint == "capture"]
+    assert captures == [f"capture-{order_id}"] * 2
+    assert paypal_stub.orders[order_id]["status"] == "COMPLETED"
+
+
+def test_capture_retried_after_503_keeps_request_id(client):
+    order_id = approved_order(client)
+    paypal_stub.config["echecs"] = 1
+    assert client.capture_order(order_id) is True
+    captures = [request_id for endpoint, request_id in paypal_stub.journal if endpoint == "capture"]
+    assert captures == [f"capture-{order_id}"] * 2
+
+
+def test_total_timeout_bounds_the_call(stub_url):
+    paypal_stub.reset()
+    paypal_stub.config["latence"] = 1.0
+    client = main.PaypalClient("id", "secret", base_url=stub_url, timeout=(0.5, 0.5),
+                               max_retries=5, backoff=0.1, total_timeout=1.5)
+    started = time.monotonic()
+    with pytest.raises(main.PaypalError):
+        client.get_order("INCONNU")
+    assert time.monotonic() - started < 2.5
+    paypal_stub.reset()
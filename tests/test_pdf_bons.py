@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""PDF de bon de livraison nommé d'après son contenu : régénéré seulement si le bon change."""
+import os
+
+import pytest
+
+from conftest import bon
+
+
+@pytest.fixture
+def rendered(db, tmp_path, monkeypatch):
+    """Chemins des PDF réellement dessinés pendant le test."""
+    pytest.importorskip("reportlab")
+    monkeypatch.setattr(db, "PDF_LIVRAISON_DIR", str(tmp_path / "PDF_Livraison"))
+    os.makedirs(db.PDF_LIVRAISON_DIR)
+    rendered = []
+    generate = db.PDFGenerator.generate_delivery_pdf
+
+    def counting_generate(data, pdf_path):
+        rendered.append(pdf_path)
+        return generate(data, pdf_path)
+
+    monkeypatch.setattr(db.PDFGenerator, "generate_delivery_pdf", staticmethod(counting_generate))
+    return rendered
+
+
+def test_same_content_reuses_pdf(db, rendered):
+    bon_id = db.insert_bon(dict(bon(), **{"Numéro Bon": "BL01092024ALSA01"}))
+    path, digest = db.delivery_pdf_for_bon(bon_id, "Orange")
+    assert os.path.basename(path) == f"bon_de_livraison_BL01092024ALSA01_{bon_id}_{digest}.pdf"
+    assert db.delivery_pdf_for_bon(bon_id, "Orange") == (path, digest)
+    assert len(rendered) == 1
+    assert os.listdir(db.PDF_LIVRAISON_DIR) == [os.path.basename(path)]
+
+
+def test_changed_content_replaces_pdf(db, rendered):
+    bon_id = db.insert_bon(dict(bon(), **{"Numéro Bon": "BL01092024ALSA01"}))
+    old_path, old_digest = db.delivery_pdf_for_bon(bon_id, "Orange")
+    with db.db_connection() as conn:
+        conn.execute("UPDATE bon_livraison SET poids_total = 650 WHERE id = ?", (bon_id,))
+    new_path, new_digest = db.delivery_pdf_for_bon(bon_id, "Orange")
+    assert new_digest != old_digest
+    assert os.listdir(db.PDF_LIVRAISON_DIR) == [os.path.basename(new_path)]
+    # Le thème fait partie du contenu du document
+    assert db.delivery_pdf_for_bon(bon_id, "Clementine")[1] != new_digest
+
+
+def test_bons_sharing_a_number_keep_their_own_pdf(db, rendered):
+    first_id = db.insert_bon(dict(bon(), **{"Numéro Bon": "BL01092024ALSA01"}))
+    second_id = db.insert_bon(dict(bon(poids=650.0), **{"Numéro Bon": "BL01092024ALSA01"}))
+    first_path, _ = db.delivery_pdf_for_bon(first_id, "Orange")
+    second_path, _ = db.delivery_pdf_for_bon(second_id, "Orange")
+    assert first_path != second_path
+    assert sorted(os.listdir(db.PDF_LIVRAISON_DIR)) == sorted(map(os.path.basename, (first_path, second_path)))
+
+
+def test_unknown_bon(db, rendered):
+    assert db.delivery_pdf_for_bon(999, "Orange") is None
+
+
+def test_download_uses_digest_as_etag(db, rendered, monkeypatch):
+    monkeypatch.setattr(db, "check_activation", lambda: True)
+    monkeypatch.setattr(db, "check_trial_period", lambda: True)
+    bon_id = db.insert_bon(bon())
+    client = db.app.test_client()
+    first = client.get(f"/generer_pdf_bon/{bon_id}")
+    assert first.status_code == 200
+    assert first.data.startswith(b"%PDF")
+    etag = first.headers["ETag"]
+    again = client.get(f"/generer_pdf_bon/{bon_id}", headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert len(rendered) == 1
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""Index plein texte bon_recherche tenu à jour par les triggers de bon_livraison."""
+import pytest
+
+from conftest import bon
+
+
+@pytest.fixture
+def fts_db(db):
+    if not db.search_state["fts"]:
+        pytest.skip("SQLite compilé sans FTS5")
+    return db
+
+
+def found(db, search):
+    return sorted(row["Agriculteur"] for row in db.fetch_bons_page(search, limit=500))
+
+
+def test_insert_trigger_indexes_new_bons(fts_db):
+    fts_db.insert_bon(bon(agriculteur="Ennajihi Karim", variete="Maroc Late"))
+    fts_db.insert_bon(bon(agriculteur="Alami Said", variete="Navel"))
+    assert found(fts_db, "ennaj") == ["Ennajihi Karim"]
+    assert found(fts_db, "variete:maroc") == ["Ennajihi Karim"]
+    assert found(fts_db, "navel alami") == ["Alami Said"]
+    assert fts_db.count_bons("orange") == 2
+
+
+def test_search_ignores_accents_and_case(fts_db):
+    fts_db.insert_bon(bon(agriculteur="Chraibi Omar", produit="Clémentine"))
+    assert found(fts_db, "CLEMENTINE") == ["Chraibi Omar"]
+    assert found(fts_db, "produit:clém") == ["Chraibi Omar"]
+
+
+def test_delete_trigger_removes_bons(fts_db):
+    bon_id = fts_db.insert_bon(bon(agriculteur="Ennajihi Karim"))
+    fts_db.insert_bon(bon(agriculteur="Alami Said"))
+    fts_db.delete_bon(bon_id)
+    assert found(fts_db, "ennajihi") == []
+    assert fts_db.count_bons("ennajihi") == 0
+    assert found(fts_db, "orange") == ["Alami Said"]
+
+
+def test_update_trigger_reindexes_bons(fts_db):
+    bon_id = fts_db.insert_bon(bon(agriculteur="Ennajihi Karim"))
+    with fts_db.db_connection() as conn:
+        conn.execute("UPDATE bon_livraison SET agriculteur = 'Bennani Ali' WHERE id = ?", (bon_id,))
+    assert found(fts_db, "ennajihi") == []
+    assert found(fts_db, "bennani") == ["Bennani Ali"]
+
+
+def test_index_matches_table_after_changes(fts_db):
+    ids = [fts_db.insert_bon(bon(agriculteur=f"Agriculteur{n} Test")) for n in range(20)]
+    for bon_id in ids[::2]:
+        fts_db.delete_bon(bon_id)
+    with fts_db.db_connection() as conn:
+        # Vérification d'intégrité FTS5 : l'index correspond au contenu de bon_livraison
+        conn.execute("INSERT INTO bon_recherche (bon_recherche, rank) VALUES ('integrity-check', 1)")
+    assert fts_db.count_bons("test") == 10
+
+
+def test_existing_bons_indexed_once(fts_db):
+    with fts_db.db_connection() as conn:
+        conn.execute("DROP TRIGGER bon_recherche_ai")
+    fts_db.insert_bon(bon(agriculteur="Ennajihi Karim"))
+    fts_db.init_db()
+    fts_db.ensure_search_index()
+    assert found(fts_db, "ennajihi") == ["Ennajihi Karim"]
+
+
+def test_like_fallback_gives_same_results(fts_db, monkeypatch):
+    fts_db.insert_bon(bon(agriculteur="Ennajihi Karim", variete="Maroc Late"))
+    fts_db.insert_bon(bon(agriculteur="Alami Said"))
+    with_fts = found(fts_db, "agriculteur:ennajihi maroc")
+    monkeypatch.setitem(fts_db.search_state, "fts", False)
+    assert found(fts_db, "agriculteur:ennajihi maroc") == with_fts == ["Ennajihi Karim"]
+
+
+def test_like_wildcards_are_literal(db, monkeypatch):
+    monkeypatch.setitem(db.search_state, "fts", False)
+    db.insert_bon(bon(agriculteur="Alami Said", parcelle="P_50%"))
+    db.insert_bon(bon(agriculteur="Bennani Ali", parcelle="P2"))
+    assert found(db, "%") == found(db, "_") == ["Alami Said"]
+    assert found(db, "parcelle:p_5") == ["Alami Said"]
+    assert found(db, "parcelle:p%2") == []
+    assert [row["Agriculteur"] for row in db.fetch_bons_filtered({"agriculteur": "_"})] == []
+    with db.db_connection() as conn:
+        conn.execute("INSERT INTO historique_rapports (numero, type) VALUES ('R01092024ALSA01', 'Stats')")
+    assert db.count_report_history("%") == db.count_report_history("a_s") == 0
+    assert db.count_report_history("alsa") == 1
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""Les agrégats rollup_recolte doivent donner les mêmes sommes qu'un groupby pandas sur les bons."""
+import random
+
+import pytest
+
+from conftest import bon
+
+LABELS = ["Agriculteur", "Parcelle", "Produit", "Variété", "Date (JJ/MM/AAAA)", "Mois", "Annee"]
+METRICS = ["Poids Total Cueillis (kg)", "Poids Global", "Total Ouvriers", "Nombre Caporaux"]
+PERIODS = [(None, None), ("2024-02-01", "2024-06-30"), ("2024-03-15", None)]
+
+
+def random_bons(count, seed=42):
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(count):
+        rows.append(bon(
+            date="{:02d}/{:02d}/{}".format(rng.randint(1, 28), rng.randint(1, 12), rng.choice([2023, 2024])),
+            agriculteur=rng.choice(["Alami Said", "Bennani Ali", "Chraibi Omar"]),
+            parcelle=rng.choice(["P1", "P2", ""]),
+            produit=rng.choice(["Orange", "Clémentine"]),
+            variete=rng.choice(["Navel", "Nour", "Maroc Late"]),
+            cueilleurs=rng.randint(0, 30), indirect=rng.randint(0, 5), autres=rng.randint(0, 3),
+            caporaux=rng.randint(0, 3), poids=round(rng.uniform(0, 900), 2), ecarts=round(rng.uniform(0, 50), 2)
+        ))
+    # Date illisible : comptée dans les totaux par dimension, exclue des périodes
+    rows.append(bon(date="", agriculteur="Alami Said", poids=111.0))
+    return rows
+
+
+def pandas_sums(db, label, metric, start_iso, end_iso):
+    import pandas as pd
+    df = db._build_bons_dataframe()
+    if start_iso:
+        df = df[df["Date"] >= pd.Timestamp(start_iso)]
+    if end_iso:
+        df = df[df["Date"] <= pd.Timestamp(end_iso)]
+    grouped = df.groupby(label)[metric].sum()
+    return {str(int(k) if isinstance(k, float) else k): v for k, v in grouped.items()}
+
+
+def rollup_sums(db, label, metric, start_iso, end_iso):
+    df = db.query_rollup(label, metric, start_iso, end_iso)
+    return {str(k): v for k, v in zip(df[label], df[metric])}
+
+
+def assert_rollups_match(db):
+    for label in LABELS:
+        for metric in METRICS:
+            for start_iso, end_iso in PERIODS:
+                expected = pandas_sums(db, label, metric, start_iso, end_iso)
+                got = rollup_sums(db, label, metric, start_iso, end_iso)
+                assert got.keys() == expected.keys(), (label, metric, start_iso, end_iso)
+                for key, value in expected.items():
+                    assert got[key] == pytest.approx(value), (label, metric, start_iso, end_iso, key)
+
+
+def rollup_table(db):
+    with db.db_connection() as conn:
+        rows = conn.execute("SELECT * FROM rollup_recolte ORDER BY granularite, dimension, periode, date_saisie, valeur")
+        return [tuple(round(v, 6) if isinstance(v, float) else v for v in row) for row in rows]
+
+
+def test_incremental_rollups_match_pandas(db):
+    ids = [db.insert_bon(row) for row in random_bons(120)]
+    assert_rollups_match(db)
+    for bon_id in ids[::3]:
+        db.delete_bon(bon_id)
+    assert_rollups_match(db)
+
+
+def test_bulk_import_updates_rollups(db):
+    nums, errors = db.import_bons(random_bons(30, seed=7)[:-1])
+    assert not errors and len(nums) == 30
+    assert_rollups_match(db)
+
+
+def test_rebuild_matches_incremental_maintenance(db):
+    ids = [db.insert_bon(row) for row in random_bons(60, seed=3)]
+    for bon_id in ids[::4]:
+        db.delete_bon(bon_id)
+    incremental = rollup_table(db)
+    with db.db_connection() as conn:
+        db.rebuild_rollups(conn)
+    assert rollup_table(db) == incremental
+
+
+def test_deleting_every_bon_empties_rollups(db):
+    ids = [db.insert_bon(row) for row in random_bons(10, seed=5)]
+    for bon_id in ids:
+        db.delete_bon(bon_id)
+    assert rollup_table(db) == []
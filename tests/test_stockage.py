@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Base SQLite des bons : migration du classeur Excel et réglages de durabilité."""
+from openpyxl import Workbook
+
+from conftest import bon
+
+
+def write_legacy_workbook(path, bons_rows, history_rows):
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "BonLivraison"
+    headers = list(bons_rows[0])
+    ws.append(headers)
+    for row in bons_rows:
+        ws.append([row[h] for h in headers])
+    hist = wb.create_sheet("HistoriqueRapports")
+    hist.append(["N°", "Type", "Date", "Chemin"])
+    for row in history_rows:
+        hist.append(row)
+    wb.save(path)
+
+
+def test_connection_is_durable(db):
+    with db.db_connection() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        # 2 = FULL : chaque COMMIT est synchronisé sur disque
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 2
+
+
+def test_excel_migrated_once(db):
+    rows = [bon(agriculteur="Alami Said"), bon(date="02/09/2024", agriculteur="Bennani Ali", poids=300.0)]
+    rows[0]["Numéro Bon"] = "BL01092024ALSA01"
+    write_legacy_workbook(db.EXCEL_FILE, rows, [[1, "Stats", "01/09/2024 10:00:00", "/tmp/r.pdf"]])
+
+    assert db.migrate_excel_to_sqlite() == 2
+    assert db.migrate_excel_to_sqlite() == 0
+    with db.db_connection() as conn:
+        bons_rows = conn.execute("SELECT num_bon, date_iso, agriculteur, poids_total FROM bon_livraison ORDER BY id").fetchall()
+        history = conn.execute("SELECT type, date, chemin FROM historique_rapports").fetchall()
+    assert [tuple(r) for r in bons_rows] == [
+        ("BL01092024ALSA01", "2024-09-01", "Alami Said", 500.0),
+        ("", "2024-09-02", "Bennani Ali", 300.0),
+    ]
+    assert [tuple(r) for r in history] == [("Stats", "01/09/2024 10:00:00", "/tmp/r.pdf")]
+
+
+def test_migration_without_workbook_marks_done(db):
+    assert db.migrate_excel_to_sqlite() == 0
+    with db.db_connection() as conn:
+        assert conn.execute("SELECT 1 FROM meta WHERE cle = 'excel_migre'").fetchone()
+
+
+def test_insert_and_delete_bump_data_version(db):
+    version = db.get_data_version()
+    bon_id = db.insert_bon(bon())
+    assert db.get_data_version() == version + 1
+    assert db.fetch_bon(bon_id)["Agriculteur"] == "Alami Said"
+    assert db.delete_bon(bon_id) is True
+    assert db.get_data_version() == version + 2
+    assert db.delete_bon(bon_id) is False
+    assert db.get_data_version() == version + 2
+
+
+def test_dataframe_cache_follows_data_version(db):
+    db.insert_bon(bon())
+    first = db.get_bons_dataframe()
+    assert db.get_bons_dataframe() is first
+    db.insert_bon(bon(agriculteur="Bennani Ali"))
+    second = db.get_bons_dataframe()
+    assert second is not first
+    assert len(second) == 2
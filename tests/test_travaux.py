@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""Table travaux : cycle de vie d'un travail et reprise des travaux orphelins."""
+import datetime
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+
+def wait_for(db, job_id, timeout=10):
+    limit = time.monotonic() + timeout
+    while time.monotonic() < limit:
+        job = db.get_job(job_id)
+        if job["statut"] in ("termine", "echec"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"travail {job_id} non terminé")
+
+
+def insert_job(db, statut, owner):
+    now = datetime.datetime.now().isoformat()
+    job_id = f"{statut}-{owner}"
+    with db.db_connection() as conn:
+        conn.execute(
+            "INSERT INTO travaux (id, type, statut, parametres, proprietaire, cree_le, maj_le) "
+            "VALUES (?, 'test', ?, '{}', ?, ?, ?)",
+            (job_id, statut, owner, now, now)
+        )
+    return job_id
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_job_runs_and_records_result(db, tmp_path, monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+
+    def handler(job_id, params):
+        db.update_job_progress(job_id, 1, 2)
+        started.set()
+        release.wait(5)
+        path = tmp_path / params["nom"]
+        path.write_text("ok")
+        return str(path)
+
+    monkeypatch.setitem(db.job_handlers, "test", handler)
+    job_id = db.submit_job("test", {"nom": "resultat.txt"})
+    assert started.wait(5)
+    job = db.get_job(job_id)
+    assert (job["statut"], job["progression"], job["total"]) == ("en_cours", 1, 2)
+    assert job["proprietaire"] == db.JOB_OWNER
+    release.set()
+    job = wait_for(db, job_id)
+    assert job["statut"] == "termine"
+    assert job["chemin"] == str(tmp_path / "resultat.txt")
+
+
+def test_failing_job_keeps_error_message(db, monkeypatch):
+    def handler(job_id, params):
+        raise ValueError("Aucun bon ne correspond aux filtres.")
+
+    monkeypatch.setitem(db.job_handlers, "test", handler)
+    job = wait_for(db, db.submit_job("test", {}))
+    assert job["statut"] == "echec"
+    assert job["message"] == "Aucun bon ne correspond aux filtres."
+
+
+def test_unknown_job_type_rejected(db):
+    with pytest.raises(ValueError):
+        db.submit_job("inconnu", {})
+
+
+def test_orphaned_jobs_marked_failed(db):
+    host = platform.node()
+    orphans = [
+        insert_job(db, "en_cours", f"{host}:{dead_pid()}"),
+        insert_job(db, "en_attente", f"autre-machine:{os.getpid()}"),
+        insert_job(db, "en_cours", ""),
+    ]
+    alive = insert_job(db, "en_cours", f"{host}:{os.getppid()}")
+    finished = insert_job(db, "termine", f"{host}:{dead_pid()}")
+
+    assert db.fail_orphaned_jobs() == len(orphans)
+    for job_id in orphans:
+        job = db.get_job(job_id)
+        assert job["statut"] == "echec"
+        assert job["message"] == "Interrompu par un redémarrage du serveur"
+    assert db.get_job(alive)["statut"] == "en_cours"
+    assert db.get_job(finished)["statut"] == "termine"
+    assert db.fail_orphaned_jobs() == 0